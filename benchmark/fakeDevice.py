@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+############################################################################
+#
+#    Fake CLI device for benchmarks
+#
+#    Asks for a password, then answers every command line with a fixed
+#    amount of output after a fixed delay. Configured through environment
+#    variables so it can stand in for ssh (see relexBench.py):
+#        FAKEDEV_PROMPT   prompt string (default "fake#")
+#        FAKEDEV_LATENCY  seconds to wait before answering (default 0)
+#        FAKEDEV_SIZE     bytes of output per command (default 64)
+#        FAKEDEV_LINE     text of the output lines (default "xxx...")
+#
+############################################################################
+
+import os
+import sys
+import time
+
+
+def payload(size, text=b"x" * 62):
+    """Build size bytes of CRLF terminated text lines."""
+    line = text + b"\r\n"
+    data = line * (size // len(line) + 1)
+    return data[:size]
+
+
+def main():
+    prompt = os.environ.get("FAKEDEV_PROMPT", "fake#").encode() + b" "
+    latency = float(os.environ.get("FAKEDEV_LATENCY", "0"))
+    size = int(os.environ.get("FAKEDEV_SIZE", "64"))
+    text = os.environ.get("FAKEDEV_LINE")
+    output = payload(size, text.encode()) if text else payload(size)
+    out = sys.stdout.buffer
+    out.write(b"Password: ")
+    out.flush()
+    if not sys.stdin.buffer.readline():
+        return
+    while True:
+        out.write(prompt)
+        out.flush()
+        line = sys.stdin.buffer.readline()
+        if not line or line.strip() == b"exit":
+            return
+        if not line.strip():
+            continue
+        if latency:
+            time.sleep(latency)
+        out.write(output)
+
+
+if __name__ == "__main__":
+    main()
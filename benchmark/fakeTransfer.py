@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+############################################################################
+#
+#    Fake sftp server and ssh exec for file transfer benchmarks
+#
+#    Stands in for "sftp" or "ssh" (see relexBench.py), asks for a
+#    password and serves the files of a station from a local directory:
+#        python fakeTransfer.py sftp -P 22 user@10.0.0.1
+#        python fakeTransfer.py ssh -p 22 user@10.0.0.1 sha256sum -- /img
+#    Remote path /x of station 10.0.0.1 is $FAKEXFER_ROOT/10.0.0.1/x.
+#    The sftp side knows put, get (both with -a), ls -ln, rename, rm and
+#    bye; ssh only runs sha256sum.
+#        FAKEXFER_ROOT  directory of the station files
+#        FAKEXFER_CUT   end the session after copying this many bytes
+#
+############################################################################
+
+import hashlib
+import os
+import shlex
+import sys
+
+
+def parseArgs(argv):
+    """Split the command line into the target and the remote command."""
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-p", "-P", "-o"):
+            next(args)
+        elif not arg.startswith("-"):
+            return arg, list(args)
+    return None, []
+
+
+def stationPath(ip, path):
+    root = os.path.join(os.environ.get("FAKEXFER_ROOT", "/tmp"), ip)
+    return os.path.join(root, path.lstrip("/"))
+
+
+def copy(src, dst, append):
+    """Copy src to dst, resuming at the size of dst with append."""
+    cut = int(os.environ.get("FAKEXFER_CUT", "0"))
+    offset = os.path.getsize(dst) if append and os.path.exists(dst) else 0
+    with open(src, "rb") as source, open(dst, "ab" if append else "wb") as target:
+        source.seek(offset)
+        copied = 0
+        while True:
+            chunk = source.read(1 << 20)
+            if not chunk:
+                return True
+            if cut and copied + len(chunk) >= cut:
+                target.write(chunk[: cut - copied])
+                return False
+            target.write(chunk)
+            copied += len(chunk)
+
+
+def sftp(ip, out):
+    out.write("Connected to {}.\n".format(ip))
+    while True:
+        out.write("sftp> ")
+        out.flush()
+        line = sys.stdin.readline()
+        if not line:
+            return
+        args = shlex.split(line)
+        if not args:
+            continue
+        cmd = args[0]
+        flags = [arg for arg in args[1:] if arg.startswith("-")]
+        paths = [arg for arg in args[1:] if not arg.startswith("-")]
+        if cmd in ("bye", "quit", "exit"):
+            return
+        try:
+            if cmd == "put":
+                if not copy(paths[0], stationPath(ip, paths[1]), "-a" in flags):
+                    return
+            elif cmd == "get":
+                if not copy(stationPath(ip, paths[0]), paths[1], "-a" in flags):
+                    return
+            elif cmd == "ls":
+                size = os.path.getsize(stationPath(ip, paths[0]))
+                out.write(
+                    "-rw-r--r--    1 1000     1000     {:>10} Jan  1 00:00 {}\n".format(
+                        size, paths[0]
+                    )
+                )
+            elif cmd == "rename":
+                os.replace(stationPath(ip, paths[0]), stationPath(ip, paths[1]))
+            elif cmd == "rm":
+                os.remove(stationPath(ip, paths[0]))
+            else:
+                out.write("Invalid command.\n")
+        except (OSError, IndexError) as exp:
+            out.write("Couldn't {}: {}\n".format(cmd, exp))
+
+
+def sha256sum(ip, args, out):
+    path = args[-1]
+    sha = hashlib.sha256()
+    try:
+        with open(stationPath(ip, path), "rb") as src:
+            for chunk in iter(lambda: src.read(1 << 20), b""):
+                sha.update(chunk)
+    except OSError as exp:
+        out.write("sha256sum: {}: {}\n".format(path, exp.strerror))
+        return 1
+    out.write("{}  {}\n".format(sha.hexdigest(), path))
+    return 0
+
+
+def main():
+    mode = sys.argv[1]
+    target, command = parseArgs(sys.argv[2:])
+    ip = target.split("@")[-1]
+    os.makedirs(stationPath(ip, ""), exist_ok=True)
+    out = sys.stdout
+    out.write("{}'s password: ".format(target))
+    out.flush()
+    if not sys.stdin.readline():
+        return 1
+    if mode == "sftp":
+        sftp(ip, out)
+        return 0
+    args = shlex.split(" ".join(command))
+    if args[:1] != ["sha256sum"]:
+        out.write("{}: command not found\n".format(args[:1]))
+        return 127
+    return sha256sum(ip, args, out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+############################################################################
+#
+#    Benchmarks for the relex hot paths against a local fake device
+#
+#    Usage:
+#        PYTHONPATH=lib/infra python benchmark/relexBench.py -output bench.json
+#        PYTHONPATH=lib/infra python benchmark/relexBench.py -quick \
+#            -baseline bench.json
+#
+#    Results are written as JSON; with -baseline every metric is compared
+#    to the earlier run and the exit status is 1 when one regressed by
+#    more than -tolerance.
+#
+############################################################################
+
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import json
+import logging
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(benchDir), "lib", "infra"))
+
+import deviceManager
+import downStore
+import fileTransfer
+import relex
+import reportStore
+import sessionBroker
+import stationIndex
+import testCompiler
+import testLogger
+
+benchmarks = (
+    "connect",
+    "broker",
+    "command",
+    "steps",
+    "stations",
+    "summary",
+    "tee",
+    "transfer",
+)
+
+
+def benchArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-output", help="File to write the JSON results to")
+    parser.add_argument("-baseline", help="Earlier JSON results to compare with")
+    parser.add_argument(
+        "-tolerance",
+        help="Allowed slowdown against the baseline (0.25 = 25%%)",
+        type=float,
+        default=0.25,
+    )
+    parser.add_argument(
+        "-only", help="Comma separated benchmarks: " + ",".join(benchmarks)
+    )
+    parser.add_argument("-quick", help="Use 10x smaller workloads", action="store_true")
+    return parser.parse_args(sys.argv[1:])
+
+
+class benchRun:
+    """Collects the results of one benchmark run."""
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.results = []
+
+    def size(self, count):
+        return max(int(count * self.scale), 1)
+
+    def record(self, name, value, unit, better="higher", **params):
+        self.results.append(
+            {
+                "name": name,
+                "value": value,
+                "unit": unit,
+                "better": better,
+                "params": params,
+            }
+        )
+        # Benchmarks may have silenced sys.stdout
+        print(
+            "{:<40} {:>14.3f} {}".format(name, value, unit),
+            file=sys.__stdout__,
+            flush=True,
+        )
+
+
+@contextlib.contextmanager
+def quietStdout():
+    """Send console output (and pexpect logfile_read) to /dev/null."""
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+@contextlib.contextmanager
+def fakeDevice(workDir, prompt="fake#", latency=0, size=64, line=""):
+    """
+    Put an ssh shim on PATH that starts fakeDevice.py instead.
+    Yields the device dictionary to pass to relex.connect().
+    """
+    shimDir = os.path.join(workDir, "bin")
+    os.makedirs(shimDir, exist_ok=True)
+    shim = os.path.join(shimDir, "ssh")
+    with open(shim, "w") as shimFile:
+        shimFile.write(
+            "#!/bin/sh\nexec {} {}\n".format(
+                sys.executable, os.path.join(benchDir, "fakeDevice.py")
+            )
+        )
+    os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+    saved = {
+        key: os.environ.get(key)
+        for key in (
+            "PATH",
+            "FAKEDEV_PROMPT",
+            "FAKEDEV_LATENCY",
+            "FAKEDEV_SIZE",
+            "FAKEDEV_LINE",
+        )
+    }
+    os.environ["PATH"] = shimDir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKEDEV_PROMPT"] = prompt
+    os.environ["FAKEDEV_LATENCY"] = str(latency)
+    os.environ["FAKEDEV_SIZE"] = str(size)
+    os.environ["FAKEDEV_LINE"] = line
+    try:
+        yield {
+            "name": "fake1",
+            "type": "fake",
+            "ip": "127.0.0.1",
+            "port": "22",
+            "user": "bench",
+            "password": "bench",
+            "prompt": prompt,
+        }
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def benchConnect(run, workDir):
+    count = run.size(50)
+    connectTime = 0
+    closeTime = 0
+    with fakeDevice(workDir) as conDev, quietStdout():
+        for _ in range(count):
+            start = time.perf_counter()
+            session = relex.connect(conDev)["session"]
+            connectTime += time.perf_counter() - start
+            start = time.perf_counter()
+            relex.close(session)
+            closeTime += time.perf_counter() - start
+    run.record(
+        "connect.latency", connectTime / count * 1000, "ms", "lower", count=count
+    )
+    run.record("close.latency", closeTime / count * 1000, "ms", "lower", count=count)
+
+
+def benchBroker(run, workDir):
+    """Back-to-back connect/command/close through the session broker."""
+    count = run.size(50)
+    client = sessionBroker.brokerClient(os.path.join(workDir, "broker.sock"))
+    with fakeDevice(workDir) as conDev, quietStdout():
+        relex.commonVars.broker = client
+        try:
+            # The first lease starts the broker and logs in
+            relex.close(relex.connect(conDev)["session"])
+            connectTime = 0
+            start = time.perf_counter()
+            for _ in range(count):
+                began = time.perf_counter()
+                session = relex.connect(conDev)["session"]
+                connectTime += time.perf_counter() - began
+                relex.command(session, "show", conDev["prompt"])
+                relex.close(session)
+            elapsed = time.perf_counter() - start
+        finally:
+            relex.commonVars.broker = None
+            client.request(op="shutdown")
+    run.record(
+        "broker.lease.latency", connectTime / count * 1000, "ms", "lower", count=count
+    )
+    run.record("broker.cycle", count / elapsed, "cycle/s", count=count)
+
+
+def benchCommand(run, workDir):
+    count = run.size(500)
+    batch = ["show"] * 10
+    with fakeDevice(workDir, size=64) as conDev, quietStdout():
+        session = relex.connect(conDev)["session"]
+        start = time.perf_counter()
+        for _ in range(count):
+            relex.command(session, "show", conDev["prompt"])
+        elapsed = time.perf_counter() - start
+        run.record("command.small", count / elapsed, "cmd/s", count=count, size=64)
+        start = time.perf_counter()
+        for _ in range(count // len(batch)):
+            relex.command_batch(session, batch, conDev["prompt"])
+        elapsed = time.perf_counter() - start
+        run.record(
+            "command_batch.small",
+            count // len(batch) * len(batch) / elapsed,
+            "cmd/s",
+            count=count,
+            size=64,
+        )
+        relex.close(session)
+
+    # A slow device: the batch is pipelined, each command still waits
+    latency = 0.2
+    count = run.size(30)
+    batch = ["show"] * 3
+    with fakeDevice(workDir, latency=latency, size=64) as conDev, quietStdout():
+        session = relex.connect(conDev)["session"]
+        expected = relex.command(session, "show", conDev["prompt"])
+        start = time.perf_counter()
+        for _ in range(count):
+            relex.command(session, "show", conDev["prompt"])
+        elapsed = time.perf_counter() - start
+        run.record("command.latency", count / elapsed, "cmd/s", latency=latency)
+        rounds = max(count // len(batch), 1)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = relex.command_batch(session, batch, conDev["prompt"])
+            if result["output"] != [expected] * len(batch):
+                raise RuntimeError("command_batch output differs: {!r}".format(result))
+        elapsed = time.perf_counter() - start
+        run.record(
+            "command_batch.latency",
+            rounds * len(batch) / elapsed,
+            "cmd/s",
+            latency=latency,
+        )
+        relex.close(session)
+
+    size = 1 << 20
+    count = run.size(20)
+    with fakeDevice(workDir, size=size) as conDev, quietStdout():
+        session = relex.connect(conDev)["session"]
+        start = time.perf_counter()
+        for _ in range(count):
+            relex.command(session, "show", conDev["prompt"])
+        elapsed = time.perf_counter() - start
+        run.record(
+            "command.large",
+            count * size / elapsed / 1e6,
+            "MB/s",
+            count=count,
+            size=size,
+        )
+        start = time.perf_counter()
+        for _ in range(count):
+            relex.command_stream(session, "show", conDev["prompt"]).close()
+        elapsed = time.perf_counter() - start
+        run.record(
+            "command_stream.large",
+            count * size / elapsed / 1e6,
+            "MB/s",
+            count=count,
+            size=size,
+        )
+        relex.close(session)
+
+    # Prompt characters in the output must not end the capture, nor a line
+    # ending like a prompt cut at a read boundary be learned as the prompt
+    checkPromptChars(workDir, "cost $5 > #4 %", 64)
+    checkPromptChars(workDir, "cost $5 #", 110000)
+
+
+def checkPromptChars(workDir, line, size):
+    # Whole CRLF terminated lines only
+    count = size // (len(line) + 2)
+    with fakeDevice(workDir, prompt="bench$", size=size, line=line) as conDev:
+        conDev["prompt"] = r"\$"
+        with quietStdout():
+            session = relex.connect(conDev)["session"]
+            streamed = [
+                "\n".join(relex.command_stream(session, "show").lines())
+                for _ in range(2)
+            ]
+            outputs = [relex.command(session, "show") for _ in range(2)]
+            batched = relex.command_batch(session, ["show", "show"])["output"]
+            relex.close(session)
+    for text in streamed + outputs + batched:
+        lines = [part.strip() for part in (text or "").splitlines() if part.strip()]
+        if set(lines) != {line} or len(lines) != count:
+            raise RuntimeError(
+                "prompt matched inside the output: {} of {} lines {!r}".format(
+                    len(lines), count, (text or "")[-200:]
+                )
+            )
+
+
+def benchSteps(run, workDir):
+    steps = run.size(2000)
+    script = os.path.join(workDir, "stepScript.py")
+    with open(script, "w") as src:
+        src.write("def Setup():\n")
+        for idx in range(steps):
+            src.write(
+                "    #STEP\n    value = {}\n    #CLEAN\n    value = 0\n".format(idx)
+            )
+    spec = importlib.util.spec_from_file_location("stepScript", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    testCompiler.cacheDir = os.path.join(workDir, "blockCache")
+    testCompiler._blockCache.clear()
+    start = time.perf_counter()
+    testCompiler.compileBlocks(module.Setup)
+    run.record(
+        "steps.compile.cold", time.perf_counter() - start, "s", "lower", steps=steps
+    )
+    testCompiler._blockCache.clear()
+    start = time.perf_counter()
+    testCompiler.compileBlocks(module.Setup)
+    run.record(
+        "steps.compile.disk", time.perf_counter() - start, "s", "lower", steps=steps
+    )
+
+    setupObj = relex.setupProc(module.Setup)
+    setupObj.splitSetup()
+    start = time.perf_counter()
+    setupObj.runSetupStep()
+    setupObj.runSetupClean()
+    elapsed = time.perf_counter() - start
+    run.record(
+        "steps.exec", elapsed / (2 * steps) * 1e6, "us/block", "lower", steps=steps
+    )
+
+
+def benchStations(run, workDir):
+    param = os.path.join(workDir, "bench.prm")
+    with open(param, "w") as prm:
+        prm.write(
+            "dut:\n  type: linux\n  distros: {any: [Ubuntu, CentOS]}\n"
+            "peer:\n  type: linux\n  cpus: {range: [8, 16]}\n"
+            "tgen:\n  type: tgen\n  name: {regex: '^tg'}\n"
+            "vars:\n  x: 1\n"
+        )
+    relex.commonVars.paramfile = param
+    for count in (10, 1000, 10000):
+        stations = os.path.join(workDir, "stations{}.yaml".format(count))
+        with open(stations, "w") as tb:
+            for idx in range(count):
+                kind = "tgen" if idx % 10 == 9 else "linux"
+                tb.write(
+                    "{0}{1}:\n  type: {0}\n  name: {2}{1}\n  distros: {3}\n"
+                    "  cpus: {4}\n  ip: 10.{5}.{6}.{7}\n  port: '22'\n".format(
+                        kind,
+                        idx,
+                        "tg" if kind == "tgen" else "lx",
+                        ("Ubuntu", "CentOS", "Debian")[idx % 3],
+                        (2, 4, 8, 16, 32)[idx % 5],
+                        idx >> 16,
+                        (idx >> 8) & 255,
+                        idx & 255,
+                    )
+                )
+        relex.commonVars.stationfile = stations
+        stationIndex._inventoryCache.clear()
+        start = time.perf_counter()
+        relex.stationLoader()
+        run.record(
+            "stations.load.{}".format(count),
+            time.perf_counter() - start,
+            "s",
+            "lower",
+            stations=count,
+        )
+        repeat = 20
+        start = time.perf_counter()
+        for _ in range(repeat):
+            relex.stationLoader()
+        run.record(
+            "stations.match.{}".format(count),
+            (time.perf_counter() - start) / repeat * 1000,
+            "ms",
+            "lower",
+            stations=count,
+        )
+        dut = relex.station[relex.devices.bound["dut"]]
+        lookups = run.size(100000)
+        start = time.perf_counter()
+        for _ in range(lookups):
+            relex.devices.roleOf(dut)
+        run.record(
+            "stations.role.{}".format(count),
+            (time.perf_counter() - start) / lookups * 1e6,
+            "us",
+            "lower",
+            stations=count,
+        )
+
+
+def benchSummary(run, workDir):
+    count = run.size(1000000)
+    relex.reportVars.Records = reportStore.reportStore(os.path.join(workDir, "summary"))
+    start = time.perf_counter()
+    for _ in range(count):
+        relex.INFO("benchmark message")
+    elapsed = time.perf_counter() - start
+    run.record("summary.record", count / elapsed, "msg/s", messages=count)
+    with quietStdout():
+        start = time.perf_counter()
+        relex.reportSummary()
+        elapsed = time.perf_counter() - start
+    run.record("summary.report", elapsed, "s", "lower", messages=count)
+    relex.reportVars.Records = reportStore.reportStore()
+
+
+def benchTee(run, workDir):
+    count = run.size(500000)
+    line = "2025-09-14 12:14:25,337 - relex - INFO - \x1b[32mbenchmark line\x1b[0m\n"
+    with quietStdout():
+        tee = testLogger.teeLogger(os.path.join(workDir, "tee.log"))
+        start = time.perf_counter()
+        for _ in range(count):
+            tee.write(line)
+        tee.sync(timeout=600)
+        elapsed = time.perf_counter() - start
+        tee.close()
+    run.record("tee.write", count * len(line) / elapsed / 1e6, "MB/s", lines=count)
+
+
+@contextlib.contextmanager
+def fakeStations(workDir, count):
+    """
+    Put ssh and sftp shims on PATH that start fakeTransfer.py instead.
+    Yields count device dictionaries to pass to relex.push()/pull().
+    """
+    shimDir = os.path.join(workDir, "xferbin")
+    os.makedirs(shimDir, exist_ok=True)
+    for mode in ("ssh", "sftp"):
+        shim = os.path.join(shimDir, mode)
+        with open(shim, "w") as shimFile:
+            shimFile.write(
+                '#!/bin/sh\nexec {} {} {} "$@"\n'.format(
+                    sys.executable, os.path.join(benchDir, "fakeTransfer.py"), mode
+                )
+            )
+        os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+    root = os.path.join(workDir, "stations")
+    stations = []
+    for num in range(count):
+        ip = "10.0.0.{}".format(num + 1)
+        os.makedirs(os.path.join(root, ip, "fw"), exist_ok=True)
+        stations.append(
+            {
+                "name": "xfer{}".format(num + 1),
+                "type": "fake",
+                "ip": ip,
+                "port": "22",
+                "user": "bench",
+                "password": "bench",
+            }
+        )
+    saved = {key: os.environ.get(key) for key in ("PATH", "FAKEXFER_ROOT")}
+    os.environ["PATH"] = shimDir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKEXFER_ROOT"] = root
+    try:
+        yield stations
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def benchTransfer(run, workDir):
+    """
+    Fan-out push and pull of one image to 16 stations, 4 at a time, then
+    interrupted and corrupted copies of it on one station.
+    """
+    size = run.size(32 << 20)
+    image = os.path.join(workDir, "image.bin")
+    with open(image, "wb") as img:
+        img.write(os.urandom(size))
+    with fakeStations(workDir, 16) as stations, quietStdout():
+        start = time.perf_counter()
+        pushed = relex.push(stations, image, "/fw/image.bin", jobs=4)
+        pushTime = time.perf_counter() - start
+        start = time.perf_counter()
+        pulled = relex.pull(
+            stations,
+            "/fw/image.bin",
+            os.path.join(workDir, "pull", "{name}.bin"),
+            jobs=4,
+        )
+        pullTime = time.perf_counter() - start
+    for label, results in (("push", pushed), ("pull", pulled)):
+        failed = [name for name, res in results.items() if res["result"] != "ok"]
+        if failed:
+            raise RuntimeError("{} failed on {}".format(label, ", ".join(failed)))
+    total = size * len(stations)
+    run.record("transfer.push", total / pushTime / 1e6, "MB/s", stations=len(stations))
+    run.record("transfer.pull", total / pullTime / 1e6, "MB/s", stations=len(stations))
+    checkTransferResume(workDir, image, size)
+
+
+def checkTransferResume(workDir, image, size):
+    """
+    Interrupted copies must resume, and a corrupt partial copy must be
+    sent again in full; both must end with the sha256 of the source.
+    """
+    checksum = fileTransfer.digest(image)
+    local = os.path.join(workDir, "resume", "image.bin")
+    with fakeStations(workDir, 1) as stations, quietStdout():
+        remote = os.path.join(
+            os.environ["FAKEXFER_ROOT"], stations[0]["ip"], "fw", "resume.bin"
+        )
+        for label, copy, part in (
+            ("push", lambda: relex.push(stations, image, "/fw/resume.bin"), remote),
+            ("pull", lambda: relex.pull(stations, "/fw/image.bin", local), local),
+        ):
+            for corrupt in (False, True):
+                os.environ["FAKEXFER_CUT"] = str(size // 2)
+                try:
+                    cut = copy()["xfer1"]
+                finally:
+                    del os.environ["FAKEXFER_CUT"]
+                if cut["result"] == "ok" or not os.path.exists(part + ".part"):
+                    raise RuntimeError("{} was not interrupted: {}".format(label, cut))
+                if corrupt:
+                    with open(part + ".part", "r+b") as partFile:
+                        partFile.write(b"\0" * 4096)
+                res = copy()["xfer1"]
+                resumed = res.get("resumed", 0)
+                if (
+                    res["result"] != "ok"
+                    or res["sha256"] != checksum
+                    or fileTransfer.digest(part) != checksum
+                    or (resumed == 0) != corrupt
+                ):
+                    raise RuntimeError(
+                        "{} did not resume{}: {}".format(
+                            label, " a corrupt copy" if corrupt else "", res
+                        )
+                    )
+
+
+def metadata(scale):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=benchDir,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": datetime.datetime.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": scale,
+    }
+
+
+def compare(results, baselineFile, tolerance):
+    """
+    Compare results with an earlier run.
+    Returns:
+        List of names of the metrics that regressed.
+    """
+    with open(baselineFile) as bf:
+        baseline = {res["name"]: res for res in json.load(bf)["results"]}
+    regressed = []
+    print("\n{:<40} {:>14} {:>14} {:>9}".format("Metric", "Baseline", "Now", "Change"))
+    for res in results:
+        old = baseline.get(res["name"])
+        if old is None or not old["value"]:
+            continue
+        change = res["value"] / old["value"] - 1
+        if res["better"] == "higher":
+            worse = change < -tolerance
+        else:
+            worse = change > tolerance
+        if worse:
+            regressed.append(res["name"])
+        print(
+            "{:<40} {:>14.3f} {:>14.3f} {:>+8.1%}{}".format(
+                res["name"],
+                old["value"],
+                res["value"],
+                change,
+                "  REGRESSED" if worse else "",
+            )
+        )
+    return regressed
+
+
+def main():
+    arg = benchArgs()
+    selected = arg.only.split(",") if arg.only else list(benchmarks)
+    scale = 0.1 if arg.quick else 1.0
+    run = benchRun(scale)
+    workDir = tempfile.mkdtemp(prefix="relexbench")
+
+    # relex normally sets these up in testExec()
+    relex.logger = logging.getLogger("relexbench")
+    relex.logger.addHandler(logging.NullHandler())
+    relex.logger.propagate = False
+    relex.param = {}
+    relex.station = {}
+    relex.downDevices = downStore.downStore(os.path.join(workDir, "down.json"))
+    relex.devices = deviceManager.deviceManager(
+        deviceManager.leaseStore(os.path.join(workDir, "leases.json"))
+    )
+
+    try:
+        for name in selected:
+            globals()["bench" + name.capitalize()](run, workDir)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    report = {"meta": metadata(scale), "results": run.results}
+    if arg.output:
+        with open(arg.output, "w") as out:
+            json.dump(report, out, indent=2)
+    if arg.baseline:
+        regressed = compare(run.results, arg.baseline, arg.tolerance)
+        if regressed:
+            print("\nRegressed: " + ", ".join(regressed))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+def linuxSessions():
+    #STEP - Connect to vm1
+    output = connect(vm1, "ssh")
+    if output["result"] == "ok":
+        OK("Success in connecting to vm1")
+    else:
+        FAIL("Failure in connecting to vm1")
+    vm1h = output["session"]
+
+    #CLEAN - Close vm1
+    output = close(vm1h)
+    if output["result"] == "ok":
+        OK("Success in closing vm1")
+    else:
+        FAIL("Failure in closing vm1")
@@ -1,5 +1,4 @@
 import relex
-import re
 
 
 def checkFile(handle, fileName):
@@ -11,9 +10,9 @@ def checkFile(handle, fileName):
     Returns:
         result: "ok" if file exists, "fail" otherwise.
     """
-    cmd_output = relex.command(handle, "ls -lart", "\$")
+    entries = relex.command_parsed(handle, "ls -lart")
     output = {}
-    if re.search(fileName, cmd_output):
+    if entries and any(entry["name"] == fileName for entry in entries):
         output["result"] = "ok"
     else:
         output["result"] = "fail"
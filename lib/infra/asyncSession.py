@@ -0,0 +1,146 @@
+import asyncio
+import pexpect
+import promptCache
+from pexpect.expect import Expecter, searcher_re
+
+
+async def expect(handle, patterns, timeout=-1):
+    """
+    Asynchronous pexpect.spawn.expect().
+    Reads the session PTY from the event loop with add_reader instead of
+    blocking in select, so one loop can wait on hundreds of sessions. The
+    handle keeps the usual before/after/match attributes and can still be
+    used with the blocking calls. A pending promptSearcher is settled, as
+    in promptCache.expectPrompt(), once no output came for settleTime.
+    Args:
+        handle: pexpect session handle.
+        patterns: Pattern or list of patterns, may include pexpect.EOF and
+                  pexpect.TIMEOUT, or a prepared searcher such as the
+                  cached searchers of command().
+        timeout: Seconds to wait, -1 uses handle.timeout.
+    Returns:
+        Index of the matched pattern.
+    Raises:
+        pexpect.EOF or pexpect.TIMEOUT when not in patterns.
+    """
+    if timeout == -1:
+        timeout = handle.timeout
+    if hasattr(patterns, "search"):
+        searcher = patterns
+    else:
+        searcher = searcher_re(handle.compile_pattern_list(patterns))
+    expecter = Expecter(handle, searcher)
+    idx = expecter.existing_data()
+    if idx is not None:
+        return idx
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    settle = None
+
+    def onSettled():
+        # No output since a pending prompt line, take it as the prompt
+        if done.done() or not searcher.pending:
+            return
+        searcher.settled = True
+        found = expecter.do_search(handle.buffer, 0)
+        if found is not None:
+            done.set_result(found)
+
+    def waitSettled():
+        nonlocal settle
+        if settle is not None:
+            settle.cancel()
+        if getattr(searcher, "pending", False):
+            settle = loop.call_later(promptCache.settleTime, onSettled)
+
+    def onReadable():
+        if done.done():
+            return
+        try:
+            data = handle.read_nonblocking(handle.maxread, timeout=0)
+        except pexpect.TIMEOUT:
+            return
+        except pexpect.EOF as exp:
+            try:
+                done.set_result(expecter.eof(exp))
+            except pexpect.EOF as eof:
+                done.set_exception(eof)
+            return
+        try:
+            found = expecter.new_data(data)
+        except Exception as exp:
+            done.set_exception(exp)
+            return
+        if found is not None:
+            done.set_result(found)
+        else:
+            waitSettled()
+
+    fd = handle.child_fd
+    loop.add_reader(fd, onReadable)
+    waitSettled()
+    try:
+        return await asyncio.wait_for(done, timeout)
+    except asyncio.TimeoutError as exp:
+        return expecter.timeout(exp)
+    finally:
+        loop.remove_reader(fd)
+        if settle is not None:
+            settle.cancel()
+
+
+# Pause before answering login questions, as pexpect's delaybeforesend,
+# for devices that drop input typed before they read it
+loginDelay = 0.05
+
+
+async def sendline(handle, line="", delay=0):
+    """
+    Asynchronous pexpect.spawn.sendline().
+    pexpect sleeps delaybeforesend seconds before every send, which stalls
+    the whole event loop; the handle's delay is switched off and the
+    optional delay is waited with asyncio.sleep instead.
+    """
+    handle.delaybeforesend = None
+    if delay:
+        await asyncio.sleep(delay)
+    return handle.sendline(line)
+
+
+async def run(func, *args):
+    """Run a blocking call, e.g. a session broker request, in the executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def close(handle):
+    """
+    Close a session without blocking the event loop.
+    pexpect waits for the child to exit on close, so the close runs in the
+    loop's shared executor.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, handle.close)
+
+
+async def gather(coros, limit=None):
+    """
+    Run coroutines concurrently, at most limit at a time.
+    Args:
+        coros: Iterable of coroutines.
+        limit: Maximum number running at once, None for no limit.
+    Returns:
+        List of results in the order of coros; exceptions are returned in
+        place of the result.
+    """
+    if limit is None:
+        return await asyncio.gather(*coros, return_exceptions=True)
+    slots = asyncio.Semaphore(limit)
+
+    async def limited(coro):
+        async with slots:
+            return await coro
+
+    return await asyncio.gather(
+        *(limited(coro) for coro in coros), return_exceptions=True
+    )
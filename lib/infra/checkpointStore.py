@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Test outcomes kept in the checkpoint
+PASS = "pass"
+FAIL = "fail"
+CRASH = "crash"
+
+
+def runKey(scriptFile, paramFile, stations):
+    """
+    Identify a run by what decides its outcome.
+    Args:
+        scriptFile: Script path; its source is hashed.
+        paramFile: Param file path; its content is hashed.
+        stations: Station names the run may use.
+    Returns:
+        Hex digest, equal only for the same script, params and stations.
+    """
+    digest = hashlib.sha256()
+    for path in (scriptFile, paramFile):
+        digest.update(os.path.realpath(path).encode() + b"\0")
+        try:
+            with open(path, "rb") as src:
+                digest.update(src.read())
+        except OSError:
+            pass
+        digest.update(b"\0")
+    digest.update("\0".join(sorted(stations)).encode())
+    return digest.hexdigest()
+
+
+class checkpointStore:
+    """
+    Per-script record of test outcomes, rewritten after every test.
+    Lets a later run with the same key skip the tests that passed.
+    """
+
+    def __init__(self, scriptFile, key, directory="~/.REXcheckpoint"):
+        directory = os.path.expanduser(directory)
+        scriptFile = os.path.realpath(scriptFile)
+        name = os.path.splitext(os.path.basename(scriptFile))[0]
+        pathHash = hashlib.sha256(scriptFile.encode()).hexdigest()[:12]
+        self.path = os.path.join(directory, "{}-{}.json".format(name, pathHash))
+        self.key = key
+        self.tests = {}
+        self.resumed = False
+
+    def load(self):
+        """
+        Take over the outcomes of the previous run if its key matches.
+        Returns:
+            True if the previous run matched and was loaded.
+        """
+        try:
+            with open(self.path) as store:
+                data = json.load(store)
+        except (OSError, ValueError):
+            return False
+        if data.get("key") != self.key:
+            return False
+        self.tests = data.get("tests", {})
+        self.resumed = True
+        return True
+
+    def status(self, testName):
+        """Outcome of a test in the checkpoint, None if it never finished."""
+        return self.tests.get(testName)
+
+    def record(self, testName, outcome):
+        """Store the outcome of a test and rewrite the checkpoint file."""
+        self.tests[testName] = outcome
+        self._write()
+
+    def reset(self):
+        """Start a fresh checkpoint for this run."""
+        self.tests = {}
+        self._write()
+
+    def _write(self):
+        data = {"key": self.key, "updated": time.time(), "tests": self.tests}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(self.path))
+            with os.fdopen(fd, "w") as store:
+                json.dump(data, store)
+            os.replace(tmpPath, self.path)
+        except OSError:
+            pass
@@ -0,0 +1,249 @@
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+
+class leaseStore:
+    """
+    Host-wide leases on stations, so concurrent runs never share one.
+    Entries are station name -> owner, pid, host and expiry time. A lease
+    is held while it has not expired and, on this host, its process is
+    alive. The file is guarded by an flock and every change is made under
+    the exclusive lock, so checking and taking a lease is atomic.
+    Processes forked from the owner (test workers, suite scripts) share
+    its leases.
+    Args:
+        path: Lease file shared by the runs of this host.
+        ttl: Seconds after which a lease expires even if its run is alive.
+        script: Script name recorded with the leases, shown to blocked runs.
+    """
+
+    def __init__(self, path="~/.REXleases.json", ttl=86400, script=None):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.script = script
+        self.host = socket.gethostname()
+        self.owner = "{}-{}-{}".format(self.host, os.getpid(), time.time())
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "a") as lockfile:
+            fcntl.flock(lockfile, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def _alive(self, entry, now):
+        if entry.get("expires", 0) < now:
+            return False
+        if entry.get("host") != self.host:
+            return True
+        try:
+            os.kill(entry["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except (OSError, KeyError, TypeError):
+            pass
+        return True
+
+    def _read(self):
+        try:
+            with open(self.path) as store:
+                entries = json.load(store)
+        except (OSError, ValueError):
+            entries = {}
+        now = time.time()
+        return {k: v for k, v in entries.items() if self._alive(v, now)}
+
+    def _write(self, entries):
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as store:
+            json.dump(entries, store)
+        os.replace(tmpPath, self.path)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Hold the exclusive lock and yield a leaseView of the live leases.
+        Leases taken on the view are written when the block ends.
+        """
+        with self._locked(fcntl.LOCK_EX):
+            view = leaseView(self, self._read())
+            yield view
+            if view.changed:
+                self._write(view.entries)
+
+    def held(self):
+        """
+        Return the stations leased by other runs.
+        Returns:
+            Dictionary of station name -> lease entry.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            entries = self._read()
+        return {k: v for k, v in entries.items() if v.get("owner") != self.owner}
+
+    def acquire(self, name):
+        """
+        Lease one station unless another run holds it.
+        Returns:
+            True if this run holds the lease now.
+        """
+        with self.transaction() as view:
+            return view.take(name)
+
+    def release(self, names=None):
+        """
+        Give back leases taken by this process.
+        Args:
+            names: Station names, all leases of this process if None.
+        """
+        with self.transaction() as view:
+            for name, entry in list(view.entries.items()):
+                mine = entry.get("owner") == self.owner
+                if mine and entry.get("pid") == os.getpid():
+                    if names is None or name in names:
+                        del view.entries[name]
+                        view.changed = True
+
+
+class leaseView:
+    """The live leases inside a leaseStore.transaction()."""
+
+    def __init__(self, store, entries):
+        self.store = store
+        self.entries = entries
+        self.changed = False
+
+    def isFree(self, name):
+        """True if no other run holds the station."""
+        entry = self.entries.get(name)
+        return entry is None or entry.get("owner") == self.store.owner
+
+    def holder(self, name):
+        """Describe the run holding a station, e.g. "a.py (pid 42 on host1)"."""
+        entry = self.entries.get(name) or {}
+        return "{} (pid {} on {})".format(
+            entry.get("script"), entry.get("pid"), entry.get("host")
+        )
+
+    def take(self, name):
+        """Lease a free station. Returns False if another run holds it."""
+        if not self.isFree(name):
+            return False
+        if name in self.entries:
+            # Already leased by this run, possibly by the parent process
+            return True
+        self.entries[name] = {
+            "owner": self.store.owner,
+            "pid": os.getpid(),
+            "host": self.store.host,
+            "script": self.store.script,
+            "expires": time.time() + self.store.ttl,
+        }
+        self.changed = True
+        return True
+
+
+class deviceManager:
+    """
+    Station allocation of a run.
+    Keeps which station plays each role (param key) and the backups of
+    every role, indexed by station, so finding the role of a device and
+    failing over to a backup are dictionary lookups instead of scans of
+    every param key and backup list. Stations are leased host-wide
+    through a leaseStore.
+    """
+
+    def __init__(self, leases=None):
+        self.leases = leases
+        self.lock = threading.Lock()
+        self.reset({})
+
+    def reset(self, stationData):
+        """Start an allocation over the given testbed stations."""
+        with self.lock:
+            self.stationData = stationData
+            self.index = None
+        self.bound = {}
+        self.roles = {}
+        self.backups = {}
+
+    def _index(self):
+        # Built on the first lookup, not per allocation. Lookups come from
+        # several connect threads at once, so the index is built under the
+        # lock and only published once complete
+        with self.lock:
+            if self.index is None:
+                byId = {}
+                byName = {}
+                for stnkey, fields in self.stationData.items():
+                    if isinstance(fields, dict):
+                        byId.setdefault(id(fields), stnkey)
+                        byName.setdefault(fields.get("name", stnkey), stnkey)
+                self.index = (byId, byName)
+            return self.index
+
+    def stationKey(self, conDev):
+        """
+        Testbed key of a device dictionary or of a session handle that
+        connect() mapped to its device, None if it is not a station.
+        """
+        index = self.index
+        if index is None:
+            index = self._index()
+        byId, byName = index
+        if not isinstance(conDev, dict):
+            conDev = self.stationData.get(conDev)
+        stnkey = byId.get(id(conDev))
+        if stnkey is None and isinstance(conDev, dict):
+            stnkey = byName.get(conDev.get("name"))
+        return stnkey
+
+    def roleOf(self, conDev):
+        """Param key the device is bound to, None if it has none."""
+        return self.roles.get(self.stationKey(conDev))
+
+    def bind(self, role, stnkey):
+        """Bind a station to a role and drop it from every backup list."""
+        previous = self.bound.get(role)
+        if previous is not None and self.roles.get(previous) == role:
+            del self.roles[previous]
+        self.bound[role] = stnkey
+        self.roles[stnkey] = role
+        self.dropBackup(stnkey)
+
+    def addBackup(self, role, stnkey):
+        """List a station as a backup of a role."""
+        self.backups.setdefault(role, {})[stnkey] = self.stationData[stnkey]
+
+    def dropBackup(self, stnkey):
+        """Remove a station from the backup lists of all roles."""
+        for backups in self.backups.values():
+            backups.pop(stnkey, None)
+
+    def nextBackup(self, role, view=None):
+        """
+        Take the first backup of a role that no other run has leased.
+        Backups leased elsewhere are dropped on the way.
+        Args:
+            role: Param key to fail over.
+            view: leaseView to lease the backup in, if leases are used.
+        Returns:
+            Station key or None when no backup is left.
+        """
+        backups = self.backups.get(role, {})
+        while backups:
+            stnkey = next(iter(backups))
+            name = self.stationData[stnkey].get("name", stnkey)
+            self.dropBackup(stnkey)
+            if view is None or view.take(name):
+                return stnkey
+        return None
@@ -0,0 +1,76 @@
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import time
+
+
+class downStore:
+    """
+    Host-wide record of stations that recently failed to connect.
+    Entries are station name -> time marked down and expire after ttl
+    seconds. The file is guarded by an flock so concurrent scripts can
+    share it safely.
+    """
+
+    def __init__(self, path="~/.REXdevDown.json", ttl=1800):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.cache = {}
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        with open(self.path + ".lock", "a") as lockfile:
+            fcntl.flock(lockfile, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as store:
+                entries = json.load(store)
+        except (OSError, ValueError):
+            entries = {}
+        now = time.time()
+        return {k: v for k, v in entries.items() if now - v < self.ttl}
+
+    def _write(self, entries):
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as store:
+            json.dump(entries, store)
+        os.replace(tmpPath, self.path)
+
+    def load(self):
+        """
+        Read the unexpired entries into the in-memory cache.
+        Returns:
+            Dictionary of station name -> time marked down.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            self.cache = self._read()
+        return self.cache
+
+    def isDown(self, name):
+        """Check a station against the entries from the last load()."""
+        return name in self.cache
+
+    def mark(self, name):
+        """Record a station as down."""
+        with self._locked(fcntl.LOCK_EX):
+            entries = self._read()
+            entries[name] = time.time()
+            self._write(entries)
+        self.cache = entries
+
+    def clear(self, name):
+        """Remove a station from the store once it is reachable again."""
+        if name not in self.cache:
+            return
+        with self._locked(fcntl.LOCK_EX):
+            entries = self._read()
+            if entries.pop(name, None) is not None:
+                self._write(entries)
+        self.cache = entries
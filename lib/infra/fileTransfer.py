@@ -0,0 +1,218 @@
+import hashlib
+import os
+import re
+import shlex
+import pexpect
+
+# Prompt of the OpenSSH sftp client
+sftpPrompt = "sftp> "
+
+# Messages of sftp commands that did not complete
+sftpErrors = re.compile(
+    r"Couldn't|Can't|not found|No such file|Permission denied|Unable to|Failure"
+)
+
+
+class transferError(Exception):
+    """A file transfer to or from a station failed."""
+
+
+def digest(path, chunkSize=1 << 20):
+    """sha256 hex digest of a local file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as src:
+        for chunk in iter(lambda: src.read(chunkSize), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def quote(path):
+    """Quote a path for the sftp command line."""
+    return '"' + path.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def lastLine(output):
+    """Last non-empty line of command output, for error messages."""
+    lines = output.strip().splitlines()
+    return lines[-1].strip() if lines else ""
+
+
+class sftpSession:
+    """
+    SFTP session to a station, logged in with its testbed credentials.
+    Files are written to <path>.part and renamed once their sha256 matches
+    the source, so an interrupted transfer leaves a partial file that the
+    next push or pull of the same file resumes from. A partial file that
+    does not match the source is discarded and the file sent again.
+    The remote checksum is taken with sha256sum over an ssh exec session.
+    Args:
+        conDev: Device dictionary with connection details.
+        options: Extra ssh options, e.g. the ControlMaster settings.
+        timeout: Seconds allowed for one sftp command or checksum.
+    """
+
+    def __init__(self, conDev, options=(), timeout=600):
+        self.conDev = conDev
+        self.options = list(options)
+        self.timeout = timeout
+        self.target = "{}@{}".format(conDev["user"], conDev["ip"])
+        self.handle = pexpect.spawn(
+            "sftp",
+            ["-P", str(conDev["port"])] + self.options + [self.target],
+            timeout=timeout,
+            encoding="utf-8",
+            codec_errors="replace",
+        )
+        self._login(self.handle, sftpPrompt)
+
+    def _login(self, handle, done):
+        # Answer host key and password questions until done is seen
+        patterns = ["continue connecting", "assword:", pexpect.EOF, pexpect.TIMEOUT]
+        if done is not pexpect.EOF:
+            patterns.append(re.escape(done))
+        while True:
+            idx = handle.expect(patterns)
+            if idx == 0:
+                handle.sendline("yes")
+            elif idx == 1:
+                handle.sendline(self.conDev["password"])
+            elif idx == 4 or (idx == 2 and done is pexpect.EOF):
+                return handle.before
+            elif idx == 2:
+                raise transferError(
+                    "connection closed unexpectedly - " + lastLine(handle.before)
+                )
+            else:
+                raise transferError("timeout logging in to {}".format(self.target))
+
+    def sftp(self, cmd, check=True):
+        """
+        Run one sftp command.
+        Returns:
+            Output of the command.
+        """
+        self.handle.sendline(cmd)
+        idx = self.handle.expect_exact([sftpPrompt, pexpect.EOF, pexpect.TIMEOUT])
+        if idx != 0:
+            raise transferError(
+                "sftp {} on {}: {}".format(
+                    cmd.split()[0],
+                    self.target,
+                    "session closed" if idx == 1 else "timeout",
+                )
+            )
+        # Drop the echoed command line
+        output = self.handle.before.partition("\n")[2]
+        if check and sftpErrors.search(output):
+            raise transferError(lastLine(output))
+        return output
+
+    def size(self, path):
+        """Size of a remote file, None if it does not exist."""
+        output = self.sftp("ls -ln {}".format(quote(path)), check=False)
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) >= 9 and fields[0][:1] in "-l" and fields[4].isdigit():
+                return int(fields[4])
+        return None
+
+    def remoteDigest(self, path):
+        """sha256 hex digest of a remote file, taken with sha256sum."""
+        handle = pexpect.spawn(
+            "ssh",
+            ["-p", str(self.conDev["port"])]
+            + self.options
+            + [self.target, "sha256sum -- " + shlex.quote(path)],
+            timeout=self.timeout,
+            encoding="utf-8",
+            codec_errors="replace",
+        )
+        try:
+            output = self._login(handle, pexpect.EOF)
+        finally:
+            handle.close()
+        found = re.search(r"^\\?([0-9a-f]{64})\s", output, re.M)
+        if found is None:
+            raise transferError(
+                "no sha256sum of {} on {}: {}".format(
+                    path, self.target, lastLine(output)
+                )
+            )
+        return found.group(1)
+
+    def push(self, local, remote):
+        """
+        Copy a local file to the station, resuming a partial copy.
+        Returns:
+            Dictionary with result, bytes, resumed (bytes already there)
+            and sha256.
+        """
+        size = os.path.getsize(local)
+        checksum = digest(local)
+        part = remote + ".part"
+        resumed = self.size(part) or 0
+        for have in (resumed, 0):
+            if have == 0:
+                self.sftp("put {} {}".format(quote(local), quote(part)))
+            elif have < size:
+                self.sftp("put -a {} {}".format(quote(local), quote(part)))
+            if self.remoteDigest(part) == checksum:
+                self.rename(part, remote)
+                return {
+                    "result": "ok",
+                    "bytes": size,
+                    "resumed": have,
+                    "sha256": checksum,
+                }
+            self.sftp("rm {}".format(quote(part)), check=False)
+        raise transferError("sha256 mismatch after copying {}".format(local))
+
+    def pull(self, remote, local):
+        """
+        Copy a file from the station, resuming a partial copy.
+        Returns:
+            Dictionary with result, bytes, resumed (bytes already there)
+            and sha256.
+        """
+        size = self.size(remote)
+        if size is None:
+            raise transferError("{} not found on {}".format(remote, self.target))
+        checksum = self.remoteDigest(remote)
+        part = local + ".part"
+        if os.path.dirname(local):
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+        resumed = os.path.getsize(part) if os.path.exists(part) else 0
+        for have in (resumed, 0):
+            if have == 0:
+                self.sftp("get {} {}".format(quote(remote), quote(part)))
+            elif have < size:
+                self.sftp("get -a {} {}".format(quote(remote), quote(part)))
+            if os.path.exists(part) and digest(part) == checksum:
+                os.replace(part, local)
+                return {
+                    "result": "ok",
+                    "bytes": size,
+                    "resumed": have,
+                    "sha256": checksum,
+                }
+            if os.path.exists(part):
+                os.remove(part)
+        raise transferError("sha256 mismatch after copying {}".format(remote))
+
+    def rename(self, source, target):
+        """Rename a remote file, replacing the target."""
+        try:
+            self.sftp("rename {} {}".format(quote(source), quote(target)))
+        except transferError:
+            # Servers without posix-rename do not replace the target
+            self.sftp("rm {}".format(quote(target)), check=False)
+            self.sftp("rename {} {}".format(quote(source), quote(target)))
+
+    def close(self):
+        if self.handle.isalive():
+            try:
+                self.handle.sendline("bye")
+                self.handle.expect(pexpect.EOF, timeout=5)
+            except (OSError, pexpect.ExceptionPexpect):
+                pass
+        self.handle.close()
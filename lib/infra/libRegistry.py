@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import sys
+
+
+class libRegistry:
+    """
+    Index of the functions under lib/func, lib/utility, lib/workflow and
+    lib/fixture.
+    Files are indexed once and each function is imported on first use.
+    The resolved callable is reused until its source file changes.
+    """
+
+    dirNames = {
+        "func": "func",
+        "util": "utility",
+        "wf": "workflow",
+        "fixture": "fixture",
+    }
+
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self.index = {}
+        self.cache = {}
+        self.scan()
+
+    def scan(self):
+        """Build the (fnType, devType, fnName) -> file path index."""
+        self.index = {}
+        for fnType, dirName in self.dirNames.items():
+            libDir = os.path.join(self.basepath, dirName)
+            if fnType == "func":
+                try:
+                    devDirs = [d for d in os.scandir(libDir) if d.is_dir()]
+                except OSError:
+                    continue
+                for devDir in devDirs:
+                    self._scanDir(fnType, devDir.name, devDir.path)
+            else:
+                self._scanDir(fnType, None, libDir)
+
+    def _scanDir(self, fnType, devType, libDir):
+        try:
+            entries = list(os.scandir(libDir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.endswith(".py") and entry.is_file():
+                key = (fnType, devType, entry.name[:-3])
+                self.index[key] = entry.path
+
+    def fnPath(self, fnType, fnName, devType=None):
+        """
+        Return the file expected to define the function.
+        Args:
+            fnType: "func", "util" or "wf".
+            fnName: Name of the function.
+            devType: Device type, only used for "func".
+        Returns:
+            Path to the function file.
+        """
+        key = (fnType, devType, fnName)
+        if key in self.index:
+            return self.index[key]
+        parts = [self.basepath, self.dirNames.get(fnType, fnType)]
+        if fnType == "func":
+            parts.append(devType)
+        return os.path.join(*parts, fnName + ".py")
+
+    def resolve(self, fnType, fnName, devType=None):
+        """
+        Return the callable for a library function.
+        The module is re-imported only when its file mtime changes.
+        Args:
+            fnType: "func", "util" or "wf".
+            fnName: Name of the function.
+            devType: Device type, only used for "func".
+        Returns:
+            The function object.
+        Raises:
+            IOError if the function file does not exist.
+        """
+        if fnType != "func":
+            devType = None
+        key = (fnType, devType, fnName)
+        path = self.fnPath(fnType, fnName, devType)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        modName = "_".join(["relexlib", fnType, devType or "", fnName])
+        spec = importlib.util.spec_from_file_location(modName, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[modName] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[modName]
+            raise
+        fnCall = getattr(module, fnName)
+        self.index[key] = path
+        self.cache[key] = (mtime, fnCall)
+        return fnCall
@@ -0,0 +1,272 @@
+import json
+import lzma
+import os
+import time
+import zlib
+
+# File suffix of the segments per compression
+suffixes = {"none": "", "gzip": ".gz", "lzma": ".xz"}
+
+
+def indexPath(logFile):
+    """Sidecar index of a log file: <base>.logidx next to it."""
+    return os.path.splitext(logFile)[0] + ".logidx"
+
+
+class plainLog:
+    """
+    Uncompressed log file with a step/test index.
+    Marks record the byte offset in the file, so a viewer can seek to
+    them. Forked workers append to the same file.
+    """
+
+    compress = "none"
+
+    def __init__(self, logFile):
+        self.path = logFile
+        self.fd = os.open(logFile, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.index = os.open(
+            indexPath(logFile), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        pass
+
+    def mark(self, entry):
+        """Index the current end of the log under entry."""
+        offset = os.fstat(self.fd).st_size
+        entry.update(
+            stream=os.path.basename(self.path),
+            file=os.path.basename(self.path),
+            segment=0,
+            offset=offset,
+            pos=offset,
+            compress=self.compress,
+            pid=os.getpid(),
+        )
+        writeIndex(self.index, entry)
+
+    def close(self):
+        for fd in (self.fd, self.index):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.fd = self.index = -1
+
+
+class segmentLog:
+    """
+    Log written as numbered compressed segments, <base>.000.log.gz, ...
+    A segment is closed once it holds segmentSize uncompressed bytes.
+    Every mark starts a new compressed member (gzip member / xz stream)
+    and records its segment, file offset and position in the sidecar
+    index, so one test or step is read by decompressing from there on.
+    gzip output is flushed to the file after every write; lzma keeps it
+    in the compressor until the next mark, sync or rotation.
+    A forked worker writes its own stream, <base>.w<pid>.000.log.gz, and
+    indexes it in the same sidecar file.
+    """
+
+    def __init__(self, logFile, compress="gzip", segmentSize=64 << 20):
+        self.compress = compress
+        self.segmentSize = segmentSize
+        self.base = os.path.splitext(logFile)[0]
+        self.index = os.open(
+            indexPath(logFile), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644
+        )
+        self._open(os.path.basename(self.base))
+
+    def _open(self, stream):
+        self.pid = os.getpid()
+        self.stream = stream
+        self.segment = -1
+        self.pos = 0
+        self.fd = -1
+        self._rotate()
+
+    def _rotate(self):
+        if self.fd >= 0:
+            self._finish()
+            os.close(self.fd)
+        self.segment += 1
+        self.file = "{}.{:03d}.log{}".format(
+            self.stream, self.segment, suffixes[self.compress]
+        )
+        path = os.path.join(os.path.dirname(self.base), self.file)
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.fileBytes = 0
+        self.segmentBytes = 0
+        self.compressor = None
+
+    def _forked(self):
+        # The parent's compressor state and segment belong to the parent
+        self._open("{}.w{}".format(os.path.basename(self.base), os.getpid()))
+
+    def _emit(self, data):
+        if data:
+            os.write(self.fd, data)
+            self.fileBytes += len(data)
+
+    def _finish(self):
+        if self.compressor is not None:
+            self._emit(self.compressor.flush())
+            self.compressor = None
+
+    def write(self, data):
+        if self.pid != os.getpid():
+            self._forked()
+        if self.compressor is None:
+            if self.compress == "lzma":
+                self.compressor = lzma.LZMACompressor(lzma.FORMAT_XZ)
+            else:
+                self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._emit(self.compressor.compress(data))
+        self.pos += len(data)
+        self.segmentBytes += len(data)
+        if self.segmentBytes >= self.segmentSize:
+            self._rotate()
+
+    def flush(self):
+        """Make everything written so far readable from the file (gzip)."""
+        if self.compressor is not None and self.compress == "gzip":
+            self._emit(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def sync(self):
+        """End the current member so all data is in the file."""
+        if self.pid == os.getpid():
+            self._finish()
+
+    def mark(self, entry):
+        """Start a new member and index it under entry."""
+        if self.pid != os.getpid():
+            self._forked()
+        self._finish()
+        entry.update(
+            stream=self.stream,
+            file=self.file,
+            segment=self.segment,
+            offset=self.fileBytes,
+            pos=self.pos,
+            compress=self.compress,
+            pid=self.pid,
+        )
+        writeIndex(self.index, entry)
+
+    def close(self):
+        if self.pid == os.getpid() and self.fd >= 0:
+            self._finish()
+        for fd in (self.fd, self.index):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.fd = self.index = -1
+
+
+def writeIndex(fd, entry):
+    entry.setdefault("time", time.time())
+    try:
+        os.write(fd, (json.dumps(entry) + "\n").encode())
+    except OSError:
+        pass
+
+
+def openLog(logFile, compress="none", segmentSize=64 << 20):
+    """
+    Open the file side of the tee logger.
+    Args:
+        logFile: Log file path; segments and the index are named after it.
+        compress: "none", "gzip" or "lzma".
+        segmentSize: Uncompressed bytes per compressed segment.
+    """
+    if compress in (None, "none"):
+        return plainLog(logFile)
+    return segmentLog(logFile, compress, segmentSize)
+
+
+def loadIndex(logFile):
+    """
+    Read the sidecar index of a log.
+    Returns:
+        List of index entries in the order they were written.
+    """
+    entries = []
+    with open(indexPath(logFile)) as index:
+        for line in index:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # A worker killed mid-write
+                continue
+    return entries
+
+
+def _decompressor(compress):
+    if compress == "lzma":
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+    return zlib.decompressobj(31)
+
+
+def readStream(directory, entry, length=None, chunkSize=1 << 20):
+    """
+    Yield the log data of a stream from an index entry on.
+    Only the segments from the entry's one on are read, starting at its
+    member, so earlier parts of the log are never decompressed.
+    Args:
+        directory: Directory of the log files.
+        entry: Index entry to start at.
+        length: Bytes to yield, None for the rest of the stream.
+    """
+    compress = entry.get("compress", "none")
+    segment = entry["segment"]
+    offset = entry["offset"]
+    remaining = length
+    while remaining is None or remaining > 0:
+        if compress == "none":
+            path = os.path.join(directory, entry["file"])
+        else:
+            path = os.path.join(
+                directory,
+                "{}.{:03d}.log{}".format(entry["stream"], segment, suffixes[compress]),
+            )
+        try:
+            src = open(path, "rb")
+        except OSError:
+            return
+        with src:
+            src.seek(offset)
+            decomp = None if compress == "none" else _decompressor(compress)
+            while remaining is None or remaining > 0:
+                raw = src.read(chunkSize)
+                if not raw:
+                    break
+                if decomp is None:
+                    data = raw
+                else:
+                    data = b""
+                    while raw:
+                        try:
+                            data += decomp.decompress(raw)
+                        except (zlib.error, lzma.LZMAError):
+                            # Unfinished member of a killed writer
+                            raw = b""
+                            break
+                        raw = decomp.unused_data if decomp.eof else b""
+                        if decomp.eof:
+                            decomp = _decompressor(compress)
+                if remaining is not None:
+                    data = data[:remaining]
+                    remaining -= len(data)
+                if data:
+                    yield data
+        if compress == "none":
+            return
+        segment += 1
+        offset = 0
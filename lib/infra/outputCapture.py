@@ -0,0 +1,115 @@
+import io
+import mmap
+import re
+import tempfile
+
+
+class capturedOutput:
+    """
+    Output of a streamed command.
+    Data is kept in memory up to spillSize bytes and then moved to an
+    anonymous temporary file, so huge outputs are never held as one
+    Python string. The first line (the command echo) is skipped by
+    lines() and text().
+    """
+
+    def __init__(self, spillSize=1 << 20):
+        self.spillSize = spillSize
+        self.memory = bytearray()
+        self.file = None
+        self.map = None
+        self.size = 0
+        self.timedOut = False
+        self.eof = False
+        self.match = None
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.file is None:
+            self.memory += data
+            if len(self.memory) > self.spillSize:
+                self.file = tempfile.TemporaryFile()
+                self.file.write(self.memory)
+                self.memory = bytearray()
+        else:
+            self.file.write(data)
+
+    def _blocks(self, blockSize=65536):
+        if self.file is None:
+            yield bytes(self.memory)
+            return
+        self.file.flush()
+        self.file.seek(0)
+        while True:
+            block = self.file.read(blockSize)
+            if not block:
+                break
+            yield block
+        self.file.seek(0, io.SEEK_END)
+
+    def lines(self):
+        """
+        Lazily iterate over the output lines as strings.
+        Only one block of the output is decoded at a time.
+        """
+        partial = b""
+        first = True
+        for block in self._blocks():
+            parts = (partial + block).split(b"\n")
+            partial = parts.pop()
+            for line in parts:
+                if first:
+                    first = False
+                    continue
+                yield line.rstrip(b"\r").decode("utf-8", errors="ignore")
+        if partial and not first:
+            yield partial.rstrip(b"\r").decode("utf-8", errors="ignore")
+
+    def search(self, pattern, flags=0):
+        """
+        Search the raw output with a regular expression.
+        Spilled output is searched through a memory map, which stays
+        open until close().
+        Args:
+            pattern: str or bytes regular expression.
+            flags: re flags.
+        Returns:
+            re.Match over bytes, or None.
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode()
+        regex = re.compile(pattern, flags)
+        if self.file is None:
+            return regex.search(self.memory)
+        if self.size == 0:
+            return None
+        if self.map is None or len(self.map) != self.size:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return regex.search(self.map)
+
+    def text(self):
+        """Return the whole output (without the echo line) as one string."""
+        return "\r\n".join(self.lines())
+
+    def __str__(self):
+        return self.text()
+
+    def close(self):
+        """Release the temporary file or memory buffer."""
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.memory = bytearray()
@@ -0,0 +1,182 @@
+import os
+import re
+import yaml
+
+valueRef = re.compile(r"\$\{(\w+)\}")
+
+# Terminal escape sequences, e.g. the colours of an aliased ls --color=auto
+ansiEscape = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|[@-Z\\-_])")
+
+
+class outputTemplate:
+    """
+    Compiled parser template turning command output into records.
+    A template names its values (name -> regex) and lists line rules that
+    reference them as ${name}. All rules are compiled into one alternation,
+    so every line is matched once. A rule with record: true emits the
+    values collected so far; filldown values are carried into the
+    following records. Terminal escape sequences are dropped from the
+    lines before matching.
+
+    Example (lib/template/linux/ls.yaml):
+        command: ls -lart
+        values:
+          total: '\\d+'
+          size: '\\d+'
+          name: '.+?'
+        filldown: [total]
+        rules:
+          - match: '^total\\s+${total}'
+          - match: '^\\S+\\s+\\d+\\s+\\S+\\s+\\S+\\s+${size}\\s+.{12}\\s+${name}$'
+            record: true
+    """
+
+    def __init__(self, spec, source="<template>"):
+        self.source = source
+        self.command = spec.get("command")
+        self.values = dict(spec.get("values") or {})
+        self.filldown = set(spec.get("filldown") or [])
+        self.required = list(spec.get("required") or [])
+        self.rules = []
+        alternatives = []
+        for idx, rule in enumerate(spec.get("rules") or []):
+            groups = []
+
+            def substitute(found, idx=idx, groups=groups):
+                name = found.group(1)
+                if name not in self.values:
+                    raise ValueError(
+                        "{}: rule {} uses undefined value {}".format(source, idx, name)
+                    )
+                group = "v{}_{}".format(idx, name)
+                groups.append((group, name))
+                return "(?P<{}>{})".format(group, self.values[name])
+
+            pattern = valueRef.sub(substitute, rule["match"])
+            alternatives.append("(?P<r{}>{})".format(idx, pattern))
+            self.rules.append((groups, bool(rule.get("record"))))
+        try:
+            self.regex = re.compile("|".join(alternatives))
+        except re.error as exp:
+            raise ValueError("{}: {}".format(source, exp))
+
+    def parse(self, lines):
+        """
+        Parse output line by line, yielding records as they complete.
+        Args:
+            lines: Output as a string or any iterable of lines, such as
+                   capturedOutput.lines().
+        Yields:
+            Dictionary of value name -> string (None when not captured).
+        """
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        current = dict.fromkeys(self.values)
+        pending = False
+        match = self.regex.match
+        for line in lines:
+            if "\x1b" in line:
+                line = ansiEscape.sub("", line)
+            found = match(line.rstrip("\r\n"))
+            if found is None:
+                continue
+            groups, record = self.rules[int(found.lastgroup[1:])]
+            for group, name in groups:
+                value = found.group(group)
+                if value is not None:
+                    current[name] = value
+                    if name not in self.filldown:
+                        pending = True
+            if record:
+                if self._complete(current):
+                    yield dict(current)
+                current = self._carry(current)
+                pending = False
+        if pending and self._complete(current):
+            yield dict(current)
+
+    def _complete(self, current):
+        return all(current[name] is not None for name in self.required)
+
+    def _carry(self, current):
+        fresh = dict.fromkeys(self.values)
+        for name in self.filldown:
+            fresh[name] = current[name]
+        return fresh
+
+
+class templateRegistry:
+    """
+    Index of the parser templates under lib/template/<device type>.
+    Each template is compiled on first use and reused until its file
+    changes.
+    """
+
+    def __init__(self, basepath):
+        self.basepath = basepath
+        self.index = {}
+        self.cache = {}
+        self.scan()
+
+    @staticmethod
+    def normalize(cmd):
+        return " ".join(cmd.split())
+
+    def scan(self):
+        """Build the (devType, command) -> template path index."""
+        self.index = {}
+        try:
+            devDirs = [d for d in os.scandir(self.basepath) if d.is_dir()]
+        except OSError:
+            return
+        for devDir in devDirs:
+            for entry in os.scandir(devDir.path):
+                if not entry.name.endswith((".yaml", ".yml")):
+                    continue
+                with open(entry.path) as tplFile:
+                    spec = yaml.safe_load(tplFile) or {}
+                if spec.get("command"):
+                    key = (devDir.name, self.normalize(spec["command"]))
+                    self.index[key] = entry.path
+
+    def lookup(self, devType, cmd):
+        """
+        Find the template for a command.
+        A template for "ls -lart" also serves "ls -lart /tmp"; the longest
+        matching command wins.
+        Args:
+            devType: Device type (station "type").
+            cmd: Command whose output is parsed.
+        Returns:
+            Path to the template file, or None.
+        """
+        words = self.normalize(cmd).split(" ")
+        for end in range(len(words), 0, -1):
+            path = self.index.get((devType, " ".join(words[:end])))
+            if path is not None:
+                return path
+        return None
+
+    def resolve(self, devType, cmd):
+        """
+        Return the compiled template for a command.
+        Args:
+            devType: Device type (station "type").
+            cmd: Command whose output is parsed.
+        Returns:
+            outputTemplate.
+        Raises:
+            IOError if there is no template for the command.
+            ValueError if the template is invalid.
+        """
+        path = self.lookup(devType, cmd)
+        if path is None:
+            raise IOError("No template for {} on {}".format(cmd, devType))
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path) as tplFile:
+            template = outputTemplate(yaml.safe_load(tplFile), path)
+        self.cache[path] = (mtime, template)
+        return template
@@ -0,0 +1,219 @@
+import re
+import threading
+import time
+import pexpect
+from pexpect.expect import Expecter, searcher_re
+
+# Bytes kept from earlier reads when searching new output; covers the
+# learned prompt line and a loose prompt on the last line
+lookback = 512
+
+# Characters a prompt line usually ends with
+promptEnds = "$#>%"
+
+# Seconds without output after which an unfinished last line matching the
+# loose prompt pattern is taken as a changed prompt
+settleTime = 0.2
+
+
+class promptSearcher:
+    """
+    pexpect searcher for the prompt after a command: EOF, TIMEOUT, prompt.
+    Once the session's exact prompt line is known, it is looked up with a
+    plain substring search at the start of a line, only in new output.
+    The loose prompt pattern is only tried on the last line received,
+    when nothing follows the match or the line ends like a prompt, so
+    prompt characters inside the output cannot end it. A loose match
+    means the prompt changed (config mode, another directory) and its
+    line becomes the exact prompt, but only once the session has been
+    quiet for settleTime: until then the searcher is pending, as the line
+    may still be output that is being received (see expectPrompt()).
+    The matched prompt line and the line break before it are not part of
+    the output left in handle.before.
+    """
+
+    eof_index = 0
+    timeout_index = 1
+    longest_string = lookback
+
+    def __init__(self, pattern, binary=True):
+        self.pattern = pattern
+        self.patterns = [pexpect.EOF, pexpect.TIMEOUT, pattern]
+        self.binary = binary
+        loose = pattern.encode() if binary else pattern
+        self.loose = re.compile(loose, re.DOTALL)
+        self.newline = b"\n" if binary else "\n"
+        self.cr = b"\r" if binary else "\r"
+        self.ends = tuple(char.encode() if binary else char for char in promptEnds)
+        self.exact = None
+        self.needle = None
+        self.pending = False
+        self.settled = False
+        self.match = None
+        self.start = 0
+        self.end = 0
+
+    def learn(self, text):
+        """
+        Take the exact prompt from the output ending in a prompt.
+        Returns:
+            The learned prompt line, None if the pattern does not match it.
+        """
+        if isinstance(text, str) and self.binary:
+            text = text.encode()
+        elif isinstance(text, bytes) and not self.binary:
+            text = text.decode("utf-8", errors="ignore")
+        line = text[text.rfind(self.newline) + 1 :].rstrip()
+        if not line or not self.loose.search(line):
+            return None
+        self.exact = line
+        self.needle = self.newline + line
+        return line
+
+    def _found(self, buffer, start, end):
+        # Leave the line break before the prompt out of handle.before
+        if buffer[start - 1 : start] == self.newline:
+            start -= 1
+            if buffer[start - 1 : start] == self.cr:
+                start -= 1
+        self.start = start
+        self.end = end
+        self.match = buffer[start:end]
+        return 2
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        settled = self.settled
+        self.pending = self.settled = False
+        lineStart = buffer.rfind(self.newline) + 1
+        if self.needle is not None:
+            pos = buffer.find(
+                self.needle, max(0, len(buffer) - freshlen - len(self.needle))
+            )
+            if pos >= 0:
+                return self._found(buffer, pos + 1, pos + len(self.needle))
+        line = buffer[lineStart:]
+        found = self.loose.search(line)
+        if found is None:
+            return -1
+        promptLine = line.rstrip()
+        end = lineStart + max(found.end(), len(promptLine))
+        if line[found.end() :].strip() and not promptLine.endswith(self.ends):
+            return -1
+        if self.exact is not None and promptLine.endswith(self.exact):
+            # Output without a final newline, followed by the usual prompt
+            start = lineStart + len(promptLine) - len(self.exact)
+            return self._found(buffer, start, end)
+        if not settled:
+            # More output may complete the line, wait for the session to
+            # go quiet before taking it as the new prompt
+            self.pending = True
+            return -1
+        self.learn(promptLine)
+        return self._found(buffer, lineStart, end)
+
+    def __str__(self):
+        return "promptSearcher: exact {!r}, pattern {!r}".format(
+            self.exact, self.pattern
+        )
+
+
+def expectPrompt(handle, searcher, timeout):
+    """
+    handle.expect_loop() for the searchers of promptCache.
+    While a promptSearcher is pending, output is read with a settleTime
+    timeout; if none arrives, the pending line is searched again as a
+    settled prompt.
+    Args:
+        handle: pexpect session handle.
+        searcher: Searcher from promptCache.searcher().
+        timeout: Seconds to wait for the prompt.
+    Returns:
+        Index of the match: 0 EOF, 1 TIMEOUT, 2 or more a prompt.
+    """
+    expecter = Expecter(handle, searcher)
+    deadline = time.monotonic() + timeout
+    idx = expecter.existing_data()
+    while idx is None:
+        remaining = deadline - time.monotonic()
+        pending = getattr(searcher, "pending", False)
+        wait = min(remaining, settleTime) if pending else remaining
+        try:
+            if wait <= 0:
+                raise pexpect.TIMEOUT("expectPrompt")
+            data = handle.read_nonblocking(handle.maxread, wait)
+        except pexpect.EOF as exp:
+            return expecter.eof(exp)
+        except pexpect.TIMEOUT as exp:
+            if pending:
+                searcher.settled = True
+                idx = expecter.do_search(handle.buffer, 0)
+            if idx is None and wait >= remaining:
+                return expecter.timeout(exp)
+        else:
+            idx = expecter.new_data(data)
+    return idx
+
+
+class promptCache:
+    """
+    Per-session prompts and their precompiled searchers.
+    A session is registered at connect time with the prompt pattern it
+    logged in with, which becomes its default prompt, and learns the exact
+    prompt line from the login. Searchers are cached per (session,
+    pattern), so command() does not rebuild or recompile its patterns.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def learn(self, handle, pattern, text):
+        """
+        Register a session with the prompt it was matched with.
+        Args:
+            handle: pexpect session handle.
+            pattern: Prompt pattern used to log in, string or list.
+            text: Output that ended in the prompt (before + after).
+        """
+        with self.lock:
+            self.sessions[handle] = {"default": pattern, "searchers": {}}
+        if isinstance(pattern, str):
+            self.searcher(handle, pattern).learn(text)
+
+    def default(self, handle):
+        """Prompt pattern the session logged in with, None if unknown."""
+        entry = self.sessions.get(handle)
+        return None if entry is None else entry["default"]
+
+    def searcher(self, handle, pattern):
+        """
+        Cached searcher for a prompt pattern on a session.
+        String patterns get a promptSearcher; lists of patterns a
+        precompiled regular expression searcher.
+        """
+        key = pattern if isinstance(pattern, str) else tuple(pattern)
+        with self.lock:
+            entry = self.sessions.setdefault(
+                handle, {"default": pattern, "searchers": {}}
+            )
+            searcher = entry["searchers"].get(key)
+            if searcher is None:
+                binary = getattr(handle, "string_type", bytes) is bytes
+                if isinstance(pattern, str):
+                    searcher = promptSearcher(pattern, binary)
+                    # A prompt already seen on the session may match it
+                    for known in entry["searchers"].values():
+                        exact = getattr(known, "exact", None)
+                        if exact is not None and searcher.learn(exact):
+                            break
+                else:
+                    patterns = [pexpect.EOF, pexpect.TIMEOUT] + list(pattern)
+                    searcher = searcher_re(handle.compile_pattern_list(patterns))
+                    searcher.patterns = patterns
+                entry["searchers"][key] = searcher
+        return searcher
+
+    def forget(self, handle):
+        """Drop a closed session."""
+        with self.lock:
+            self.sessions.pop(handle, None)
@@ -0,0 +1,89 @@
+import collections
+import errno
+import selectors
+import socket
+import time
+
+# Sockets open at once, well under the usual limit of 1024 open files
+maxSockets = 256
+
+# Connect errors of this host rather than of the station
+localErrors = {
+    errno.EMFILE,
+    errno.ENFILE,
+    errno.ENOBUFS,
+    errno.ENOMEM,
+    errno.EADDRNOTAVAIL,
+}
+
+
+def probeStations(targets, timeout=1.0, limit=maxSockets):
+    """
+    Probe many stations at once with non-blocking TCP connects.
+    At most limit connects are in flight, polled with one selector; each
+    one that completes makes room for the next, and the whole probe takes
+    at most timeout seconds.
+    Args:
+        targets: Dictionary of station name -> (ip, port).
+        timeout: Seconds to wait for the connects to complete.
+        limit: Maximum number of sockets open at once.
+    Returns:
+        Dictionary of station name -> connect latency in seconds, or None
+        if the station was unreachable. Stations that were not probed,
+        because the timeout ran out before their turn or this host ran out
+        of sockets, are left out.
+    """
+    result = {}
+    waiting = collections.deque(targets.items())
+    sel = selectors.DefaultSelector()
+    deadline = time.monotonic() + timeout
+    try:
+        while waiting or sel.get_map():
+            while waiting and len(sel.get_map()) < limit:
+                name, (ip, port) = waiting.popleft()
+                try:
+                    addr = socket.getaddrinfo(ip, int(port), type=socket.SOCK_STREAM)[0]
+                    sock = socket.socket(addr[0], addr[1], addr[2])
+                except (ValueError, TypeError, socket.gaierror):
+                    result[name] = None
+                    continue
+                except OSError as exp:
+                    if exp.errno in localErrors:
+                        # Retry once a socket in flight is closed
+                        waiting.appendleft((name, (ip, port)))
+                        break
+                    result[name] = None
+                    continue
+                sock.setblocking(False)
+                start = time.monotonic()
+                err = sock.connect_ex(addr[4])
+                if err not in (0, errno.EINPROGRESS):
+                    sock.close()
+                    if err in localErrors:
+                        waiting.appendleft((name, (ip, port)))
+                        break
+                    result[name] = None
+                    continue
+                sel.register(sock, selectors.EVENT_WRITE, (name, start))
+            if not sel.get_map():
+                # Out of sockets with none in flight, the rest is not probed
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                name, start = key.data
+                err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    result[name] = time.monotonic() - start
+                elif err not in localErrors:
+                    result[name] = None
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+    finally:
+        # Connects still in flight did not answer within the timeout
+        for key in list(sel.get_map().values()):
+            result[key.data[0]] = None
+            key.fileobj.close()
+        sel.close()
+    return result
@@ -7,23 +7,50 @@
 ############################################################################
 
 import sys
-import inspect
 import logging
 import testLogger
+import logSegments
 import testArgs
-import datetime
+import testCompiler
+import libRegistry
+import sessionPool
+import stationIndex
+import downStore
+import reachProbe
+import reportStore
+import outputCapture
+import outputParser
+import promptCache
+import asyncSession
+import timingTrace
+import checkpointStore
+import deviceManager
+import fileTransfer
+import sessionBroker
 import code
 import re
+import shlex
 import os
 import pexpect
 import yaml
 import types
-import imp
+import tempfile
+import time
+import asyncio
+import atexit
+import functools
+import itertools
+import zlib
+import multiprocessing
+import threading
+import concurrent.futures
+import multiprocessing.connection
 
 sys.dont_write_bytecode = True
 
 #     Holds counters and messages for test execution reporting.
-#     Tracks pass/fail counts, info/debug messages, and test status.
+#     Tracks pass/fail counts and test status; messages are streamed
+#     to the Records store.
 reportVars = types.SimpleNamespace(
     PassCount=0,
     FailCount=0,
@@ -33,7 +60,8 @@ reportVars = types.SimpleNamespace(
     TestFailCount=0,
     SetupFail=False,
     TestFail=False,
-    Message=[],
+    TestSkipCount=0,
+    Records=reportStore.reportStore(),
 )
 
 #     Stores properties and counters for test steps.
@@ -57,21 +85,72 @@ commonVars = types.SimpleNamespace(
     loglevel=None,
     stnmatchlist=[],
     stnbkplist={},
+    stnassign={},
+    parallel=1,
+    workerId=None,
+    sessionpool=None,
+    controlmaster=False,
+    preflight=None,
+    stations=None,
+    checkpoint=None,
+    rerun=None,
+    broker=None,
+    leasewait=0,
+    candidates=set(),
 )
 
+#     Serialises station bookkeeping and reporting across threads.
+connectLock = threading.RLock()
+reportLock = threading.Lock()
+
+#     Stations that recently failed to connect, shared across scripts.
+downDevices = downStore.downStore()
+
+#     Exact prompts learned per session and their precompiled searchers.
+prompts = promptCache.promptCache()
+
+#     Stations bound to each param key, their backups and the host-wide
+#     leases that keep concurrent runs off each other's stations.
+devices = deviceManager.deviceManager(
+    deviceManager.leaseStore(script=os.path.basename(sys.argv[0]))
+)
+
+#     Index of lib/func, lib/utility, lib/workflow and lib/fixture used by
+#     lib() and the setup fixtures.
+#     Built once at import; callables are cached per (device type, name).
+libIndex = libRegistry.libRegistry(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+#     Parser templates under lib/template, compiled once per command.
+templateIndex = outputParser.templateRegistry(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "template"
+    )
+)
+
+#     Wall time of steps, commands and connect attempts for the summary
+#     and the optional Chrome trace file.
+timing = timingTrace.timingTrace()
+
+#     Setup fixtures started in this process or inherited from the suite
+#     runner, by fixture name.
+activeFixtures = {}
+
 
 def OK(msg, test=False):
     """
     Log a successful test step.
-    Increments pass counters and appends a formatted message.
+    Increments pass counters and stores a result record.
     """
-    reportVars.PassCount += 1
-    if test == "TestCase":
-        reportVars.TestPassCount += 1
+    with reportLock:
+        reportVars.PassCount += 1
+        if test == "TestCase":
+            reportVars.TestPassCount += 1
     logger.ok(msg)
-    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-    append_msg = time + " - [OK] - " + msg
-    reportVars.Message.append(append_msg)
+    reportVars.Records.add(
+        reportStore.OK, msg, commonVars.currentSection, commonVars.currentTest
+    )
 
 
 def FAIL(msg):
@@ -79,20 +158,22 @@ def FAIL(msg):
     Log a failed test step.
     Increments fail counters, sets fail flags, and aborts if needed.
     """
-    reportVars.FailCount += 1
-    if commonVars.currentSection == "Setup":
-        reportVars.SetupFail = True
-    else:
-        if not reportVars.TestFail:
-            reportVars.TestFail = True
-            reportVars.TestFailCount += 1
+    with reportLock:
+        reportVars.FailCount += 1
+        if commonVars.currentSection == "Setup":
+            reportVars.SetupFail = True
+        else:
+            if not reportVars.TestFail:
+                reportVars.TestFail = True
+                reportVars.TestFailCount += 1
     logger.fail(msg)
-    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-    append_msg = time + " - [FAIL] - " + msg
-    reportVars.Message.append(append_msg)
+    reportVars.Records.add(
+        reportStore.FAIL, msg, commonVars.currentSection, commonVars.currentTest
+    )
     if stepProperty.AbortOnFail == True:
         INFO("*** Aborting Script on Failure ***")
-        reportSummary()
+        if commonVars.workerId is None:
+            reportSummary()
         sys.exit(1)
 
 
@@ -101,45 +182,49 @@ def ERROR(msg):
     Log an error during test execution.
     Increments fail counters, sets fail flags, and aborts if needed.
     """
-    reportVars.FailCount += 1
-    if commonVars.currentSection == "Setup":
-        reportVars.SetupFail = True
-    else:
-        if not reportVars.TestFail:
-            reportVars.TestFail = True
-            reportVars.TestFailCount += 1
+    with reportLock:
+        reportVars.FailCount += 1
+        if commonVars.currentSection == "Setup":
+            reportVars.SetupFail = True
+        else:
+            if not reportVars.TestFail:
+                reportVars.TestFail = True
+                reportVars.TestFailCount += 1
     logger.error(msg)
-    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-    append_msg = time + " - [ERROR] - " + msg
-    reportVars.Message.append(append_msg)
+    reportVars.Records.add(
+        reportStore.ERROR, msg, commonVars.currentSection, commonVars.currentTest
+    )
     if stepProperty.AbortOnFail == True:
         INFO("*** Aborting Script on Failure ***")
-        reportSummary()
+        if commonVars.workerId is None:
+            reportSummary()
         sys.exit(1)
 
 
 def INFO(msg):
     """
     Log an informational message.
-    Increments info counter and appends a formatted message.
+    Increments info counter and stores a result record.
     """
-    reportVars.InfoCount += 1
+    with reportLock:
+        reportVars.InfoCount += 1
     logger.info(msg)
-    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-    append_msg = time + " - [INFO] - " + msg
-    reportVars.Message.append(append_msg)
+    reportVars.Records.add(
+        reportStore.INFO, msg, commonVars.currentSection, commonVars.currentTest
+    )
 
 
 def DEBUG(msg):
     """
     Log a debug message.
-    Increments debug counter and appends a formatted message.
+    Increments debug counter and stores a result record.
     """
-    reportVars.DebugCount += 1
+    with reportLock:
+        reportVars.DebugCount += 1
     logger.debug(msg)
-    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
-    append_msg = time + " - [DEBUG] - " + msg
-    reportVars.Message.append(append_msg)
+    reportVars.Records.add(
+        reportStore.DEBUG, msg, commonVars.currentSection, commonVars.currentTest
+    )
 
 
 def reportSummary():
@@ -148,19 +233,23 @@ def reportSummary():
     Shows pass/fail counts and script status.
     """
     print("\n")
-    SummaryReport = "\n".join(reportVars.Message)
     banner = "Execution Summary"
     print("=" * 100)
     print(banner.rjust(70))
     print("=" * 100)
-    print(SummaryReport)
+    for line in reportVars.Records.lines():
+        print(line)
     print("=" * 100)
+    timingSummary()
     print("=" * 100)
     print("+" + "-" * (52) + "+")
     msg = "Total Number Of Test Passed = {}".format(reportVars.TestPassCount)
     summaryFormatter(msg)
     msg = "Total Number Of Test Failed = {}".format(reportVars.TestFailCount)
     summaryFormatter(msg)
+    if reportVars.TestSkipCount:
+        msg = "Total Number Of Test Skipped = {}".format(reportVars.TestSkipCount)
+        summaryFormatter(msg)
     if reportVars.FailCount == 0 and reportVars.TestPassCount == 0:
         msg = "Script dont have pass criteria for TestCases!"  # .rjust(35)
     elif reportVars.FailCount == 0:
@@ -172,6 +261,28 @@ def reportSummary():
             msg = "Script has Failed!"  # .rjust(35)
     summaryFormatter(msg)
     print("+" + "-" * (52) + "+")
+    reportVars.Records.close()
+    timing.close()
+
+
+def timingSummary():
+    """Print the slowest steps, commands and connects of the run."""
+    rows = timing.table()
+    if not rows:
+        return
+    print("Timing Summary".rjust(57))
+    print("=" * 100)
+    print(
+        "{:<9} {:<50} {:>7} {:>9} {:>9} {:>9}".format(
+            "Category", "Name", "Count", "Total(s)", "Avg(s)", "Max(s)"
+        )
+    )
+    for cat, name, count, total, avg, peak in rows:
+        print(
+            "{:<9} {:<50} {:>7} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                cat, name[:50], count, total, avg, peak
+            )
+        )
 
 
 def summaryFormatter(line):
@@ -188,29 +299,411 @@ def splitTestRunner(*testlist):
     """
     Run each test function in the provided list.
     Splits test steps, executes them, and logs results.
+    Tests run concurrently when more than one parallel worker is requested.
     Args:
         *testlist: One or more test functions to execute.
     """
+    testlist = selectTests(expandMatrix(testlist))
+    if commonVars.parallel > 1 and len(testlist) > 1:
+        parallelTestRunner(*testlist)
+        return
     for test in testlist:
-        # INFO("+++ Starting Execution Of TestCase +++")
-        commonVars.currentSectionFailFlag = False
-        testObj = testProc(test)
-        testObj.splitTest()
-        INFO("+++ Starting Execution Of {} +++".format(commonVars.currentTest))
-        stepProperty.TestStepCounter = 0
+        runTest(test)
+
+
+def matrix(*rows, **axes):
+    """
+    Declare the parameter matrix of a test function.
+    A matrix in the param file vars for the same test takes precedence.
+    Usage:
+        @relex.matrix(mtu=[1500, 9000], proto=["tcp", "udp"])
+        @relex.matrix({"mtu": 1500, "proto": "tcp"}, {"mtu": 9000, "proto": "udp"})
+    Args:
+        *rows: Explicit cases, one dictionary per variant.
+        **axes: Value lists; every combination becomes a variant.
+    """
+
+    def mark(func):
+        func.matrix = list(rows) if rows else axes
+        return func
+
+    return mark
+
+
+class testVariant:
+    """
+    One case of a test matrix: the test function with its values.
+    Variants share the compiled blocks of the function; while one runs,
+    its values are bound to the global "case".
+    """
+
+    def __init__(self, func, case):
+        self.func = func
+        self.case = case
+        self.__name__ = "{}[{}]".format(
+            func.__name__, ",".join("{}={}".format(k, v) for k, v in case.items())
+        )
+
+
+def matrixCases(spec):
+    """
+    Expand a matrix spec into its cases.
+    Args:
+        spec: {name: [values]} crossed in order, or a list of case dictionaries.
+    Returns:
+        List of {name: value} dictionaries.
+    """
+    if isinstance(spec, list):
+        return [dict(case) for case in spec]
+    names = list(spec)
+    values = [
+        spec[name] if isinstance(spec[name], list) else [spec[name]]
+        for name in names
+    ]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def expandMatrix(testlist):
+    """
+    Replace every test that has a matrix with one variant per case.
+    Matrices come from param["vars"]["matrix"][<test name>] or the
+    relex.matrix decorator.
+    Args:
+        testlist: Test functions in script order.
+    Returns:
+        List of test functions and testVariant objects.
+    """
+    try:
+        specs = dict(param["vars"]["matrix"] or {})
+    except (NameError, KeyError, TypeError):
+        specs = {}
+    names = {test.__name__ for test in testlist}
+    for testName in specs:
+        if testName not in names:
+            INFO("Matrix given for unknown test {}".format(testName))
+    expanded = []
+    for test in testlist:
+        spec = specs.get(test.__name__, getattr(test, "matrix", None))
+        if not spec:
+            expanded.append(test)
+            continue
+        cases = matrixCases(spec)
+        DEBUG("Expanding {} into {} variants".format(test.__name__, len(cases)))
+        expanded.extend(testVariant(test, case) for case in cases)
+    return expanded
+
+
+def selectTests(testlist):
+    """
+    Drop the tests a resumed run does not need to repeat.
+    With -resume every test that passed in the checkpointed run is
+    skipped; with -rerunfailed only the tests that failed there are run.
+    Args:
+        testlist: Test functions in script order.
+    Returns:
+        List of test functions to run.
+    """
+    checkpoint = commonVars.checkpoint
+    if checkpoint is None or not checkpoint.resumed:
+        return list(testlist)
+    selected = []
+    for test in testlist:
+        status = checkpoint.status(test.__name__)
+        if commonVars.rerun == "failed":
+            rerun = status in (checkpointStore.FAIL, checkpointStore.CRASH)
+        else:
+            rerun = status != checkpointStore.PASS
+        if rerun:
+            selected.append(test)
+        else:
+            reportVars.TestSkipCount += 1
+            INFO(
+                "Skipping {} - {} in the checkpointed run".format(
+                    test.__name__, status or "not run"
+                )
+            )
+    return selected
+
+
+def recordOutcome(testName, outcome):
+    """Store a test outcome in the run checkpoint, if any."""
+    if commonVars.checkpoint is not None:
+        commonVars.checkpoint.record(testName, outcome)
+
+
+def runTest(test):
+    """
+    Split and execute a single test function with its cleanups.
+    Args:
+        test: Test function to execute.
+    """
+    # INFO("+++ Starting Execution Of TestCase +++")
+    commonVars.currentSectionFailFlag = False
+    testObj = testProc(test)
+    testObj.splitTest()
+    if isinstance(test, testVariant):
+        globals()["case"] = dict(test.case)
+    testLogger.mark("Test", testObj.name)
+    INFO("+++ Starting Execution Of {} +++".format(commonVars.currentTest))
+    stepProperty.TestStepCounter = 0
+    try:
         testObj.runTestStep()
         testObj.runTestClean()
-        # reportVars.TestPassCount+=1
-        INFO("+++ Ending Execution Of {} +++".format(commonVars.currentTest))
+    except SystemExit:
+        # Aborted on failure; parallel workers are recorded by the parent
+        if commonVars.workerId is None:
+            recordOutcome(testObj.name, checkpointStore.FAIL)
+        raise
+    if commonVars.workerId is None:
+        recordOutcome(
+            testObj.name,
+            checkpointStore.FAIL if reportVars.TestFail else checkpointStore.PASS,
+        )
+    # reportVars.TestPassCount+=1
+    INFO("+++ Ending Execution Of {} +++".format(commonVars.currentTest))
+    testLogger.mark("Test", None)
+
+
+reportCounters = (
+    "PassCount",
+    "FailCount",
+    "InfoCount",
+    "DebugCount",
+    "TestPassCount",
+    "TestFailCount",
+)
+
+
+def deviceSlots():
+    """
+    Partition the matched stations into disjoint device sets.
+    The first set is the primary assignment made by stationLoader; further
+    sets are built from the backup stations of every param key that no
+    other run has leased, and are leased for this run.
+    Returns:
+        At most commonVars.parallel {paramkey: station name} dictionaries.
+    """
+    if not commonVars.stnassign:
+        return [{} for _ in range(commonVars.parallel)]
+    slots = [dict(commonVars.stnassign)]
+    used = set(commonVars.stnassign.values())
+    with devices.leases.transaction() as leases:
+        while len(slots) < commonVars.parallel:
+            slot = {}
+            for paramkey in commonVars.stnassign:
+                for stnkey in commonVars.stnbkplist.get(paramkey, {}):
+                    name = station[stnkey].get("name", stnkey)
+                    if stnkey not in used and leases.isFree(name):
+                        slot[paramkey] = stnkey
+                        used.add(stnkey)
+                        break
+                else:
+                    return slots
+            for stnkey in slot.values():
+                leases.take(station[stnkey].get("name", stnkey))
+            slots.append(slot)
+    return slots
+
+
+def testWorker(test, slot, primary, assigned, spool, conn):
+    """
+    Run one test in a forked worker bound to its own stations.
+    Sends the worker's counters back to the parent; records go to spool.
+    Args:
+        test: Test function to execute.
+        slot: {paramkey: station name} assigned to this worker.
+        primary: True for the slot Setup ran on, whose worker keeps the
+                 sessions Setup opened.
+        assigned: Station names held by any worker.
+        spool: File receiving the worker's result records.
+        conn: Pipe end used to return the report.
+    """
+    commonVars.workerId = os.getpid()
+    commonVars.currentTest = test.__name__
+    if commonVars.sessionpool is not None:
+        commonVars.sessionpool.detach()
+    for counter in reportCounters:
+        setattr(reportVars, counter, 0)
+    timing.reset()
+    reportVars.Records.redirect(spool)
+    moved = {devices.bound.get(paramkey): stnkey for paramkey, stnkey in slot.items()}
+    for paramkey, stnkey in slot.items():
+        devices.bind(paramkey, stnkey)
+        globals()[paramkey] = station[stnkey]
+    for stnkey in assigned:
+        devices.dropBackup(stnkey)
+    if slot:
+        DEBUG(f"Stations for '{test.__name__}' are '{slot}'")
+    aborted = False
+    # Inherited handles stay referenced, closing them would log the parent out
+    reopened = workerSessions(moved, keep=primary)
+    try:
+        runTest(test)
+    except SystemExit:
+        aborted = True
+    for handle in reopened.values():
+        if handle is not None and not getattr(handle, "closed", False):
+            close(handle)
+    report = {counter: getattr(reportVars, counter) for counter in reportCounters}
+    report["aborted"] = aborted
+    report["timing"] = timing.stats
+    reportVars.Records.flush()
+    testLogger.flushAll()
+    conn.send(report)
+    conn.close()
+
+
+def workerSessions(moved, keep=False):
+    """
+    Replace the sessions a worker inherited from Setup with its own.
+    Concurrent workers must not share a pty, so every session handle held
+    in a script variable, or in a dict or list in one, is reconnected from
+    the worker: to the worker's station if the session's station was
+    moved to it, else to the same device. Broker sessions of unmoved
+    devices are kept, as the broker runs their commands one at a time.
+    Args:
+        moved: {primary station key: worker station key}.
+        keep: Keep the inherited sessions instead; used by the one worker
+              on the primary slot, which shares them with nobody.
+    Returns:
+        Dictionary of inherited handle -> new handle (None if it failed).
+    """
+    reopened = {}
+
+    def reopen(handle):
+        if keep:
+            if isinstance(handle, pexpect.spawn):
+                inheritSession(handle)
+            return handle
+        if handle not in reopened:
+            conDev = station[handle]
+            stnkey = devices.stationKey(conDev)
+            if stnkey in moved:
+                conDev = station[moved[stnkey]]
+            elif isinstance(handle, sessionBroker.brokerSession):
+                return handle
+            telnet = os.path.basename(getattr(handle, "command", "")) == "telnet"
+            result = connect(conDev, "telnet" if telnet else "ssh")
+            if result["result"] != "ok":
+                ERROR(f"Could not open a worker session to {conDev['name']}")
+            reopened[handle] = result["session"]
+        return reopened[handle]
+
+    def replace(value, depth):
+        if isinstance(value, (pexpect.spawn, sessionBroker.brokerSession)):
+            return reopen(value) if value in station else value
+        if depth == 0:
+            return value
+        if isinstance(value, dict):
+            for key, item in list(value.items()):
+                value[key] = replace(item, depth - 1)
+        elif isinstance(value, list):
+            value[:] = [replace(item, depth - 1) for item in value]
+        return value
+
+    for name, value in list(globals().items()):
+        if name not in ("station", "param") and not name.startswith("__"):
+            globals()[name] = replace(value, 3)
+    return reopened
+
+
+def parallelTestRunner(*testlist):
+    """
+    Run test functions concurrently in forked worker processes.
+    Each running test holds one device slot from deviceSlots(), so no two
+    workers share a station. Outcomes are checkpointed as each worker
+    finishes; reports are merged in test order at the end.
+    Args:
+        *testlist: One or more test functions to execute.
+    """
+    slots = deviceSlots()
+    assigned = {stnkey for slot in slots for stnkey in slot.values()}
+    DEBUG(f"Running tests with {len(slots)} parallel workers")
+    for test in testlist:
+        testCompiler.compileBlocks(getattr(test, "func", test))
+    ctx = multiprocessing.get_context("fork")
+    pending = list(enumerate(testlist))
+    freeSlots = list(range(len(slots)))
+    running = {}
+    results = {}
+    aborted = False
+    spools = {}
+    while running or (pending and not aborted):
+        while pending and freeSlots and not aborted:
+            idx, test = pending.pop(0)
+            slotId = freeSlots.pop(0)
+            fd, spools[idx] = tempfile.mkstemp(prefix="relex", suffix=".jsonl")
+            os.close(fd)
+            testLogger.flushAll()
+            reportVars.Records.flush()
+            recvConn, sendConn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(
+                target=testWorker,
+                args=(
+                    test,
+                    slots[slotId],
+                    slotId == 0,
+                    assigned,
+                    spools[idx],
+                    sendConn,
+                ),
+            )
+            proc.start()
+            sendConn.close()
+            running[recvConn] = (proc, idx, slotId)
+        for conn in multiprocessing.connection.wait(list(running)):
+            proc, idx, slotId = running.pop(conn)
+            try:
+                results[idx] = conn.recv()
+            except EOFError:
+                results[idx] = None
+            conn.close()
+            proc.join()
+            freeSlots.append(slotId)
+            report = results[idx]
+            # Checkpoint each outcome now, so an interrupted run keeps it
+            if report is None:
+                outcome = checkpointStore.CRASH
+            elif report["TestFailCount"] or report["aborted"]:
+                outcome = checkpointStore.FAIL
+            else:
+                outcome = checkpointStore.PASS
+            recordOutcome(testlist[idx].__name__, outcome)
+            if report is not None and report["aborted"]:
+                aborted = True
+
+    commonVars.currentSection = "Test"
+    for idx in sorted(results):
+        report = results[idx]
+        reportVars.Records.merge(spools[idx])
+        if report is None:
+            reportVars.TestFail = False
+            commonVars.currentTest = testlist[idx].__name__
+            ERROR(
+                "Worker for {} exited unexpectedly".format(testlist[idx].__name__)
+            )
+            continue
+        for counter in reportCounters:
+            setattr(
+                reportVars, counter, getattr(reportVars, counter) + report[counter]
+            )
+        timing.merge(report["timing"])
+    if aborted:
+        reportSummary()
+        sys.exit(1)
 
 
 def execBlock(codeblock):
-    """Executes a block of code, handling exceptions."""
+    """
+    Executes a compiled step/clean block, handling exceptions.
+    Raw source strings are still accepted and compiled on the fly.
+    """
     try:
-        testblock = "\n".join(
-            re.sub(r"^\s{4}", "", sline) for sline in codeblock.split("\n")
-        )
-        exec(testblock, globals())
+        if isinstance(codeblock, str):
+            codeblock = "\n".join(
+                re.sub(r"^\s{4}", "", sline) for sline in codeblock.split("\n")
+            )
+        exec(codeblock, globals())
     except Exception as exp:
         ERROR(f"Exception Occured - {type(exp).__name__} - {exp}")
         return False
@@ -225,22 +718,34 @@ class splitProc:
         self.stepList = []
         self.cleanList = []
         self.stepCounter = 0
+        self.name = None
 
     def splitStepClean(self):
-        srclines = inspect.getsourcelines(self.src_func)[0]  # [1:]
-        funcName = srclines.pop(0)
-        try:
-            functionName = re.search("def\s+(\S+)\(\):", funcName).group(1)
-            commonVars.currentTest = functionName
-        except:
-            pass
-        srclines = "".join(srclines)
-        testlines = re.split("#STEP.*\n", srclines)
-        for line in testlines:
-            if line:
-                split_lines = re.split("#CLEAN.*\n", line)
-                self.stepList.append(split_lines[0])
-                self.cleanList.append(split_lines[1] if len(split_lines) > 1 else "")
+        """
+        Load the compiled step and clean blocks of the source function.
+        Blocks are compiled once and cached by testCompiler; matrix
+        variants use the blocks of their test function.
+        """
+        functionName, stepList, cleanList = testCompiler.compileBlocks(
+            getattr(self.src_func, "func", self.src_func)
+        )
+        if isinstance(self.src_func, testVariant):
+            functionName = self.src_func.__name__
+        commonVars.currentTest = functionName
+        self.name = functionName
+        self.stepList = list(stepList)
+        self.cleanList = list(cleanList)
+
+    def runBlock(self, kind, index, codeblock):
+        """
+        Execute one block and record its wall time.
+        Block 0 holds anything before the first #STEP marker.
+        """
+        testLogger.mark(commonVars.currentSection, self.name, kind, index)
+        with timing.span("step", "{} {} {}".format(self.name, kind, index)) as info:
+            result = execBlock(codeblock)
+            info["result"] = "ok" if result else "fail"
+        return result
 
 
 class setupProc(splitProc):
@@ -264,17 +769,18 @@ class setupProc(splitProc):
             if reportVars.SetupFail:
                 break
             self.stepCounter += 1
-            if not execBlock(codeblock):
+            if not self.runBlock("STEP", self.stepCounter - 1, codeblock):
                 reportVars.SetupFail = True
                 break
 
     def runSetupClean(self):
         """Execute setup cleanup steps in reverse order."""
+        commonVars.currentTest = self.name
         for codeblock in reversed(self.cleanList):
             if self.stepCounter <= 0:
                 break
             self.stepCounter -= 1
-            execBlock(codeblock)
+            self.runBlock("CLEAN", self.stepCounter, codeblock)
 
 
 class testProc(splitProc):
@@ -299,7 +805,7 @@ class testProc(splitProc):
             if reportVars.TestFail and not stepProperty.ContinueOnFail:
                 break
             self.stepCounter += 1
-            if not execBlock(codeblock):
+            if not self.runBlock("STEP", self.stepCounter - 1, codeblock):
                 reportVars.TestFail = True
                 if not stepProperty.ContinueOnFail:
                     break
@@ -310,7 +816,123 @@ class testProc(splitProc):
             if self.stepCounter <= 0:
                 break
             self.stepCounter -= 1
-            execBlock(codeblock)
+            self.runBlock("CLEAN", self.stepCounter, codeblock)
+
+
+class fixtureProc(setupProc):
+    """
+    Named setup under lib/fixture shared by the scripts that declare it.
+    The STEP blocks run once; the variables they set (session handles,
+    config state) are handed to every user, and the CLEAN blocks run when
+    the last user releases the fixture.
+    """
+
+    def __init__(self, fixtureName, users=1):
+        super().__init__(libIndex.resolve("fixture", fixtureName))
+        self.fixtureName = fixtureName
+        self.users = users
+        self.owner = os.getpid()
+        self.exports = {}
+        self.stations = []
+        self.failed = False
+
+    def start(self):
+        """Run the STEP blocks and remember the variables they set."""
+        self.splitSetup()
+        before = dict(globals())
+        commonVars.currentSection = "Setup"
+        INFO("Starting fixture {}".format(self.fixtureName))
+        self.runSetupStep()
+        self.failed = reportVars.SetupFail
+        self.stations = list(commonVars.stnmatchlist)
+        self.exports = {
+            name: value
+            for name, value in globals().items()
+            if before.get(name, self) is not value
+        }
+
+    def adopt(self):
+        """Bind the fixture variables in a script forked after start()."""
+        globals().update(self.exports)
+        for value in self.exports.values():
+            if isinstance(value, pexpect.spawn):
+                inheritSession(value)
+        INFO("Using fixture {} started by the suite".format(self.fixtureName))
+        if self.failed:
+            ERROR("Fixture {} failed in its setup".format(self.fixtureName))
+
+    def release(self):
+        """
+        Drop one user and run the CLEAN blocks after the last one.
+        Returns:
+            True if the fixture was cleaned up.
+        """
+        self.users -= 1
+        if self.users > 0:
+            return False
+        commonVars.currentSection = "Setup"
+        self.runSetupClean()
+        INFO("Released fixture {}".format(self.fixtureName))
+        activeFixtures.pop(self.fixtureName, None)
+        return True
+
+
+def inheritSession(handle):
+    """
+    Make a session spawned by a parent process usable after fork.
+    pexpect checks the ssh/telnet process with waitpid, which only works
+    in the process that spawned it; the inherited handle checks it with
+    signal 0 instead, and logs its output to this process.
+    """
+
+    def isalive():
+        try:
+            os.kill(handle.pid, 0)
+        except OSError:
+            return False
+        return True
+
+    handle.ptyproc.isalive = isalive
+    handle.logfile_read = sys.stdout.buffer
+
+
+def useFixtures(fixtureNames):
+    """
+    Start or adopt the fixtures a script declares, in order.
+    Fixtures already started by the suite runner are only adopted; the
+    rest are started here and owned by this script.
+    Args:
+        fixtureNames: Fixture names from testExec.
+    Returns:
+        List of fixtureProc this script has to release.
+    """
+    owned = []
+    for fixtureName in fixtureNames:
+        fixture = activeFixtures.get(fixtureName)
+        if fixture is not None and fixture.owner != os.getpid():
+            fixture.adopt()
+        else:
+            try:
+                fixture = fixtureProc(fixtureName)
+            except IOError:
+                ERROR(
+                    "Unable to find fixture in path - {}".format(
+                        libIndex.fnPath("fixture", fixtureName)
+                    )
+                )
+                break
+            activeFixtures[fixtureName] = fixture
+            owned.append(fixture)
+            fixture.start()
+        if reportVars.SetupFail:
+            break
+    return owned
+
+
+def releaseFixtures(owned):
+    """Release the fixtures returned by useFixtures, last started first."""
+    for fixture in reversed(owned):
+        fixture.release()
 
 
 def stationLoader():
@@ -318,13 +940,14 @@ def stationLoader():
     Loads station and parameter data from YAML files.
     Matches parameters to stations and sets up global references.
     Populates backup lists for alternative matches.
+    Param fields may be plain values or {any: [...]}, {regex: "..."} and
+    {range: [low, high]} criteria, resolved through the station index.
     """
     global param
     global station
     global device
     try:
-        with open(commonVars.stationfile) as tb_data:
-            station_data = yaml.safe_load(tb_data)
+        station_data, stnIndex = stationIndex.loadInventory(commonVars.stationfile)
         with open(commonVars.paramfile) as pf_data:
             param_data = yaml.safe_load(pf_data)
     except Exception as e:
@@ -333,42 +956,159 @@ def stationLoader():
 
     param = param_data
     station = station_data
+    try:
+        downDevices.load()
+    except OSError as e:
+        DEBUG(f"Unable to read down device store: {e}")
+
+    candidateMap = {
+        paramkey: stnIndex.match(paramfields)
+        for paramkey, paramfields in param_data.items()
+        if paramkey != "vars"
+    }
+    # Every station the param file matches, whoever holds it right now
+    commonVars.candidates = {
+        stnkey for candidates in candidateMap.values() for stnkey in candidates
+    }
+    if commonVars.stations is not None:
+        # The suite runner reserved these stations for this script, in
+        # its order of preference per param key
+        candidateMap = {
+            paramkey: [
+                stnkey
+                for stnkey in commonVars.stations.get(paramkey, [])
+                if stnkey in candidates
+            ]
+            for paramkey, candidates in candidateMap.items()
+        }
+    latency = None
+    if commonVars.preflight:
+        latency = preflight(candidateMap, station_data)
+    ranked = {
+        paramkey: rankStations(paramkey, candidates, station_data, latency)
+        for paramkey, candidates in candidateMap.items()
+    }
+    deadline = time.time() + commonVars.leasewait
+    while True:
+        blocked = assignStations(ranked, station_data)
+        if not blocked or time.time() >= deadline:
+            break
+        # Hand back the partial assignment while waiting for other runs
+        devices.leases.release()
+        time.sleep(min(1.0, max(0.0, deadline - time.time())))
+    for paramkey, holders in blocked.items():
+        INFO(f"Stations for '{paramkey}' are leased by {', '.join(holders)}")
+
+
+def assignStations(ranked, station_data):
+    """
+    Bind every param key to its first candidate this run can lease.
+    Other free candidates become backups, leased only on failover;
+    candidates leased by other runs are left out.
+    Args:
+        ranked: {paramkey: candidate station names} from rankStations().
+        station_data: Station dictionary from the testbed file.
+    Returns:
+        {paramkey: [lease holders]} for param keys left without a station
+        because other runs hold all their candidates.
+    """
+    devices.reset(station_data)
     commonVars.stnmatchlist = []
-    commonVars.stnbkplist = {}
+    commonVars.stnbkplist = devices.backups
+    commonVars.stnassign = devices.bound
+    blocked = {}
+    with devices.leases.transaction() as leases:
+        for paramkey, candidates in ranked.items():
+            holders = []
+            for stnkey in candidates:
+                name = station_data[stnkey].get("name", stnkey)
+                if stnkey in devices.roles:
+                    continue
+                if not leases.isFree(name):
+                    holders.append(leases.holder(name))
+                elif paramkey not in devices.bound and leases.take(name):
+                    devices.bind(paramkey, stnkey)
+                    globals()[paramkey] = station_data[stnkey]
+                    commonVars.stnmatchlist.append(stnkey)
+                else:
+                    devices.addBackup(paramkey, stnkey)
+            if paramkey in devices.bound:
+                DEBUG(
+                    f"Backup stations for '{paramkey}' are '{list(devices.backups.get(paramkey, {}))}'"
+                )
+                globals()["device"] = paramkey
+            elif holders:
+                blocked[paramkey] = holders
+            else:
+                DEBUG(f"No match found for param '{paramkey}'")
+    return blocked
 
-    for paramkey, paramfields in param_data.items():
-        if paramkey == "vars":
-            continue
-        first_match = True
-        commonVars.stnbkplist[paramkey] = {}
-        for stnkey, stnfields in station_data.items():
-            if all(item in stnfields.items() for item in paramfields.items()):
-                if stnkey not in commonVars.stnmatchlist:
-                    if first_match:
-                        globals()[paramkey] = station_data[stnkey]
-                        commonVars.stnmatchlist.append(stnkey)
-                        first_match = False
-                    else:
-                        commonVars.stnbkplist[paramkey][stnkey] = {}
-                        commonVars.stnbkplist[paramkey][stnkey] = stnfields
-        if not first_match:
-            DEBUG(
-                f"Backup stations for '{paramkey}' are '{list(commonVars.stnbkplist.get(paramkey, []).keys())}'"
-            )
-            globals()["device"] = paramkey
-        else:
-            DEBUG(f"No match found for param '{paramkey}'")
-    for stn in commonVars.stnmatchlist:
-        for paramkey in param_data.keys():
-            if paramkey != "vars":
-                try:
-                    if stn in commonVars.stnbkplist[paramkey]:
-                        del commonVars.stnbkplist[paramkey][stn]
-                except KeyError:
-                    pass
 
+def preflight(candidateMap, station_data):
+    """
+    Probe every candidate station concurrently before assignment.
+    Args:
+        candidateMap: Dictionary of paramkey -> candidate station names.
+        station_data: Station dictionary from the testbed file.
+    Returns:
+        Dictionary of station name -> TCP connect latency, None if the
+        station did not answer within commonVars.preflight seconds.
+        Stations that could not be probed are left out and ranked as
+        unknown by rankStations().
+    """
+    targets = {}
+    for candidates in candidateMap.values():
+        for stnkey in candidates:
+            fields = station_data[stnkey]
+            if "ip" in fields:
+                targets[stnkey] = (fields["ip"], fields.get("port", 22))
+    latency = reachProbe.probeStations(targets, commonVars.preflight)
+    unreachable = [stnkey for stnkey, lat in latency.items() if lat is None]
+    DEBUG(
+        f"Pre-flight probed {len(latency)} of {len(targets)} stations,"
+        f" unreachable: {unreachable}"
+    )
+    return latency
+
+
+def rankStations(paramkey, candidates, station_data, latency=None):
+    """
+    Order the candidate stations of a param key.
+    Known-down stations are only kept as last-resort backups. With
+    pre-flight results, reachable stations come first, fastest first.
+    Args:
+        paramkey: Param key the candidates belong to.
+        candidates: Matching station names in inventory order.
+        station_data: Station dictionary from the testbed file.
+        latency: Output of preflight() or None.
+    Returns:
+        Reordered list of station names.
+    """
+
+    def rank(stnkey):
+        isDown = downDevices.isDown(station_data[stnkey].get("name", stnkey))
+        if latency is None:
+            return (isDown,)
+        if stnkey not in latency:
+            return (False, isDown, float("inf"))
+        if latency[stnkey] is None:
+            return (True, isDown, 0)
+        return (False, isDown, latency[stnkey])
 
-def testExec(Setup, *test):
+    down = [
+        stnkey
+        for stnkey in candidates
+        if downDevices.isDown(station_data[stnkey].get("name", stnkey))
+    ]
+    if down:
+        DEBUG(
+            f"Demoting known-down stations for '{paramkey}'"
+            f" to last-resort backups: {down}"
+        )
+    return sorted(candidates, key=rank)
+
+
+def testExec(Setup, *test, fixtures=()):
     """
     Executes the test workflow:
     - Initializes logging and configuration variables.
@@ -379,6 +1119,8 @@ def testExec(Setup, *test):
     Args:
         Setup: Setup function to run before tests.
         *test: One or more test functions to execute.
+        fixtures: Names of shared setup fixtures under lib/fixture, set up
+            before Setup and cleaned up after it.
     """
     # Run the setup function
     arg = testArgs.testArgs()
@@ -386,30 +1128,109 @@ def testExec(Setup, *test):
     commonVars.stationfile = arg.station
     commonVars.paramfile = arg.param
     commonVars.loglevel = arg.loglevel
-    testLogger.initLogging(logFile=arg.logfile, level=arg.loglevel)
+    commonVars.parallel = arg.parallel
+    commonVars.controlmaster = arg.controlmaster
+    downDevices.ttl = arg.downttl
+    commonVars.preflight = arg.preflight
+    commonVars.leasewait = arg.leasewait
+    atexit.register(devices.leases.release)
+    if arg.broker:
+        commonVars.broker = sessionBroker.brokerClient(arg.broker)
+    if arg.sessionpool:
+        commonVars.sessionpool = sessionPool.sessionPool()
+        atexit.register(commonVars.sessionpool.closeAll)
+    testLogger.initLogging(
+        logFile=arg.logfile,
+        level=arg.loglevel,
+        flushInterval=arg.logflushinterval,
+        flushSize=arg.logflushsize,
+        compress=arg.logcompress,
+        segmentSize=arg.logsegment << 20,
+    )
+    resultBase = os.path.splitext(arg.logfile)[0]
+    reportVars.Records = reportStore.reportStore(
+        resultBase, os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    )
+    if arg.trace:
+        timing.open(resultBase + ".trace.json")
     global logger
     logger = logging.getLogger(__name__)
     logger.info("Log file: {}".format(arg.logfile))
+    if arg.logcompress != "none":
+        logger.info(
+            "Log segments: {}.NNN.log{}, index {}".format(
+                resultBase,
+                logSegments.suffixes[arg.logcompress],
+                logSegments.indexPath(arg.logfile),
+            )
+        )
+    logger.info("Result files: {0}.jsonl, {0}.xml".format(resultBase))
+    if arg.trace:
+        logger.info("Trace file: {}".format(timing.path))
     logger.info("Station file: {}".format(arg.station))
     logger.info("Param file: {}".format(arg.param))
     logger.info("Log level: {}".format(arg.loglevel))
+    logger.info("Parallel tests: {}".format(arg.parallel))
+    logger.info("Session pool: {}".format(arg.sessionpool))
+    if arg.broker:
+        logger.info("Session broker: {}".format(arg.broker))
     stationLoader()
+    loadCheckpoint(arg)
     INFO(
         "*** Starting Execution Of Script - {} ***".format(
             os.path.realpath(sys.argv[0])
         )
     )
+    commonVars.currentSection = "Setup"
+    ownedFixtures = useFixtures(fixtures)
     setupObj = setupProc(Setup)
     commonVars.currentSection = "Setup"
     setupObj.splitSetup()
-    setupObj.runSetupStep()
+    if reportVars.SetupFail == False:
+        setupObj.runSetupStep()
+    testLogger.mark("Setup", None)
     if reportVars.SetupFail == False:
         splitTestRunner(*test)
     setupObj.runSetupClean()
+    releaseFixtures(ownedFixtures)
+    devices.leases.release()
     INFO("*** Ending Script Execution ***")
     reportSummary()
 
 
+def loadCheckpoint(arg):
+    """
+    Open the checkpoint of this script for the current run.
+    The run is keyed by the script source, the param file and the
+    stations the param file matches; -resume/-rerunfailed only take over
+    the recorded outcomes when the key is unchanged. Leases, down
+    stations and suite reservations only decide which of them a run
+    uses, so they do not change the key.
+    Args:
+        arg: Parsed command line arguments.
+    """
+    key = checkpointStore.runKey(
+        sys.argv[0], commonVars.paramfile, commonVars.candidates
+    )
+    checkpoint = checkpointStore.checkpointStore(sys.argv[0], key)
+    commonVars.checkpoint = checkpoint
+    if arg.rerunfailed:
+        commonVars.rerun = "failed"
+    elif arg.resume:
+        commonVars.rerun = "unpassed"
+    else:
+        checkpoint.reset()
+        return
+    if checkpoint.load():
+        INFO("Resuming from checkpoint {}".format(checkpoint.path))
+    else:
+        INFO(
+            "No checkpoint of a run with this script, param file and stations"
+            " - running all tests"
+        )
+        checkpoint.reset()
+
+
 def connect(conDev, protocol="ssh"):
     """
     Establish a connection to a device using SSH or Telnet.
@@ -420,68 +1241,267 @@ def connect(conDev, protocol="ssh"):
     Returns:
         Dictionary with result status and session handle.
     """
-    ip = conDev["ip"]
-    port = conDev["port"]
-    user = conDev["user"]
-    password = conDev["password"]
     output = {}
     output["result"] = "fail"
     output["session"] = None
-    if re.match("ssh", protocol, re.I):
-        if re.match("linux", conDev["type"], re.I):
-            prompt = "\$"
-        else:
-            prompt = conDev["prompt"]
-        conDevSession = connect_ssh(ip, user, password, prompt, port)
-        for paramkey in param.keys():
-            if paramkey != "vars":
-                if globals()[paramkey] == conDev:
-                    try:
-                        bkp_list_dict = commonVars.stnbkplist[paramkey]
-                        bkp_list = list(bkp_list_dict.items())
-                    except KeyError:
-                        bkp_list = []
-                    break
-        while conDevSession == "fail":
-            with open(os.path.expanduser("~/.REXdevDownList"), "a+") as f:
-                f.seek(0)
-                content = f.read()
-                if not re.search(conDev["name"], content):
-                    f.write(conDev["name"] + "\n")
-            if not bkp_list:
-                return output
-            for newconDev in bkp_list:
-                for paramkey in param.keys():
-                    if paramkey != "vars":
-                        if globals()[paramkey] == conDev:
-                            conDev = newconDev[1]
-                            globals()[paramkey] = conDev
-                            bkp_list.remove(newconDev)
-                break
-            for paramkey in param.keys():
-                if paramkey != "vars":
-                    for k, v in commonVars.stnbkplist[paramkey].items():
-                        if v == conDev:
-                            commonVars.stnbkplist[paramkey].pop(k, None)
-                            DEBUG(
-                                f"Removed {v['name']} from backup list for {paramkey}"
-                            )
-                            break
-            ip = conDev["ip"]
-            port = conDev["port"]
-            user = conDev["user"]
-            password = conDev["password"]
-            if re.match("linux", conDev["type"], re.I):
-                prompt = "\$"
-            else:
-                prompt = conDev["prompt"]
-            conDevSession = connect_ssh(ip, user, password, prompt, port)
+    pooling = commonVars.broker is None and re.match("ssh", protocol, re.I)
+    if pooling:
+        pooled = pooledSession(conDev)
+        if pooled is not None:
+            output["result"] = "ok"
+            output["session"] = pooled
+            return output
+    prompt = devicePrompt(conDev)
+    attempt = 1
+    with timing.span("connect", conDev["name"], attempt=attempt) as info:
+        conDevSession = openSession(conDev, protocol, prompt)
+        info["result"] = "fail" if conDevSession == "fail" else "ok"
+    devkey = devices.roleOf(conDev)
+    while conDevSession == "fail":
+        conDev = failoverStation(conDev, devkey)
+        if conDev is None:
+            return output
+        prompt = devicePrompt(conDev)
+        attempt += 1
+        with timing.span("connect", conDev["name"], attempt=attempt) as info:
+            conDevSession = openSession(conDev, protocol, prompt)
+            info["result"] = "fail" if conDevSession == "fail" else "ok"
+    downDevices.clear(conDev["name"])
+    if pooling and commonVars.sessionpool is not None:
+        commonVars.sessionpool.add(conDev["name"], conDevSession, prompt)
     output["result"] = "ok"
     output["session"] = conDevSession
     station[conDevSession] = conDev
     return output
 
 
+def openSession(conDev, protocol, prompt):
+    """
+    Log in to a device, or lease its session from the session broker.
+    Args:
+        conDev: Device dictionary with connection details.
+        protocol: Connection protocol ("ssh" or "telnet").
+        prompt: Prompt expected from the device.
+    Returns:
+        Session handle or "fail".
+    """
+    if commonVars.broker is not None:
+        try:
+            lease = commonVars.broker.lease(conDev, protocol.lower(), prompt)
+        except (OSError, ValueError) as exp:
+            INFO("Session broker unavailable - {}".format(exp))
+            return "fail"
+        if lease["result"] != "ok":
+            INFO(
+                "Session broker could not lease {} - {}".format(
+                    conDev["name"], lease["reason"]
+                )
+            )
+            return "fail"
+        return lease["session"]
+    if re.match("telnet", protocol, re.I):
+        return connect_telnet(
+            conDev["ip"],
+            conDev["user"],
+            conDev["password"],
+            prompt,
+            port=conDev["port"],
+        )
+    return connect_ssh(
+        conDev["ip"], conDev["user"], conDev["password"], prompt, conDev["port"]
+    )
+
+
+def pooledSession(conDev):
+    """
+    Take an idle session to the device from the session pool, if enabled.
+    Returns:
+        pexpect handle or None.
+    """
+    if commonVars.sessionpool is None:
+        return None
+    pooled = commonVars.sessionpool.acquire(conDev["name"])
+    if pooled is not None:
+        DEBUG(f"Reusing pooled session to {conDev['name']}")
+        station[pooled] = conDev
+    return pooled
+
+
+def devicePrompt(conDev):
+    """
+    Return the prompt expected from a device.
+    Linux devices use the shell prompt, others the prompt from the testbed.
+    """
+    if re.match("linux", conDev["type"], re.I):
+        return "\$"
+    return conDev["prompt"]
+
+
+def failoverStation(conDev, devkey):
+    """
+    Mark a device down and bind the next free backup in its place.
+    Backups taken by concurrent connects or leased by other runs are
+    skipped; the chosen backup is leased for this run and the lease of
+    the failed station is handed back.
+    Args:
+        conDev: Device dictionary that failed to connect.
+        devkey: Param key bound to the device, None if it has none.
+    Returns:
+        The backup device dictionary, or None when none is left.
+    """
+    with connectLock:
+        downDevices.mark(conDev["name"])
+        if devkey is None:
+            return None
+        with devices.leases.transaction() as leases:
+            stnkey = devices.nextBackup(devkey, leases)
+        if stnkey is None:
+            return None
+        devices.leases.release([conDev["name"]])
+        devices.bind(devkey, stnkey)
+        DEBUG(f"Failing over '{devkey}' from {conDev['name']} to {stnkey}")
+        conDev = station[stnkey]
+        globals()[devkey] = conDev
+    return conDev
+
+
+def connect_many(conDevs, protocol="ssh", jobs=32):
+    """
+    Connect to several devices concurrently.
+    Each device goes through connect(), including its own failover to
+    backup stations, in a separate thread, jobs at a time.
+    Args:
+        conDevs: Dictionary of label -> device dictionary,
+                 e.g. {"vm1": vm1, "vm2": vm2}.
+        protocol: Connection protocol ("ssh" or "telnet").
+        jobs: Logins running at once.
+    Returns:
+        Dictionary of label -> connect() result,
+        e.g. {"vm1": {"result": "ok", "session": handle}, ...}.
+    """
+    output = {}
+    if not conDevs:
+        return output
+
+    def connectOne(conDev):
+        try:
+            return connect(conDev, protocol)
+        except Exception as exp:
+            ERROR(f"Exception Occured - {type(exp).__name__} - {exp}")
+            return {"result": "fail", "session": None}
+
+    workers = max(1, min(len(conDevs), jobs))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            label: pool.submit(connectOne, conDev)
+            for label, conDev in conDevs.items()
+        }
+    for label, future in futures.items():
+        output[label] = future.result()
+    return output
+
+
+def push(stations, local, remote, jobs=4, timeout=600):
+    """
+    Copy a local file to several stations over SFTP, jobs at a time.
+    A partial copy left on a station by an interrupted push is resumed,
+    and the file is only put in place once its sha256 matches.
+    Args:
+        stations: Dictionary of label -> device dictionary, or a list of
+                  device dictionaries labelled by station name.
+        local: Local file to copy.
+        remote: Path on the stations; "{name}" is replaced by the
+                station name.
+        jobs: Transfers running at once.
+        timeout: Seconds allowed for one sftp command or checksum.
+    Returns:
+        Dictionary of label -> result, e.g. {"vm1": {"result": "ok",
+        "bytes": 1024, "resumed": 0, "sha256": "..."}, "vm2": {"result":
+        "fail", "reason": "..."}}.
+    """
+    return transferMany("push", stations, local, remote, jobs, timeout)
+
+
+def pull(stations, remote, local, jobs=4, timeout=600):
+    """
+    Copy a file from several stations over SFTP, jobs at a time.
+    A partial local copy left by an interrupted pull is resumed, and the
+    file is only put in place once its sha256 matches.
+    Args:
+        stations: Dictionary of label -> device dictionary, or a list of
+                  device dictionaries labelled by station name.
+        remote: Path on the stations; "{name}" is replaced by the
+                station name.
+        local: Local file; "{name}" is replaced by the station name and
+               must be used when pulling from more than one station.
+        jobs: Transfers running at once.
+        timeout: Seconds allowed for one sftp command or checksum.
+    Returns:
+        Dictionary of label -> result, as push().
+    """
+    if len(stations) > 1 and "{name}" not in local:
+        raise ValueError("pull() from several stations needs {name} in " + local)
+    return transferMany("pull", stations, remote, local, jobs, timeout)
+
+
+def transferMany(direction, stations, source, target, jobs, timeout):
+    """Run push or pull for every station with a bounded thread pool."""
+    if not isinstance(stations, dict):
+        stations = {conDev["name"]: conDev for conDev in stations}
+    output = {}
+    if not stations:
+        return output
+
+    def transferOne(conDev):
+        name = conDev["name"]
+        src = source.replace("{name}", name)
+        dst = target.replace("{name}", name)
+        with timing.span("transfer", name, direction=direction) as info:
+            session = None
+            try:
+                DEBUG(f"Starting {direction} of {src} to {dst} on {name}")
+                session = fileTransfer.sftpSession(conDev, sshOptions(), timeout)
+                if direction == "push":
+                    result = session.push(src, dst)
+                else:
+                    result = session.pull(src, dst)
+            except (
+                fileTransfer.transferError,
+                OSError,
+                pexpect.ExceptionPexpect,
+            ) as exp:
+                result = {"result": "fail", "reason": str(exp)}
+            finally:
+                if session is not None:
+                    session.close()
+            info["result"] = result["result"]
+        if result["result"] == "ok":
+            resumed = result["resumed"]
+            INFO(
+                "{} {} to {} on {} ({} bytes{}, sha256 {})".format(
+                    "Pushed" if direction == "push" else "Pulled",
+                    src,
+                    dst,
+                    name,
+                    result["bytes"],
+                    ", resumed at {}".format(resumed) if resumed else "",
+                    result["sha256"][:12],
+                )
+            )
+        else:
+            INFO(f"Failed to {direction} {src} to {dst} on {name} - {result['reason']}")
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {
+            label: pool.submit(transferOne, conDev)
+            for label, conDev in stations.items()
+        }
+    for label, future in futures.items():
+        output[label] = future.result()
+    return output
+
+
 def connect_ssh(ip, user, password, prompt, port=22, timeout=30):
     """
     Establish an SSH connection using pexpect.
@@ -496,8 +1516,7 @@ def connect_ssh(ip, user, password, prompt, port=22, timeout=30):
     Returns:
         pexpect handle or "fail" on error.
     """
-    spawn_string = "ssh " + user + "@" + ip + " -p " + port
-    handle = pexpect.spawn(spawn_string)
+    handle = pexpect.spawn(sshSpawnString(ip, user, port))
     handle.logfile_read = sys.stdout.buffer
     handle.timeout = timeout
     while True:
@@ -520,6 +1539,7 @@ def connect_ssh(ip, user, password, prompt, port=22, timeout=30):
         if idx == 3:
             handle.sendline()
             handle.expect(prompt)
+            prompts.learn(handle, prompt, handle.before + handle.after)
             break
         if idx == 4:
             handle = "fail"
@@ -532,7 +1552,27 @@ def connect_ssh(ip, user, password, prompt, port=22, timeout=30):
     return handle
 
 
-def connect_telnet(ip, user, password, prompt, timeout=30):
+def sshSpawnString(ip, user, port=22):
+    """Build the ssh command line used to open a device session."""
+    return " ".join(["ssh", user + "@" + ip, "-p", str(port)] + sshOptions())
+
+
+def sshOptions():
+    """Extra ssh options of device sessions and file transfers."""
+    if commonVars.controlmaster:
+        # Multiplex over one master connection per station
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            "ControlPersist=600",
+            "-o",
+            "ControlPath=~/.ssh/relex-%r@%h:%p",
+        ]
+    return []
+
+
+def connect_telnet(ip, user, password, prompt, timeout=30, port=23):
     """
     Establish a Telnet connection using pexpect.
     Handles authentication and prompt matching.
@@ -542,10 +1582,11 @@ def connect_telnet(ip, user, password, prompt, timeout=30):
         password: Password.
         prompt: Shell prompt to expect.
         timeout: Timeout for connection (default 30).
+        port: Telnet port, e.g. the console server port (default 23).
     Returns:
         pexpect handle or "fail" on error.
     """
-    spawn_string = "telnet" + " " + ip
+    spawn_string = "telnet" + " " + ip + " " + str(port)
     handle = pexpect.spawn(spawn_string)
     handle.logfile_read = sys.stdout
     while True:
@@ -569,10 +1610,11 @@ def connect_telnet(ip, user, password, prompt, timeout=30):
         if idx == 6:
             handle.sendline()
             handle.expect(prompt)
+            prompts.learn(handle, prompt, handle.before + handle.after)
             break
         if idx == 7:
             handle = "fail"
-            INFO("connection closed unexpectedly for (}".format(ip))
+            INFO("connection closed unexpectedly for {}".format(ip))
             break
         if idx == 8:
             handle = "fail"
@@ -581,6 +1623,20 @@ def connect_telnet(ip, user, password, prompt, timeout=30):
     return handle
 
 
+def timedCommand(func):
+    """Record the wall time of a command function, named after the command."""
+
+    @functools.wraps(func)
+    def timed(handle, cmd, *args, **kwargs):
+        name = cmd if isinstance(cmd, str) else "; ".join(cmd)
+        device = station.get(handle, {}).get("name")
+        with timing.span("command", name[:60], device=device):
+            return func(handle, cmd, *args, **kwargs)
+
+    return timed
+
+
+@timedCommand
 def command(handle, cmd, prompt="", timeout=30):
     """
     Send a command to the device and capture output.
@@ -593,19 +1649,40 @@ def command(handle, cmd, prompt="", timeout=30):
     Returns:
         Command output as string.
     """
-    if prompt == "":
-        prompt = stepProperty.prompt[handle]
+    if isinstance(handle, sessionBroker.brokerSession):
+        return handle.call("command", cmd, prompt, timeout)
     handle.timeout = timeout
-    expect_list = [pexpect.EOF, pexpect.TIMEOUT]
-    if isinstance(prompt, str):
-        expect_list.append(prompt)
-    elif isinstance(prompt, list):
-        expect_list = expect_list + prompt
-    else:
-        INFO("Prompt doesnt match any category!")
+    searcher = commandSearcher(handle, prompt)
     handle.flush()
     handle.sendline(cmd)
-    idx = handle.expect(expect_list)
+    with timing.span("expect", cmd[:60]):
+        idx = promptCache.expectPrompt(handle, searcher, timeout)
+    return commandOutput(handle, idx, searcher.patterns)
+
+
+def commandSearcher(handle, prompt):
+    """
+    Return the cached searcher used by command(): EOF, TIMEOUT, prompt(s).
+    A string prompt is matched as the exact prompt line learned for the
+    session, so prompt characters inside the output do not end it.
+    Args:
+        handle: pexpect session handle.
+        prompt: Prompt pattern or list of patterns, "" for the prompt the
+            session logged in with.
+    """
+    if prompt == "":
+        prompt = prompts.default(handle)
+    if not isinstance(prompt, (str, list)):
+        INFO("Prompt doesnt match any category!")
+        prompt = []
+    return prompts.searcher(handle, prompt)
+
+
+def commandOutput(handle, idx, expect_list):
+    """
+    Extract the command output after expecting commandSearcher().
+    Drops the echoed command line and a trailing prompt line.
+    """
     if idx == 0:
         INFO("connection closed unexpectedly")
         return
@@ -632,6 +1709,284 @@ def command(handle, cmd, prompt="", timeout=30):
         return cmd_output
 
 
+@timedCommand
+def command_stream(
+    handle, cmd, prompt="", timeout=30, stopOn=None, spillSize=1 << 20, window=1024
+):
+    """
+    Send a command and capture its output incrementally.
+    Output is read in chunks as it arrives and stored in a capturedOutput,
+    which moves to a temporary file once it exceeds spillSize bytes.
+    Args:
+        handle: pexpect session handle.
+        cmd: Command string to send.
+        prompt: Expected prompt after command (optional), string or list.
+        timeout: Timeout for command execution (default 30).
+        stopOn: Optional list of regex patterns. When one matches, the
+                command is interrupted with Ctrl-C and output after the
+                match is discarded; output.match holds (index, match).
+        spillSize: Bytes kept in memory before spilling to disk.
+        window: Bytes held back so patterns spanning chunks still match.
+    Returns:
+        capturedOutput, iterate with output.lines() or output.search().
+    """
+    if isinstance(handle, sessionBroker.brokerSession):
+        ERROR("command_stream is not supported on session broker handles")
+        return None
+    # The learned prompt line, as in command(), so a prompt character in
+    # the echo or the output does not end the capture
+    searcher = commandSearcher(handle, prompt)
+    text = handle.string_type is str
+
+    def raw(data):
+        return data.encode() if text else data
+
+    stopRes = [
+        re.compile(p if text or not isinstance(p, str) else p.encode())
+        for p in stopOn or []
+    ]
+    output = outputCapture.capturedOutput(spillSize)
+    deadline = time.monotonic() + timeout
+    # Drop stale output so an old prompt cannot end the capture
+    handle.buffer = handle.string_type()
+    handle.sendline(cmd)
+    newline = "\n" if text else b"\n"
+    pending = handle.string_type()
+    echoed = False
+    storing = True
+    while True:
+        remaining = deadline - time.monotonic()
+        # A line that may be a changed prompt is taken once output stops
+        settling = echoed and getattr(searcher, "pending", False)
+        wait = min(remaining, promptCache.settleTime) if settling else remaining
+        try:
+            if wait <= 0:
+                raise pexpect.TIMEOUT("command_stream")
+            chunk = handle.read_nonblocking(size=65536, timeout=wait)
+        except pexpect.TIMEOUT:
+            if settling:
+                searcher.settled = True
+                if searcher.search(pending, 0) >= 2:
+                    if storing:
+                        output.write(raw(pending[: searcher.start]))
+                    handle.buffer = pending[searcher.end :]
+                    return output
+                if wait < remaining:
+                    continue
+            output.write(raw(pending))
+            output.timedOut = True
+            INFO("Timeout in executing command")
+            return output
+        except pexpect.EOF:
+            output.write(raw(pending))
+            output.eof = True
+            INFO("connection closed unexpectedly")
+            return output
+        data = pending + chunk
+        if storing:
+            for idx, stopRe in enumerate(stopRes):
+                match = stopRe.search(data)
+                if match:
+                    output.write(raw(data[: match.end()]))
+                    output.match = (idx, match)
+                    storing = False
+                    handle.sendcontrol("c")
+                    break
+        # The prompt can only follow the end of the echoed command line
+        echoed = echoed or newline in data
+        if echoed and searcher.search(data, len(chunk)) >= 2:
+            if storing:
+                output.write(raw(data[: searcher.start]))
+            handle.buffer = data[searcher.end :]
+            return output
+        pending = data[-window:]
+        if storing:
+            output.write(raw(data[:-window]))
+
+
+@timedCommand
+def command_batch(handle, cmds, prompt="", timeout=30):
+    """
+    Send several commands to the device in one round-trip.
+    On Linux devices the commands are sent as one shell line, each wrapped
+    in eval and followed by a sentinel carrying its index and exit status,
+    so outputs are split on the sentinels rather than on the prompt.
+    Other devices get all commands in one write and the output is split
+    on the learned prompt lines, as in command(), dropping the echoes of
+    the commands where the device shows them (see batchOutputs()).
+    Args:
+        handle: pexpect session handle.
+        cmds: List of command strings.
+        prompt: Expected prompt after the batch (optional), string or list.
+        timeout: Timeout for the whole batch (default 30).
+    Returns:
+        Dictionary with result status, "output" (one string per command,
+        None if it did not complete) and "status" (exit status per command
+        on Linux devices, otherwise None).
+    """
+    output = {}
+    output["result"] = "fail"
+    output["output"] = [None] * len(cmds)
+    output["status"] = [None] * len(cmds)
+    if not cmds:
+        output["result"] = "ok"
+        return output
+    if isinstance(handle, sessionBroker.brokerSession):
+        return handle.call("command_batch", cmds, prompt, timeout)
+    if isinstance(prompt, bytes):
+        prompt = prompt.decode()
+    searcher = commandSearcher(handle, prompt)
+    loose = "|".join("(?:{})".format(p) for p in searcher.patterns[2:])
+    deadline = time.monotonic() + timeout
+    handle.timeout = timeout
+    handle.flush()
+    conDev = station.get(handle, {})
+    if re.match("linux", conDev.get("type", ""), re.I):
+        # The echoed line shows the printf escapes literally, so only the
+        # real sentinels contain the \036 bytes
+        token = "RLX" + os.urandom(4).hex()
+        line = "printf '\\036{}:B\\036\\n'".format(token)
+        for idx, cmd in enumerate(cmds):
+            line += "; eval {}; printf '\\036{}:%d:%d\\036\\n' {} $?".format(
+                shlex.quote(cmd), token, idx
+            )
+        marker = re.compile(
+            b"\x1e" + token.encode() + rb":(?:B|(\d+):(\d+))\x1e\r?\n?"
+        )
+        last = re.compile(
+            b"\x1e"
+            + token.encode()
+            + b":"
+            + str(len(cmds) - 1).encode()
+            + rb":\d+\x1e"
+        )
+        handle.sendline(line)
+        idx = handle.expect([pexpect.EOF, pexpect.TIMEOUT, last])
+        data = handle.before
+        if idx == 2:
+            data += handle.after
+        start = None
+        for found in marker.finditer(data):
+            if found.group(1) is not None and start is not None:
+                pos = int(found.group(1))
+                output["output"][pos] = data[start : found.start()].decode(
+                    "utf-8", errors="ignore"
+                )
+                output["status"][pos] = int(found.group(2))
+            start = found.end()
+        if idx == 0:
+            INFO("connection closed unexpectedly")
+            return output
+        if idx == 1:
+            INFO("Timeout in executing command batch")
+            return output
+        # Resynchronise on the prompt line that follows the last sentinel
+        promptCache.expectPrompt(
+            handle, searcher, max(deadline - time.monotonic(), 1)
+        )
+    else:
+        # One write for the whole batch, so the device gets every command
+        # after a single round-trip and pexpect's delaybeforesend is paid
+        # once
+        handle.send("".join(cmd + os.linesep for cmd in cmds))
+        segments = []
+        while len(segments) < len(cmds):
+            known = getattr(searcher, "exact", None)
+            remaining = max(deadline - time.monotonic(), 0)
+            idx = promptCache.expectPrompt(handle, searcher, remaining)
+            if idx == 0:
+                INFO("connection closed unexpectedly")
+                return output
+            if idx == 1:
+                INFO("Timeout in executing command batch")
+                return output
+            segments.append(handle.before.decode("utf-8", errors="ignore"))
+            if getattr(searcher, "exact", None) != known:
+                # A changed prompt is only taken once the device is quiet,
+                # so all output is in
+                break
+        learned = [known, getattr(searcher, "exact", None)]
+        learned = [
+            prompt.decode("utf-8", errors="ignore")
+            for prompt in learned
+            if isinstance(prompt, bytes)
+        ]
+        outputs = batchOutputs(segments, cmds, loose, learned)
+        output["output"][: len(outputs)] = outputs
+        if len(outputs) < len(cmds):
+            INFO("Prompt not found after every command of the batch")
+            return output
+    output["result"] = "ok"
+    return output
+
+
+def batchOutputs(segments, cmds, loose, prompts=()):
+    """
+    Split the output of a pipelined command_batch() per command.
+    The output before each prompt line is one command's output. Echoes of
+    the commands are dropped where present: all of them typed ahead before
+    the first output, or each one after the prompt it was read at. Where a
+    changed prompt merged outputs, a line starting with one of the learned
+    prompts, or matching the loose prompt pattern followed by the echo of
+    the next command, also ends an output.
+    Args:
+        segments: Output before each prompt line matched, decoded.
+        cmds: Commands of the batch.
+        loose: Prompt pattern of the batch.
+        prompts: Exact prompt lines learned before and after the batch.
+    Returns:
+        List of outputs, one per command that completed.
+    """
+    looseRe = re.compile(loose)
+    known = [prompt for prompt in prompts if prompt]
+    echoes = [cmd.strip() for cmd in cmds] + [""]
+    outputs = []
+    lines = []
+
+    def promptRest(text):
+        # Text after a learned prompt at the start of text, None if none
+        for prompt in known:
+            if text.startswith(prompt):
+                return text[len(prompt) :]
+        return None
+
+    for seg, segment in enumerate(segments):
+        segLines = segment.split("\r\n")
+        if seg == 0:
+            # Echo of the first command and any typed-ahead echoes
+            skip = 0
+            while skip < min(len(segLines), len(cmds)) and (
+                segLines[skip].strip() == echoes[skip]
+            ):
+                skip += 1
+            segLines = segLines[skip:]
+        for num, line in enumerate(segLines):
+            text = line.rstrip()
+            echo = echoes[min(len(outputs) + 1, len(cmds))]
+            if seg > 0 and num == 0:
+                rest = line
+            elif echo and text.endswith(echo) and looseRe.search(text[: -len(echo)]):
+                rest = echo
+            else:
+                rest = promptRest(text)
+            if rest is None:
+                lines.append(line)
+                continue
+            # A prompt line ends the output; the rest of it is the echo of
+            # the next command, another prompt, or the start of its output
+            while rest is not None:
+                outputs.append("\r\n".join(lines))
+                lines = []
+                rest = rest.lstrip()
+                nested = promptRest(rest)
+                if nested is None and rest.strip():
+                    if rest.strip() != echoes[min(len(outputs), len(cmds))]:
+                        lines.append(rest)
+                rest = nested
+    outputs.append("\r\n".join(lines))
+    return outputs[: len(cmds)]
+
+
 def sendCntrl(handle, char):
     """
     Send a control character to the device session.
@@ -639,12 +1994,17 @@ def sendCntrl(handle, char):
         handle: pexpect session handle.
         char: Control character to send.
     """
-    handle.sendControl(char)
+    if isinstance(handle, sessionBroker.brokerSession):
+        handle.call("sendCntrl", char)
+        return
+    handle.sendcontrol(char)
 
 
 def close(handle):
     """
     Close the device session handle.
+    Pooled sessions are returned to the session pool and broker sessions
+    to the session broker instead.
     Returns a result dictionary indicating success or failure.
     Args:
         handle: pexpect session handle.
@@ -653,11 +2013,20 @@ def close(handle):
     """
     output = {}
     output["result"] = "fail"
+    if isinstance(handle, sessionBroker.brokerSession):
+        # The session stays logged in for the next lease
+        output["result"] = handle.release()["result"]
+        return output
+    if commonVars.sessionpool is not None:
+        if commonVars.sessionpool.release(handle):
+            output["result"] = "ok"
+            return output
     try:
         handle.close()
     except Exception as exp:
         ERROR("Exception Occured - " + type(exp).__name__ + " - " + str(exp))
         return output
+    prompts.forget(handle)
     output["result"] = "ok"
     return output
 
@@ -680,18 +2049,310 @@ def lib(fnType, fnName, *args, **kwargs):
     Returns:
         Result of the invoked function or None on error.
     """
-    basepath = os.path.dirname(os.path.abspath(__file__))
-    if fnType == "util":
-        fnPath = basepath + "/../" + "utility" + "/" + fnName + ".py"
-    elif fnType == "wf":
-        fnPath = basepath + "/../" + "workflow" + "/" + fnName + ".py"
-    elif fnType == "func":
-        type = station[args[0]]["type"]
-        fnPath = basepath + "/../" + "func" + "/" + type + "/" + fnName + ".py"
+    devType = None
+    if fnType == "func":
+        devType = station[args[0]]["type"]
+    elif fnType not in ("util", "wf"):
+        ERROR("Unknown function type - {}".format(fnType))
+        return
     try:
-        fnCall = imp.load_source(fnName, fnPath)
+        tmpfunc = libIndex.resolve(fnType, fnName, devType)
     except IOError:
-        ERROR("Unable to find function in path - {}".format(fnPath))
+        ERROR(
+            "Unable to find function in path - {}".format(
+                libIndex.fnPath(fnType, fnName, devType)
+            )
+        )
         return
-    tmpfunc = getattr(fnCall, fnName)
     return tmpfunc(*args, **kwargs)
+
+
+def parse(handle, cmd, cmd_output):
+    """
+    Parse command output into records with the template for the command.
+    Templates live in lib/template/<device type> and are compiled once.
+    Args:
+        handle: pexpect session handle, used to find the device type.
+        cmd: Command that produced the output.
+        cmd_output: Output string, or capturedOutput from command_stream().
+    Returns:
+        List of dictionaries, one per record, or None on error.
+    """
+    devType = station[handle]["type"]
+    try:
+        template = templateIndex.resolve(devType, cmd)
+    except (IOError, ValueError) as exp:
+        ERROR("Unable to load template - " + str(exp))
+        return
+    if isinstance(cmd_output, outputCapture.capturedOutput):
+        cmd_output = cmd_output.lines()
+    elif cmd_output is None:
+        cmd_output = ""
+    return list(template.parse(cmd_output))
+
+
+def command_parsed(handle, cmd, prompt="", timeout=30):
+    """
+    Send a command and parse its output with the matching template.
+    Args:
+        handle: pexpect session handle.
+        cmd: Command string to send.
+        prompt: Expected prompt after command (optional).
+        timeout: Timeout for command execution (default 30).
+    Returns:
+        List of dictionaries, one per record, or None on error.
+    """
+    return parse(handle, cmd, command(handle, cmd, prompt, timeout))
+
+
+async def connect_async(conDev, protocol="ssh"):
+    """
+    Asynchronous connect(), with the same prompt and failover handling.
+    Many devices can be connected from one event loop, e.g.
+    run_async([connect_async(dev) for dev in devices]). With -broker the
+    session is leased from the session broker, as in connect().
+    Args:
+        conDev: Device dictionary with connection details.
+        protocol: Connection protocol ("ssh" or "telnet").
+    Returns:
+        Dictionary with result status and session handle.
+    """
+    output = {}
+    output["result"] = "fail"
+    output["session"] = None
+    telnet = re.match("telnet", protocol, re.I)
+    if not telnet and commonVars.broker is None:
+        pooled = pooledSession(conDev)
+        if pooled is not None:
+            output["result"] = "ok"
+            output["session"] = pooled
+            return output
+    devkey = devices.roleOf(conDev)
+    attempt = 0
+    while True:
+        prompt = devicePrompt(conDev)
+        attempt += 1
+        start = time.time()
+        began = time.perf_counter()
+        if commonVars.broker is not None:
+            # Broker requests block on its socket
+            conDevSession = await asyncSession.run(
+                openSession, conDev, protocol, prompt
+            )
+        elif telnet:
+            conDevSession = await connect_telnet_async(
+                conDev["ip"],
+                conDev["user"],
+                conDev["password"],
+                prompt,
+                port=conDev["port"],
+            )
+        else:
+            conDevSession = await connect_ssh_async(
+                conDev["ip"],
+                conDev["user"],
+                conDev["password"],
+                prompt,
+                conDev["port"],
+            )
+        timing.add(
+            "connect",
+            conDev["name"],
+            start,
+            time.perf_counter() - began,
+            tid=asyncTraceId(conDev["name"]),
+            attempt=attempt,
+            result="fail" if conDevSession == "fail" else "ok",
+        )
+        if conDevSession != "fail":
+            break
+        conDev = failoverStation(conDev, devkey)
+        if conDev is None:
+            return output
+    downDevices.clear(conDev["name"])
+    pooling = not telnet and commonVars.broker is None
+    if pooling and commonVars.sessionpool is not None:
+        commonVars.sessionpool.add(conDev["name"], conDevSession, prompt)
+    output["result"] = "ok"
+    output["session"] = conDevSession
+    station[conDevSession] = conDev
+    return output
+
+
+async def connect_ssh_async(ip, user, password, prompt, port=22, timeout=30):
+    """
+    Asynchronous connect_ssh().
+    Returns:
+        pexpect handle or "fail" on error.
+    """
+    handle = pexpect.spawn(sshSpawnString(ip, user, port))
+    handle.logfile_read = sys.stdout.buffer
+    handle.timeout = timeout
+    if isinstance(prompt, bytes):
+        prompt = prompt.decode()
+    delay = asyncSession.loginDelay
+    while True:
+        idx = await expect_async(
+            handle,
+            [
+                "continue connecting (yes/no)?",
+                "password:",
+                "Password",
+                prompt,
+                pexpect.EOF,
+                pexpect.TIMEOUT,
+            ],
+        )
+        if idx == 0:
+            await asyncSession.sendline(handle, "yes", delay)
+        if 1 <= idx <= 2:
+            await asyncSession.sendline(handle, password, delay)
+        if idx == 3:
+            await asyncSession.sendline(handle)
+            await expect_async(handle, prompt)
+            prompts.learn(handle, prompt, handle.before + handle.after)
+            return handle
+        if idx == 4:
+            INFO("connection closed unexpectedly for {}".format(ip))
+            return "fail"
+        if idx == 5:
+            INFO("Timeout in getting connection for {}".format(ip))
+            return "fail"
+
+
+async def connect_telnet_async(ip, user, password, prompt, timeout=30, port=23):
+    """
+    Asynchronous connect_telnet().
+    Returns:
+        pexpect handle or "fail" on error.
+    """
+    handle = pexpect.spawn("telnet" + " " + ip + " " + str(port))
+    handle.logfile_read = sys.stdout.buffer
+    handle.timeout = timeout
+    delay = asyncSession.loginDelay
+    while True:
+        idx = await expect_async(
+            handle,
+            [
+                "user:",
+                "User:",
+                "username:",
+                "Username:",
+                "password:",
+                "Password:",
+                prompt,
+                pexpect.EOF,
+                pexpect.TIMEOUT,
+            ],
+        )
+        if 0 <= idx <= 3:
+            await asyncSession.sendline(handle, user, delay)
+        if 4 <= idx <= 5:
+            await asyncSession.sendline(handle, password, delay)
+        if idx == 6:
+            await asyncSession.sendline(handle)
+            await expect_async(handle, prompt)
+            prompts.learn(handle, prompt, handle.before + handle.after)
+            return handle
+        if idx == 7:
+            INFO("connection closed unexpectedly for {}".format(ip))
+            return "fail"
+        if idx == 8:
+            INFO("Timeout in getting connection for {}".format(ip))
+            return "fail"
+
+
+async def expect_async(handle, patterns, timeout=-1):
+    """
+    Wait for patterns on a session without blocking the event loop.
+    Args:
+        handle: pexpect session handle.
+        patterns: Pattern or list of patterns (pexpect.EOF/TIMEOUT allowed).
+        timeout: Seconds to wait, -1 uses the handle timeout.
+    Returns:
+        Index of the matched pattern.
+    """
+    return await asyncSession.expect(handle, patterns, timeout)
+
+
+async def command_async(handle, cmd, prompt="", timeout=30):
+    """
+    Asynchronous command(); returns the same output.
+    Args:
+        handle: pexpect session handle.
+        cmd: Command string to send.
+        prompt: Expected prompt after command (optional).
+        timeout: Timeout for command execution (default 30).
+    Returns:
+        Command output as string.
+    """
+    if isinstance(handle, sessionBroker.brokerSession):
+        return await asyncSession.run(handle.call, "command", cmd, prompt, timeout)
+    handle.timeout = timeout
+    searcher = commandSearcher(handle, prompt)
+    start = time.time()
+    began = time.perf_counter()
+    handle.flush()
+    await asyncSession.sendline(handle, cmd)
+    idx = await expect_async(handle, searcher)
+    # Concurrent commands overlap, so each session gets its own trace row
+    timing.add(
+        "command",
+        cmd[:60],
+        start,
+        time.perf_counter() - began,
+        tid=asyncTraceId(station.get(handle, {}).get("name", handle.pid)),
+        device=station.get(handle, {}).get("name"),
+    )
+    return commandOutput(handle, idx, searcher.patterns)
+
+
+async def close_async(handle):
+    """
+    Asynchronous close(); pooled sessions are returned to the pool and
+    broker sessions to the session broker.
+    Returns:
+        Dictionary with result status.
+    """
+    output = {}
+    output["result"] = "fail"
+    if isinstance(handle, sessionBroker.brokerSession):
+        output["result"] = (await asyncSession.run(handle.release))["result"]
+        return output
+    if commonVars.sessionpool is not None:
+        if commonVars.sessionpool.release(handle):
+            output["result"] = "ok"
+            return output
+    try:
+        await asyncSession.close(handle)
+    except Exception as exp:
+        ERROR("Exception Occured - " + type(exp).__name__ + " - " + str(exp))
+        return output
+    prompts.forget(handle)
+    output["result"] = "ok"
+    return output
+
+
+def asyncTraceId(key):
+    """Trace row for a device, so concurrent async spans do not overlap."""
+    return zlib.crc32(str(key).encode())
+
+
+def run_async(coros, limit=None):
+    """
+    Run coroutines on one event loop from a STEP block.
+    Exceptions are reported with ERROR and give None in their place.
+    Args:
+        coros: List of coroutines, e.g. [command_async(h, "uptime") ...].
+        limit: Maximum number running at once (optional).
+    Returns:
+        List of results in the order of coros.
+    """
+    results = asyncio.run(asyncSession.gather(coros, limit))
+    for pos, result in enumerate(results):
+        if isinstance(result, BaseException):
+            ERROR(
+                "Exception Occured - " + type(result).__name__ + " - " + str(result)
+            )
+            results[pos] = None
+    return results
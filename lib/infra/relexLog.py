@@ -0,0 +1,127 @@
+############################################################################
+#
+#    relex-log - shows one test or step of a relex log through its index
+#
+#    Usage:
+#        python relexLog.py logs/hello_2025-09-06T10:32:57.log -list
+#        python relexLog.py logs/hello_2025-09-06T10:32:57.log -test Test1
+#        python relexLog.py logs/hello_2025-09-06T10:32:57.log -test Test1 -step 2
+#
+############################################################################
+
+import argparse
+import os
+import sys
+
+import logSegments
+
+
+def logArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logfile", help="Log file given to the script with -logfile")
+    parser.add_argument(
+        "-list", help="List the indexed tests and steps", action="store_true"
+    )
+    parser.add_argument("-test", help="Show the log of this setup, fixture or test")
+    parser.add_argument("-step", help="Only show this step", type=int)
+    parser.add_argument(
+        "-block",
+        help="Block kind of -step",
+        choices=["STEP", "CLEAN"],
+        default="STEP",
+    )
+    return parser.parse_args(sys.argv[1:])
+
+
+def streams(entries):
+    """Group index entries by the process that wrote them, in write order."""
+    grouped = {}
+    for entry in entries:
+        grouped.setdefault((entry["stream"], entry["pid"]), []).append(entry)
+    return grouped
+
+
+def slices(entries, test, step=None, block="STEP"):
+    """
+    Find the parts of the log written for a test or one of its steps.
+    A part runs from a matching index entry up to the next entry of the
+    same process that does not belong to it.
+    Returns:
+        List of (start entry, length or None for the rest of the stream).
+    """
+    found = []
+    for streamEntries in streams(entries).values():
+        start = None
+        for entry in streamEntries:
+            if step is None:
+                inside = entry["test"] == test
+            else:
+                inside = (
+                    entry["test"] == test
+                    and entry["block"] == block
+                    and entry["step"] == step
+                )
+            if inside and start is None:
+                start = entry
+            elif not inside and start is not None:
+                found.append((start, entry["pos"] - start["pos"]))
+                start = None
+        if start is not None:
+            found.append((start, None))
+    found.sort(key=lambda part: part[0]["time"])
+    return found
+
+
+def listIndex(entries):
+    print(
+        "{:<8} {:<36} {:<6} {:>4}  {:<28} {:>12}".format(
+            "Section", "Name", "Block", "Step", "Segment", "Position"
+        )
+    )
+    for entry in entries:
+        if entry["test"] is None:
+            # End of a test
+            continue
+        print(
+            "{:<8} {:<36} {:<6} {:>4}  {:<28} {:>12}".format(
+                entry["section"] or "",
+                entry["test"] or "",
+                entry["block"] or "",
+                "" if entry["step"] is None else entry["step"],
+                entry["file"],
+                entry["pos"],
+            )
+        )
+
+
+def main():
+    arg = logArgs()
+    try:
+        entries = logSegments.loadIndex(arg.logfile)
+    except OSError as exp:
+        print("Cannot read the log index: {}".format(exp))
+        return 1
+    if arg.list:
+        listIndex(entries)
+        return 0
+    directory = os.path.dirname(os.path.abspath(arg.logfile))
+    if arg.test is None:
+        # The whole log of the main process
+        parts = [(entries[0], None)] if entries else []
+        if parts:
+            parts[0][0].update(segment=0, offset=0)
+    else:
+        parts = slices(entries, arg.test, arg.step, arg.block)
+        if not parts:
+            print("No {} in the log index".format(arg.test))
+            return 1
+    out = sys.stdout.buffer
+    for start, length in parts:
+        for data in logSegments.readStream(directory, start, length):
+            out.write(data)
+    out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import datetime
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+# Level codes stored in result records
+OK, FAIL, ERROR, INFO, DEBUG = range(5)
+levelNames = ("OK", "FAIL", "ERROR", "INFO", "DEBUG")
+levelCodes = {name: code for code, name in enumerate(levelNames)}
+
+jsonString = json.encoder.encode_basestring_ascii
+
+# Characters not allowed in XML 1.0 documents
+xmlInvalid = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class resultRecord:
+    """Single OK/FAIL/ERROR/INFO/DEBUG entry of a run."""
+
+    __slots__ = ("time", "level", "section", "test", "msg")
+
+    def __init__(self, stamp, level, section, test, msg):
+        self.time = stamp
+        self.level = level
+        self.section = section
+        self.test = test
+        self.msg = msg
+
+    def toJson(self):
+        # Hand-assembled, json.dumps on a dict dominates the cost of OK()
+        return '{"time": %r, "level": "%s", "section": %s, "test": %s, "msg": %s}' % (
+            self.time,
+            levelNames[self.level],
+            "null" if self.section is None else jsonString(str(self.section)),
+            "null" if self.test is None else jsonString(str(self.test)),
+            jsonString(self.msg),
+        )
+
+    @classmethod
+    def fromJson(cls, line):
+        data = json.loads(line)
+        return cls(
+            data["time"],
+            levelCodes[data["level"]],
+            data["section"],
+            data["test"],
+            data["msg"],
+        )
+
+    def format(self):
+        """Format the record the way the execution summary prints it."""
+        stamp = datetime.datetime.fromtimestamp(self.time)
+        stamp = stamp.strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
+        return stamp + " - [" + levelNames[self.level] + "] - " + self.msg
+
+
+class junitWriter:
+    """
+    Streams result records into a JUnit XML file.
+    Every setup or test function becomes one testcase, written out as soon
+    as the records move on to the next one.
+    """
+
+    def __init__(self, path, suiteName):
+        self.file = open(path, "w", encoding="utf-8")
+        self.suiteName = suiteName
+        self.case = None
+        self.start = 0
+        self.end = 0
+        self.failures = []
+        self.file.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self.file.write("<testsuite name={}>\n".format(quoteattr(suiteName)))
+
+    def add(self, rec):
+        case = rec.test or "Script"
+        if case != self.case:
+            self._writeCase()
+            self.case = case
+            self.start = rec.time
+            self.failures = []
+        self.end = rec.time
+        if rec.level in (FAIL, ERROR):
+            self.failures.append(rec)
+
+    def _writeCase(self):
+        # Records outside any setup/test only matter when they failed
+        if self.case is None or (self.case == "Script" and not self.failures):
+            return
+        self.file.write(
+            '  <testcase classname={} name={} time="{:.3f}"'.format(
+                quoteattr(self.suiteName),
+                quoteattr(self.case),
+                self.end - self.start,
+            )
+        )
+        if not self.failures:
+            self.file.write("/>\n")
+            return
+        self.file.write(">\n")
+        for rec in self.failures:
+            msg = xmlInvalid.sub("", rec.msg)
+            self.file.write(
+                "    <failure type={} message={}>{}</failure>\n".format(
+                    quoteattr(levelNames[rec.level]), quoteattr(msg), escape(msg)
+                )
+            )
+        self.file.write("  </testcase>\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self._writeCase()
+        self.case = None
+        self.file.write("</testsuite>\n")
+        self.file.close()
+
+
+class reportStore:
+    """
+    Append-only store of result records.
+    Records are streamed to a JSON-lines file (and optionally a JUnit XML
+    file) as they arrive; none are kept in memory.
+    """
+
+    def __init__(self, base=None, suiteName="relex"):
+        """
+        Args:
+            base: Path prefix for <base>.jsonl and <base>.xml. Without it
+                  records are spooled to a temporary file.
+            suiteName: Test suite name used in the JUnit file.
+        """
+        self.lock = threading.Lock()
+        self.junit = None
+        if base is None:
+            self.file = tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", prefix="relex", suffix=".jsonl"
+            )
+        else:
+            self.file = open(base + ".jsonl", "w", encoding="utf-8")
+            self.junit = junitWriter(base + ".xml", suiteName)
+
+    def add(self, level, msg, section=None, test=None, stamp=None):
+        """
+        Store one record.
+        Args:
+            level: Level code (OK, FAIL, ERROR, INFO or DEBUG).
+            msg: Message text.
+            section: Current section ("Setup", "Test", ...).
+            test: Current setup/test function name.
+            stamp: Epoch timestamp, defaults to now.
+        Returns:
+            The stored resultRecord.
+        """
+        if stamp is None:
+            stamp = time.time()
+        rec = resultRecord(stamp, level, section, test, msg)
+        self._store(rec, rec.toJson())
+        return rec
+
+    def _store(self, rec, line):
+        with self.lock:
+            self.file.write(line + "\n")
+            if self.junit is not None:
+                self.junit.add(rec)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            if self.junit is not None:
+                self.junit.flush()
+
+    def redirect(self, path):
+        """
+        Send further records to a new spool file.
+        Used by forked workers so the parent can merge their records in
+        order; the JUnit file is left to the parent. The spool is line
+        buffered so records survive a crashing worker.
+        Args:
+            path: Spool file for this process.
+        """
+        # Keep the inherited files referenced; closing them here could
+        # flush into or delete the parent's files
+        self.inherited = (self.file, self.junit)
+        self.lock = threading.Lock()
+        self.file = open(path, "w", encoding="utf-8", buffering=1)
+        self.junit = None
+
+    def merge(self, path):
+        """
+        Append the records of a worker spool file and delete it.
+        Args:
+            path: Spool file written by a worker.
+        """
+        try:
+            with open(path, encoding="utf-8") as spool:
+                for line in spool:
+                    line = line.rstrip("\n")
+                    if line:
+                        self._store(resultRecord.fromJson(line), line)
+        except OSError:
+            return
+        os.remove(path)
+
+    def records(self):
+        """Iterate over all records from the start of the run."""
+        self.flush()
+        with open(self.file.name, encoding="utf-8") as spool:
+            for line in spool:
+                yield resultRecord.fromJson(line)
+
+    def lines(self):
+        """Iterate over the formatted records without loading them all."""
+        for rec in self.records():
+            yield rec.format()
+
+    def close(self):
+        """Finish the JUnit file and flush the record file."""
+        with self.lock:
+            if self.junit is not None:
+                self.junit.close()
+                self.junit = None
+            self.file.flush()
@@ -0,0 +1,469 @@
+############################################################################
+#
+#    Session broker - keeps device sessions open across relex scripts
+#
+#    Usage:
+#        python sessionBroker.py -socket ~/.REXbroker.sock -idle 600
+#        python script.py -logfile X -param Y -broker
+#
+#    Scripts started with -broker start the broker themselves when it is
+#    not running yet.
+#
+############################################################################
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import relex
+import testLogger
+
+logger = logging.getLogger("sessionBroker")
+
+defaultSocket = os.path.expanduser("~/.REXbroker.sock")
+
+# relex functions a leased session may run inside the broker
+brokerCalls = ("command", "command_batch", "sendCntrl")
+
+
+def jsonDefault(value):
+    """Encode the bytes relex returns on a command timeout."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="ignore")
+    return str(value)
+
+
+class brokerEntry:
+    """A device session owned by the broker."""
+
+    def __init__(self, key, conDev, protocol, prompt):
+        self.key = key
+        self.conDev = conDev
+        self.protocol = protocol
+        self.prompt = prompt
+        self.handle = None
+        self.lease = None
+        self.lastUsed = time.monotonic()
+        self.leaseCount = 0
+
+
+class sessionBroker:
+    """
+    Long-lived ssh/telnet sessions shared by the scripts of a host.
+    A session is leased to one script at a time; later leases of the same
+    device wait for it and reuse the logged-in session instead of opening
+    a new one. Sessions unused for idle seconds are closed.
+    """
+
+    def __init__(self, idle=600):
+        self.cond = threading.Condition()
+        self.entries = {}
+        self.leased = {}
+        self.idle = idle
+        self.ids = itertools.count(1)
+        self.stopEvent = threading.Event()
+
+    def lease(self, conDev, protocol, prompt, wait=300):
+        """
+        Lease the session to a device, logging in if there is none.
+        Args:
+            conDev: Device dictionary (ip, port, user, password, name).
+            protocol: "ssh" or "telnet".
+            prompt: Prompt expected from the device.
+            wait: Seconds to wait while another script holds the session.
+        Returns:
+            Reply dictionary with the lease id.
+        """
+        key = "{}://{}@{}:{}".format(
+            protocol, conDev["user"], conDev["ip"], conDev["port"]
+        )
+        deadline = time.monotonic() + wait
+        with self.cond:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = brokerEntry(key, conDev, protocol, prompt)
+                self.entries[key] = entry
+            while entry.lease is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {"result": "fail", "reason": "session is busy"}
+                self.cond.wait(remaining)
+            leaseId = next(self.ids)
+            entry.lease = leaseId
+            entry.leaseCount += 1
+            self.leased[leaseId] = entry
+        # The entry is ours now; log in outside the lock
+        entry.conDev = conDev
+        entry.prompt = prompt or entry.prompt
+        reused = entry.handle is not None and entry.handle.isalive()
+        if not reused:
+            self.closeHandle(entry)
+            handle = self.open(entry)
+            if handle == "fail":
+                self.release(leaseId)
+                return {"result": "fail", "reason": "login failed"}
+            entry.handle = handle
+        # command_batch picks its framing from the device type
+        relex.station[entry.handle] = conDev
+        logger.info(
+            "Leased {} as {} ({})".format(
+                key, leaseId, "reused" if reused else "new login"
+            )
+        )
+        return {"result": "ok", "lease": leaseId, "reused": reused}
+
+    def open(self, entry):
+        """Log in to the device of an entry."""
+        conDev = entry.conDev
+        if entry.protocol == "telnet":
+            return relex.connect_telnet(
+                conDev["ip"],
+                conDev["user"],
+                conDev["password"],
+                entry.prompt,
+                port=conDev["port"],
+            )
+        return relex.connect_ssh(
+            conDev["ip"],
+            conDev["user"],
+            conDev["password"],
+            entry.prompt,
+            conDev["port"],
+        )
+
+    def call(self, leaseId, func, args):
+        """Run one of brokerCalls on the leased session."""
+        entry = self.leased.get(leaseId)
+        if entry is None:
+            return {"result": "fail", "reason": "unknown lease {}".format(leaseId)}
+        if func not in brokerCalls:
+            return {"result": "fail", "reason": "unsupported call {}".format(func)}
+        value = getattr(relex, func)(entry.handle, *args)
+        entry.lastUsed = time.monotonic()
+        return {"result": "ok", "value": value}
+
+    def release(self, leaseId, close=False):
+        """
+        Return a leased session, keeping it logged in unless close is set.
+        """
+        with self.cond:
+            entry = self.leased.pop(leaseId, None)
+            if entry is None:
+                return {"result": "fail", "reason": "unknown lease {}".format(leaseId)}
+            if close:
+                self.closeHandle(entry)
+            entry.lease = None
+            entry.lastUsed = time.monotonic()
+            self.cond.notify_all()
+        return {"result": "ok"}
+
+    def closeHandle(self, entry):
+        handle, entry.handle = entry.handle, None
+        if handle is None:
+            return
+        try:
+            handle.close()
+        except Exception:
+            pass
+
+    def status(self):
+        """Describe every session for the status request."""
+        now = time.monotonic()
+        with self.cond:
+            return {
+                "result": "ok",
+                "sessions": [
+                    {
+                        "session": entry.key,
+                        "name": entry.conDev.get("name"),
+                        "open": entry.handle is not None,
+                        "lease": entry.lease,
+                        "leases": entry.leaseCount,
+                        "idle": round(now - entry.lastUsed, 1),
+                    }
+                    for entry in self.entries.values()
+                ],
+            }
+
+    def reap(self):
+        """Close sessions that were not leased for idle seconds."""
+        while not self.stopEvent.wait(min(self.idle / 4, 30)):
+            now = time.monotonic()
+            with self.cond:
+                for entry in self.entries.values():
+                    if entry.lease is None and now - entry.lastUsed > self.idle:
+                        self.closeHandle(entry)
+
+    def closeAll(self):
+        self.stopEvent.set()
+        with self.cond:
+            for entry in self.entries.values():
+                self.closeHandle(entry)
+
+    def dispatch(self, request, leases):
+        """
+        Handle one request of a client.
+        Args:
+            request: Decoded request dictionary.
+            leases: Lease ids held by the client connection.
+        Returns:
+            Reply dictionary.
+        """
+        op = request.get("op")
+        try:
+            if op == "lease":
+                reply = self.lease(
+                    request["station"],
+                    request.get("protocol", "ssh"),
+                    request.get("prompt"),
+                    request.get("wait", 300),
+                )
+                if reply["result"] == "ok":
+                    leases.add(reply["lease"])
+                return reply
+            if op in ("release", "close"):
+                leases.discard(request["lease"])
+                return self.release(request["lease"], close=op == "close")
+            if op == "call":
+                return self.call(
+                    request["lease"], request["func"], request.get("args", [])
+                )
+            if op == "status":
+                return self.status()
+        except Exception as exp:
+            reason = "{} - {}".format(type(exp).__name__, exp)
+            return {"result": "fail", "reason": reason}
+        return {"result": "fail", "reason": "unknown request {}".format(op)}
+
+
+class brokerHandler(socketserver.StreamRequestHandler):
+    """One client connection; its leases end when it disconnects."""
+
+    def handle(self):
+        broker = self.server.broker
+        leases = set()
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    reply = {"result": "fail", "reason": "malformed request"}
+                else:
+                    if request.get("op") == "shutdown":
+                        threading.Thread(target=self.server.shutdown).start()
+                        reply = {"result": "ok"}
+                    else:
+                        reply = broker.dispatch(request, leases)
+                data = json.dumps(reply, default=jsonDefault) + "\n"
+                self.wfile.write(data.encode())
+        except OSError:
+            pass
+        finally:
+            # A script that exits or crashes gives its sessions back
+            for leaseId in leases:
+                broker.release(leaseId)
+
+
+class brokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class brokerSession:
+    """
+    A session leased from the broker, used in place of a pexpect handle.
+    relex.command/command_batch/sendCntrl/close forward to it.
+    """
+
+    def __init__(self, client, lease, name):
+        self.client = client
+        self.lease = lease
+        self.name = name
+
+    def call(self, func, *args):
+        reply = self.client.request(
+            op="call", lease=self.lease, func=func, args=list(args)
+        )
+        if reply["result"] != "ok":
+            raise ConnectionError(
+                "Session broker failed {} on {}: {}".format(
+                    func, self.name, reply.get("reason")
+                )
+            )
+        return reply["value"]
+
+    def release(self, close=False):
+        """Give the session back to the broker; close also logs it out."""
+        return self.client.request(op="close" if close else "release", lease=self.lease)
+
+    def __repr__(self):
+        return "<brokerSession {} lease {}>".format(self.name, self.lease)
+
+
+class brokerClient:
+    """
+    Connection of a script process to the broker.
+    Requests of all threads share the connection one at a time; a forked
+    worker opens its own connection on first use.
+    """
+
+    def __init__(self, path=defaultSocket, autostart=True, startTimeout=10):
+        self.path = path
+        self.autostart = autostart
+        self.startTimeout = startTimeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.rfile = None
+        self.pid = None
+        self.inherited = []
+
+    def _connect(self):
+        if self.sock is not None and self.pid == os.getpid():
+            return
+        if self.sock is not None:
+            # Keep the parent's connection open; closing it would end its leases
+            self.inherited.append((self.sock, self.rfile))
+        self.sock = None
+        deadline = time.monotonic() + self.startTimeout
+        started = False
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                break
+            except OSError:
+                sock.close()
+                if not self.autostart or time.monotonic() > deadline:
+                    raise
+            if not started:
+                self.start()
+                started = True
+            time.sleep(0.05)
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.pid = os.getpid()
+
+    def start(self):
+        """Start a broker daemon in its own session."""
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "-socket", self.path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    def request(self, **request):
+        """Send one request and wait for the reply."""
+        data = (json.dumps(request) + "\n").encode()
+        with self.lock:
+            self._connect()
+            self.sock.sendall(data)
+            line = self.rfile.readline()
+        if not line:
+            self.sock = None
+            raise ConnectionError("Session broker closed the connection")
+        return json.loads(line)
+
+    def lease(self, conDev, protocol, prompt, wait=300):
+        """
+        Lease a session to a device.
+        Returns:
+            Reply dictionary; on success "session" holds the brokerSession.
+        """
+        fields = ("name", "type", "ip", "port", "user", "password")
+        reply = self.request(
+            op="lease",
+            station={field: conDev.get(field) for field in fields},
+            protocol=protocol,
+            prompt=prompt,
+            wait=wait,
+        )
+        if reply["result"] == "ok":
+            reply["session"] = brokerSession(self, reply["lease"], conDev.get("name"))
+        return reply
+
+
+def brokerArgs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-socket", help="Unix socket to listen on", default=defaultSocket
+    )
+    parser.add_argument(
+        "-idle",
+        help="Seconds an unleased session stays logged in",
+        type=float,
+        default=600,
+    )
+    parser.add_argument(
+        "-logfile",
+        help="Log of the broker and its sessions",
+        default=os.path.expanduser("~/.REXbroker.log"),
+    )
+    parser.add_argument(
+        "-loglevel", help="Debug level to be used while executing", default="info"
+    )
+    parser.add_argument(
+        "-status", help="Print the sessions of a running broker", action="store_true"
+    )
+    parser.add_argument("-shutdown", help="Stop a running broker", action="store_true")
+    return parser.parse_args(sys.argv[1:])
+
+
+def main():
+    arg = brokerArgs()
+    if arg.status or arg.shutdown:
+        client = brokerClient(arg.socket, autostart=False)
+        try:
+            reply = client.request(op="shutdown" if arg.shutdown else "status")
+        except OSError:
+            print("No session broker on {}".format(arg.socket))
+            return 1
+        print(json.dumps(reply, indent=2))
+        return 0
+    try:
+        brokerClient(arg.socket, autostart=False).request(op="status")
+        print("Session broker already running on {}".format(arg.socket))
+        return 0
+    except OSError:
+        pass
+    if os.path.exists(arg.socket):
+        os.unlink(arg.socket)
+
+    testLogger.initLogging(logFile=arg.logfile, level=arg.loglevel)
+    relex.logger = logging.getLogger(relex.__name__)
+    # relex normally sets these up in testExec()
+    relex.param = {}
+    relex.station = {}
+    broker = sessionBroker(arg.idle)
+    oldMask = os.umask(0o077)
+    try:
+        server = brokerServer(arg.socket, brokerHandler)
+    finally:
+        os.umask(oldMask)
+    server.broker = broker
+    threading.Thread(target=broker.reap, name="relex-brokerreap", daemon=True).start()
+    logger.info("Session broker listening on {}".format(arg.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(arg.socket)
+        except OSError:
+            pass
+        broker.closeAll()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
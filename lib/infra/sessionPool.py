@@ -0,0 +1,157 @@
+import threading
+import time
+import pexpect
+
+
+class sessionPool:
+    """
+    Pool of authenticated device sessions keyed by station name.
+    Sessions returned by close() are parked here and handed back out by
+    connect() after a prompt probe. A background thread probes idle
+    sessions to keep them alive and evicts idle or broken ones.
+    """
+
+    def __init__(self, idleTimeout=600, keepalive=60, probeTimeout=5):
+        self.idleTimeout = idleTimeout
+        self.keepalive = keepalive
+        self.probeTimeout = probeTimeout
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.detached = []
+        self.stopEvent = threading.Event()
+        self.startKeepalive()
+
+    def startKeepalive(self):
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(
+            target=self._keepaliveLoop, name="relex-keepalive", daemon=True
+        )
+        self.thread.start()
+
+    def add(self, name, handle, prompt):
+        """
+        Register a newly connected session as in use.
+        Args:
+            name: Station name.
+            handle: pexpect session handle.
+            prompt: Prompt expected from the session.
+        """
+        entry = {"handle": handle, "prompt": prompt, "inUse": True, "lastUsed": 0}
+        with self.lock:
+            self.entries[handle] = (name, entry)
+
+    def acquire(self, name):
+        """
+        Hand out an idle, healthy session to a station.
+        Broken sessions found on the way are closed and evicted.
+        Args:
+            name: Station name.
+        Returns:
+            pexpect session handle, or None if no session is available.
+        """
+        while True:
+            with self.lock:
+                entry = None
+                for stnName, candidate in self.entries.values():
+                    if stnName == name and not candidate["inUse"]:
+                        entry = candidate
+                        entry["inUse"] = True
+                        break
+            if entry is None:
+                return None
+            if self.probe(entry):
+                return entry["handle"]
+            self.discard(entry["handle"])
+
+    def release(self, handle):
+        """
+        Return a session to the pool.
+        Args:
+            handle: pexpect session handle.
+        Returns:
+            True if the handle belongs to the pool, False otherwise.
+        """
+        with self.lock:
+            if handle not in self.entries:
+                return False
+            entry = self.entries[handle][1]
+            entry["inUse"] = False
+            entry["lastUsed"] = time.monotonic()
+        return True
+
+    def discard(self, handle):
+        """Remove a session from the pool and close it."""
+        with self.lock:
+            self.entries.pop(handle, None)
+        try:
+            handle.close(force=True)
+        except Exception:
+            pass
+
+    def probe(self, entry):
+        """
+        Check a session by sending an empty line and expecting its prompt.
+        Pending output is drained first so a stale prompt cannot match.
+        Args:
+            entry: Pool entry of the session.
+        Returns:
+            True if the prompt came back within probeTimeout.
+        """
+        handle = entry["handle"]
+        logfile = handle.logfile_read
+        handle.logfile_read = None
+        try:
+            if not handle.isalive():
+                return False
+            try:
+                while True:
+                    handle.read_nonblocking(size=65536, timeout=0)
+            except pexpect.TIMEOUT:
+                pass
+            handle.buffer = handle.string_type()
+            handle.sendline()
+            idx = handle.expect(
+                [entry["prompt"], pexpect.EOF, pexpect.TIMEOUT],
+                timeout=self.probeTimeout,
+            )
+            return idx == 0
+        except Exception:
+            return False
+        finally:
+            handle.logfile_read = logfile
+
+    def _keepaliveLoop(self):
+        while not self.stopEvent.wait(self.keepalive):
+            now = time.monotonic()
+            with self.lock:
+                idle = []
+                for name, entry in self.entries.values():
+                    if not entry["inUse"]:
+                        entry["inUse"] = True
+                        idle.append(entry)
+            for entry in idle:
+                expired = now - entry["lastUsed"] > self.idleTimeout
+                if expired or not self.probe(entry):
+                    self.discard(entry["handle"])
+                else:
+                    with self.lock:
+                        entry["inUse"] = False
+
+    def detach(self):
+        """
+        Forget inherited sessions in a forked worker.
+        The handles are kept referenced so they are not closed from the
+        worker, which would tear down the parent's connections.
+        """
+        self.lock = threading.Lock()
+        self.detached.extend(self.entries)
+        self.entries = {}
+        self.startKeepalive()
+
+    def closeAll(self):
+        """Stop the keepalive thread and close all pooled sessions."""
+        self.stopEvent.set()
+        with self.lock:
+            handles = list(self.entries)
+        for handle in handles:
+            self.discard(handle)
@@ -0,0 +1,118 @@
+import os
+import re
+import yaml
+
+# Station files already parsed in this process, keyed by path.
+_inventoryCache = {}
+
+# Operators accepted as a param field value, e.g.
+#   distros: {any: [Ubuntu, CentOS]}
+#   name: {regex: "^mylinux[12]$"}
+#   cpus: {range: [4, 16]}
+criteriaOps = {"any", "regex", "range"}
+
+
+class stationIndex:
+    """
+    Inverted attribute index over a station inventory.
+    Maps each field and value to the set of station names having it,
+    so param criteria resolve through set intersections.
+    """
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.order = {}
+        self.index = {}
+        self.unhashable = {}
+        self.regexCache = {}
+        for pos, (name, fields) in enumerate(stations.items()):
+            self.order[name] = pos
+            if not isinstance(fields, dict):
+                continue
+            for field, value in fields.items():
+                try:
+                    self.index.setdefault(field, {}).setdefault(value, set()).add(name)
+                except TypeError:
+                    self.unhashable.setdefault(field, set()).add(name)
+
+    def _lookup(self, field, value):
+        """Stations whose field equals value."""
+        try:
+            return self.index.get(field, {}).get(value, set())
+        except TypeError:
+            names = self.unhashable.get(field, set()) | set().union(
+                *self.index.get(field, {}).values()
+            )
+            return {name for name in names if self.stations[name][field] == value}
+
+    def _fieldMatch(self, field, criteria):
+        """Stations satisfying a single field criteria."""
+        if not (
+            isinstance(criteria, dict) and criteria and set(criteria) <= criteriaOps
+        ):
+            return self._lookup(field, criteria)
+        result = None
+        for op, arg in criteria.items():
+            if op == "any":
+                names = set().union(*(self._lookup(field, value) for value in arg))
+            elif op == "regex":
+                pattern = self.regexCache.get(arg)
+                if pattern is None:
+                    pattern = self.regexCache[arg] = re.compile(arg)
+                names = set()
+                for value, valueNames in self.index.get(field, {}).items():
+                    if pattern.search(str(value)):
+                        names |= valueNames
+            else:
+                low, high = arg
+                names = set()
+                for value, valueNames in self.index.get(field, {}).items():
+                    try:
+                        if low <= value <= high:
+                            names |= valueNames
+                    except TypeError:
+                        pass
+            result = names if result is None else result & names
+        return result
+
+    def match(self, paramfields):
+        """
+        Find stations matching every field of a param entry.
+        Args:
+            paramfields: Dictionary of field -> value or criteria.
+        Returns:
+            List of matching station names in inventory order.
+        """
+        if not paramfields:
+            return list(self.order)
+        sets = [self._fieldMatch(f, c) for f, c in paramfields.items()]
+        sets.sort(key=len)
+        names = set(sets[0])
+        for other in sets[1:]:
+            if not names:
+                break
+            names &= other
+        return sorted(names, key=self.order.__getitem__)
+
+
+def loadInventory(stationfile):
+    """
+    Load a station YAML file together with its index.
+    The file is parsed and indexed once per process and again only when
+    its mtime changes.
+    Args:
+        stationfile: Path to the station YAML file.
+    Returns:
+        Tuple of (station dictionary, stationIndex).
+    """
+    path = os.path.realpath(stationfile)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _inventoryCache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as tb_data:
+            station_data = yaml.safe_load(tb_data)
+        cached = (mtime, station_data, stationIndex(station_data))
+        _inventoryCache[path] = cached
+    # The caller gets its own top-level dict since relex adds
+    # session handle keys to it
+    return dict(cached[1]), cached[2]
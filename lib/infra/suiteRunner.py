@@ -0,0 +1,560 @@
+############################################################################
+#
+#    Suite runner - runs many relex scripts from one warm process
+#
+#    Usage:
+#        python suiteRunner.py -suite regression.yaml -jobs 4
+#        python suiteRunner.py script/a/a.py script/b/b.py -station tb.yaml
+#
+############################################################################
+
+import argparse
+import ast
+import datetime
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import runpy
+import sys
+import time
+import traceback
+import yaml
+from xml.sax.saxutils import quoteattr
+
+# Imported up front so every forked script starts with them loaded
+import pexpect
+import relex
+import reportStore
+import stationIndex
+import testLogger
+
+# Record stores inherited from the suite process. Workers keep them
+# referenced so collecting them cannot delete the parent's spool file.
+inherited = []
+
+
+def suiteArgs():
+    parser = argparse.ArgumentParser()
+    suffix = datetime.datetime.now().isoformat()
+    defaultStation = os.path.expanduser("~/git_code/relex/testbed/sampletb.yaml")
+    parser.add_argument("scripts", nargs="*", help="Scripts to run")
+    parser.add_argument("-suite", help="YAML file listing the scripts to run")
+    parser.add_argument(
+        "-station", help="File to get test device info", default=defaultStation
+    )
+    parser.add_argument(
+        "-jobs", help="Number of scripts to run concurrently", type=int, default=4
+    )
+    parser.add_argument(
+        "-spares",
+        help="Free stations reserved per device as failover backups",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-logdir",
+        help="Directory for the script logs and suite results",
+        default=os.path.expanduser("~/git_code/relex/logs/suite_" + suffix),
+    )
+    parser.add_argument(
+        "-loglevel", help="Debug level to be used while executing", default="debug"
+    )
+    # Remaining arguments (e.g. -controlmaster) are passed to every script
+    return parser.parse_known_args(sys.argv[1:])
+
+
+class suiteScript:
+    """A script of the suite with its device requirements."""
+
+    def __init__(self, path, param=None, args=None):
+        self.path = os.path.realpath(path)
+        self.name = os.path.splitext(os.path.basename(self.path))[0]
+        self.param = param or os.path.splitext(self.path)[0] + ".prm"
+        self.args = [str(arg) for arg in args or []]
+        self.needs = {}
+        self.fixtures = declaredFixtures(self.path)
+        self.logBase = None
+        self.assign = {}
+        self.stations = []
+        self.report = None
+        self.start = 0
+        self.duration = 0
+
+    def loadNeeds(self, stnIndex):
+        """Resolve the param keys to candidate station names."""
+        try:
+            with open(self.param) as pf_data:
+                param_data = yaml.safe_load(pf_data) or {}
+        except (OSError, yaml.YAMLError):
+            # The script reports the error itself when it loads the file
+            param_data = {}
+        self.needs = {
+            paramkey: stnIndex.match(fields)
+            for paramkey, fields in param_data.items()
+            if paramkey != "vars"
+        }
+        # Keys that cannot be matched even on an idle testbed never block
+        # the script; stationLoader reports them
+        possible = self.pick(set())
+        self.needs = {
+            paramkey: candidates
+            for paramkey, candidates in self.needs.items()
+            if paramkey in possible
+        }
+
+    def pick(self, taken, prefer=()):
+        """
+        Choose a distinct station per param key, avoiding taken ones.
+        Stations in prefer (held by the script's fixtures) come first.
+        """
+        taken = set(taken)
+        chosen = {}
+        for paramkey, candidates in self.needs.items():
+            for stnkey in sorted(candidates, key=lambda stnkey: stnkey not in prefer):
+                if stnkey not in taken:
+                    chosen[paramkey] = [stnkey]
+                    taken.add(stnkey)
+                    break
+        return chosen
+
+    def reserve(self, busy, spares, prefer=()):
+        """
+        Pick free stations for every param key.
+        Args:
+            busy: Station names held by running scripts.
+            spares: Extra free stations to hold per key for failover.
+            prefer: Stations to use first when they match.
+        Returns:
+            {paramkey: [station names]} or None if a key has no free station.
+        """
+        chosen = self.pick(busy, prefer)
+        if len(chosen) < len(self.needs):
+            return None
+        taken = set(busy)
+        taken.update(names[0] for names in chosen.values())
+        for paramkey, names in chosen.items():
+            for stnkey in self.needs[paramkey]:
+                if len(names) > spares:
+                    break
+                if stnkey not in taken:
+                    names.append(stnkey)
+                    taken.add(stnkey)
+        return chosen
+
+
+def declaredFixtures(path):
+    """
+    Find the fixtures a script passes to testExec(..., fixtures=[...]).
+    Returns:
+        List of fixture names; empty if there are none or they are not
+        given as a literal list.
+    """
+    try:
+        with open(path) as src:
+            tree = ast.parse(src.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        funcName = getattr(node.func, "attr", getattr(node.func, "id", None))
+        if funcName != "testExec":
+            continue
+        for keyword in node.keywords:
+            if keyword.arg == "fixtures":
+                try:
+                    return [str(name) for name in ast.literal_eval(keyword.value)]
+                except ValueError:
+                    return []
+    return []
+
+
+def loadSuite(suiteFile, scripts):
+    """
+    Build the script list from a suite file and/or command line paths.
+    Suite file format:
+        args: [-controlmaster]          # optional, passed to every script
+        scripts:
+          - script/sample/hello.py
+          - path: script/sample/sampleScript1.py
+            param: script/sample/other.prm
+            args: [-parallel, 2]
+    Returns:
+        List of suiteScript.
+    """
+    entries = []
+    if suiteFile:
+        with open(suiteFile) as sf_data:
+            suite = yaml.safe_load(sf_data) or {}
+        baseDir = os.path.dirname(os.path.realpath(suiteFile))
+        common = suite.get("args") or []
+        for entry in suite.get("scripts") or []:
+            if isinstance(entry, str):
+                entry = {"path": entry}
+            param = entry.get("param")
+            entries.append(
+                suiteScript(
+                    os.path.join(baseDir, entry["path"]),
+                    param and os.path.join(baseDir, param),
+                    list(common) + list(entry.get("args") or []),
+                )
+            )
+    entries.extend(suiteScript(path) for path in scripts)
+    return entries
+
+
+def scriptWorker(script, stations, argv, conn):
+    """
+    Run one script in a forked worker and send its report back.
+    The script runs as __main__ with relex, pexpect and the station
+    inventory already loaded, and may only select the given stations.
+    Fixtures started by the suite are inherited and adopted by testExec.
+    """
+    consoleFd = os.open(
+        script.logBase + ".console", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+    )
+    os.dup2(consoleFd, 1)
+    os.dup2(consoleFd, 2)
+    os.close(consoleFd)
+    sys.argv = [script.path] + argv
+    relex.devices.leases.script = os.path.basename(script.path)
+    sys.path.insert(0, os.path.dirname(script.path))
+    relex.commonVars.stations = stations
+    inherited.append(relex.reportVars.Records)
+    inherited.append(testLogger.detach())
+    # Start from clean counters; the suite process ran the fixtures
+    for counter in relex.reportCounters:
+        setattr(relex.reportVars, counter, 0)
+    relex.reportVars.SetupFail = False
+    relex.reportVars.TestFail = False
+    relex.timing.reset()
+    code = 0
+    try:
+        runpy.run_path(script.path, run_name="__main__")
+    except SystemExit as exp:
+        if exp.code is None or isinstance(exp.code, int):
+            code = exp.code or 0
+        else:
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    report = {
+        counter: getattr(relex.reportVars, counter)
+        for counter in relex.reportCounters
+    }
+    report["SetupFail"] = relex.reportVars.SetupFail
+    report["code"] = code
+    if relex.commonVars.sessionpool is not None:
+        relex.commonVars.sessionpool.closeAll()
+    if testLogger.tee is not None:
+        testLogger.tee.close()
+    conn.send(report)
+    conn.close()
+
+
+def leaseStations(names):
+    """
+    Lease stations for a script, all or none.
+    Returns:
+        False if another run holds one of them.
+    """
+    with relex.devices.leases.transaction() as leases:
+        if not all(leases.isFree(name) for name in names):
+            return False
+        for name in names:
+            leases.take(name)
+    return True
+
+
+def scriptStatus(report):
+    """Summarise a script report the way reportSummary does."""
+    if report is None:
+        return "Crashed"
+    if report["SetupFail"]:
+        return "Failed in Setup"
+    if report["FailCount"] or report["code"]:
+        return "Failed"
+    if report["TestPassCount"] == 0:
+        return "No pass criteria"
+    return "Passed"
+
+
+def startFixtures(script, stationfile, users):
+    """
+    Start the fixtures of a script that are not running yet.
+    They run in the suite process on the stations reserved for the
+    script, so every later script forked from it inherits their sessions.
+    Args:
+        script: suiteScript about to be started.
+        stationfile: Testbed file.
+        users: {fixture name: number of scripts declaring it}.
+    """
+    for fixtureName in script.fixtures:
+        if fixtureName in relex.activeFixtures:
+            continue
+        relex.commonVars.stationfile = stationfile
+        relex.commonVars.paramfile = script.param
+        relex.commonVars.stations = script.assign
+        relex.stationLoader()
+        try:
+            fixture = relex.fixtureProc(fixtureName, users[fixtureName])
+        except IOError:
+            # The script reports the missing fixture itself
+            continue
+        relex.activeFixtures[fixtureName] = fixture
+        fixture.start()
+        if fixture.failed:
+            break
+
+
+def releaseFixtures(script):
+    """Drop the script as a user of its fixtures, cleaning up unused ones."""
+    for fixtureName in script.fixtures:
+        fixture = relex.activeFixtures.get(fixtureName)
+        if fixture is not None:
+            fixture.release()
+
+
+def runSuite(scripts, stationfile, jobs, spares, logdir, loglevel, extraArgs):
+    """
+    Run the scripts, at most jobs at a time, on disjoint stations.
+    A script starts as soon as every one of its param keys can get a
+    station that no running script holds; scripts further down the list
+    may start ahead of one that is waiting for busy stations.
+    Scripts sharing a fixture run one at a time on the fixture's
+    stations, which stay reserved until its last user has finished.
+    Reserved stations are leased host-wide; stations leased by other runs
+    count as busy until they are given back.
+    Returns:
+        True if every script passed.
+    """
+    os.makedirs(logdir, exist_ok=True)
+    testLogger.initLogging(
+        logFile=os.path.join(logdir, "suite.log"), level=loglevel
+    )
+    relex.logger = logging.getLogger(relex.__name__)
+    users = {}
+    for script in scripts:
+        for fixtureName in script.fixtures:
+            users[fixtureName] = users.get(fixtureName, 0) + 1
+    if users:
+        relex.reportVars.Records = reportStore.reportStore(
+            os.path.join(logdir, "fixtures"), "fixtures"
+        )
+    station_data, stnIndex = stationIndex.loadInventory(stationfile)
+    try:
+        relex.downDevices.load()
+    except OSError:
+        pass
+    seen = {}
+    for script in scripts:
+        script.loadNeeds(stnIndex)
+        for names in script.needs.values():
+            # Known-down stations are only used when nothing else is free
+            names.sort(
+                key=lambda stnkey: relex.downDevices.isDown(
+                    station_data[stnkey].get("name", stnkey)
+                )
+            )
+        count = seen.get(script.name, 0) + 1
+        seen[script.name] = count
+        logName = script.name if count == 1 else f"{script.name}_{count}"
+        script.logBase = os.path.join(logdir, logName)
+
+    stationName = {
+        stnkey: fields.get("name", stnkey) for stnkey, fields in station_data.items()
+    }
+    stationKey = {name: stnkey for stnkey, name in stationName.items()}
+    leased = set()
+    waitingOn = set()
+
+    ctx = multiprocessing.get_context("fork")
+    pending = list(scripts)
+    running = {}
+    while pending or running:
+        inUse = {
+            fixtureName
+            for _, runScript in running.values()
+            for fixtureName in runScript.fixtures
+        }
+        busy = set()
+        for _, runScript in running.values():
+            busy.update(runScript.stations)
+        for fixture in relex.activeFixtures.values():
+            busy.update(fixture.stations)
+        if leased - busy:
+            relex.devices.leases.release([stationName[k] for k in leased - busy])
+            leased &= busy
+        others = {stationKey.get(name, name) for name in relex.devices.leases.held()}
+        busy.update(others)
+        for script in list(pending):
+            if len(running) >= jobs:
+                break
+            if inUse.intersection(script.fixtures):
+                continue
+            held = set()
+            for fixtureName in script.fixtures:
+                if fixtureName in relex.activeFixtures:
+                    held.update(relex.activeFixtures[fixtureName].stations)
+            chosen = script.reserve(busy - held, spares, held)
+            if chosen is None:
+                continue
+            stations = [name for names in chosen.values() for name in names]
+            if not leaseStations([stationName[k] for k in stations]):
+                # Another run leased one of them since held() was read
+                continue
+            leased.update(stations)
+            pending.remove(script)
+            script.assign = chosen
+            script.stations = stations
+            busy.update(script.stations)
+            inUse.update(script.fixtures)
+            startFixtures(script, stationfile, users)
+            argv = [
+                "-logfile",
+                script.logBase + ".log",
+                "-station",
+                stationfile,
+                "-param",
+                script.param,
+                "-loglevel",
+                loglevel,
+            ]
+            argv += extraArgs + script.args
+            recvConn, sendConn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(
+                target=scriptWorker, args=(script, script.assign, argv, sendConn)
+            )
+            sys.stdout.flush()
+            proc.start()
+            sendConn.close()
+            script.start = time.monotonic()
+            running[recvConn] = (proc, script)
+            print(f"Started  {script.name} on {script.stations or '-'}", flush=True)
+        if not running:
+            if not others:
+                # Nothing can free a station; should not happen
+                break
+            if others != waitingOn:
+                print(
+                    f"Waiting for stations leased by other runs: {sorted(others)}",
+                    flush=True,
+                )
+                waitingOn = others
+            time.sleep(1)
+            continue
+        for conn in multiprocessing.connection.wait(list(running)):
+            proc, script = running.pop(conn)
+            try:
+                script.report = conn.recv()
+            except EOFError:
+                script.report = None
+            conn.close()
+            proc.join()
+            script.duration = time.monotonic() - script.start
+            releaseFixtures(script)
+            print(
+                "Finished {} - {} ({:.1f}s)".format(
+                    script.name, scriptStatus(script.report), script.duration
+                ),
+                flush=True,
+            )
+    for fixture in list(relex.activeFixtures.values()):
+        # Users that never started still hold a reference
+        fixture.users = 1
+        fixture.release()
+    relex.devices.leases.release()
+    relex.reportVars.Records.close()
+    writeJunit(scripts, os.path.join(logdir, "suite.xml"))
+    return suiteSummary(scripts, logdir)
+
+
+def writeJunit(scripts, path):
+    """Combine the per-script JUnit files into one testsuites file."""
+    with open(path, "w", encoding="utf-8") as out:
+        out.write('<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n')
+        for script in scripts:
+            try:
+                with open(script.logBase + ".xml", encoding="utf-8") as xml:
+                    lines = xml.read().splitlines()[1:]
+            except OSError:
+                lines = []
+            if lines and lines[-1] == "</testsuite>":
+                out.write("\n".join(lines) + "\n")
+            else:
+                # Script never wrote a complete result file
+                out.write(
+                    "<testsuite name={0}>\n  <testcase classname={0} name={0}>"
+                    '\n    <failure type="ERROR" message={1}/>\n  </testcase>'
+                    "\n</testsuite>\n".format(
+                        quoteattr(script.name), quoteattr(scriptStatus(script.report))
+                    )
+                )
+        out.write("</testsuites>\n")
+
+
+def suiteSummary(scripts, logdir):
+    """Print the per-script and aggregate summary."""
+    print("\n")
+    print("=" * 100)
+    print("Suite Summary".rjust(57))
+    print("=" * 100)
+    print(
+        "{:<30} {:<18} {:>7} {:>7} {:>9}  {}".format(
+            "Script", "Result", "Passed", "Failed", "Time", "Stations"
+        )
+    )
+    passed = 0
+    testPass = 0
+    testFail = 0
+    for script in scripts:
+        report = script.report or {}
+        status = scriptStatus(script.report)
+        passed += status == "Passed"
+        testPass += report.get("TestPassCount", 0)
+        testFail += report.get("TestFailCount", 0)
+        print(
+            "{:<30} {:<18} {:>7} {:>7} {:>8.1f}s  {}".format(
+                script.name[:30],
+                status,
+                report.get("TestPassCount", 0),
+                report.get("TestFailCount", 0),
+                script.duration,
+                ",".join(script.stations),
+            )
+        )
+    print("=" * 100)
+    print("+" + "-" * (52) + "+")
+    for msg in (
+        "Scripts Passed = {} of {}".format(passed, len(scripts)),
+        "Total Number Of Test Passed = {}".format(testPass),
+        "Total Number Of Test Failed = {}".format(testFail),
+    ):
+        relex.summaryFormatter(msg)
+    print("+" + "-" * (52) + "+")
+    print("Logs and results: {}".format(logdir))
+    return passed == len(scripts)
+
+
+def main():
+    arg, extraArgs = suiteArgs()
+    scripts = loadSuite(arg.suite, arg.scripts)
+    if not scripts:
+        print("No scripts to run")
+        return 1
+    ok = runSuite(
+        scripts,
+        os.path.realpath(arg.station),
+        max(arg.jobs, 1),
+        max(arg.spares, 0),
+        arg.logdir,
+        arg.loglevel,
+        extraArgs,
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,4 +26,86 @@ def testArgs():
     parser.add_argument(
         "-station", help="File to get test device info", default=defaultStation
     )
+    parser.add_argument(
+        "-parallel",
+        help="Number of test cases to run concurrently",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-sessionpool",
+        help="Reuse device sessions across connect()/close() calls",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-controlmaster",
+        help="Multiplex SSH sessions over a shared ControlMaster connection",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-downttl",
+        help="Seconds a failed station is skipped by station selection",
+        type=int,
+        default=1800,
+    )
+    parser.add_argument(
+        "-leasewait",
+        help="Seconds to wait for stations leased by other runs",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "-preflight",
+        help="Probe candidate stations before assignment, with this timeout",
+        type=float,
+        nargs="?",
+        const=1.0,
+        default=None,
+    )
+    parser.add_argument(
+        "-broker",
+        help="Lease device sessions from the session broker on this socket",
+        nargs="?",
+        const=os.path.expanduser("~/.REXbroker.sock"),
+        default=None,
+    )
+    parser.add_argument(
+        "-logflushinterval",
+        help="Seconds console/log output may be buffered before writing",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "-logflushsize",
+        help="Bytes of console/log output buffered before writing",
+        type=int,
+        default=65536,
+    )
+    parser.add_argument(
+        "-logcompress",
+        help="Write the log as compressed segments with this compression",
+        choices=["none", "gzip", "lzma"],
+        default="none",
+    )
+    parser.add_argument(
+        "-logsegment",
+        help="Megabytes of log output per compressed segment",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "-trace",
+        help="Write a Chrome trace-event file of step/command/connect timings",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-resume",
+        help="Skip the tests that passed in the last run with the same inputs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-rerunfailed",
+        help="Run only the tests that failed in the last run with the same inputs",
+        action="store_true",
+    )
     return parser.parse_args(sys.argv[1:])
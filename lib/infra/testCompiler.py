@@ -0,0 +1,164 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import io
+import marshal
+import os
+import tempfile
+import textwrap
+import time
+import tokenize
+
+# Compiled STEP/CLEAN blocks are kept on disk keyed by a hash of the
+# function source, so unchanged scripts skip parsing and compiling.
+# Files are named <function id>-<source hash>.blk; a new revision of a
+# function replaces the old one, and entries unused for cacheMaxAge
+# seconds are dropped.
+cacheDir = os.path.expanduser("~/.REXblockCache")
+cacheMaxAge = 30 * 86400
+
+# In-process cache keyed by the function's code object.
+_blockCache = {}
+
+
+def _findMarkers(source):
+    """
+    Locate #STEP and #CLEAN comments in the function source.
+    Args:
+        source: Function source text.
+    Returns:
+        List of (line number, "STEP" | "CLEAN") tuples in source order.
+    """
+    markers = []
+    for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+        if tok.type != tokenize.COMMENT:
+            continue
+        if tok.string.startswith("#STEP"):
+            markers.append((tok.start[0], "STEP"))
+        elif tok.string.startswith("#CLEAN"):
+            markers.append((tok.start[0], "CLEAN"))
+    return markers
+
+
+def _splitBody(body, markers):
+    """
+    Group top-level function statements into step and clean blocks.
+    The first block holds anything placed before the first #STEP marker.
+    Args:
+        body: List of ast statements from the function body.
+        markers: Output of _findMarkers with matching line numbers.
+    Returns:
+        List of [stepStatements, cleanStatements] pairs.
+    """
+    blocks = [[[], []]]
+    part = 0
+    markers = list(markers)
+
+    def consume(lineno):
+        nonlocal part
+        while markers and (lineno is None or markers[0][0] < lineno):
+            kind = markers.pop(0)[1]
+            if kind == "STEP":
+                blocks.append([[], []])
+                part = 0
+            else:
+                part = 1
+
+    for stmt in body:
+        consume(stmt.lineno)
+        blocks[-1][part].append(stmt)
+    consume(None)
+    return blocks
+
+
+def _compileBlocks(func):
+    """
+    Parse the function source and compile each block to a code object.
+    Args:
+        func: Setup or test function.
+    Returns:
+        Tuple of (function name, step code list, clean code list).
+    """
+    srclines, firstline = inspect.getsourcelines(func)
+    source = textwrap.dedent("".join(srclines))
+    filename = inspect.getsourcefile(func) or func.__code__.co_filename
+    funcId = hashlib.sha256(
+        "\0".join([os.path.abspath(filename), func.__qualname__]).encode()
+    ).hexdigest()[:16]
+    key = hashlib.sha256(
+        importlib.util.MAGIC_NUMBER
+        + "\0".join([filename, str(firstline), source]).encode()
+    ).hexdigest()
+    cachePath = os.path.join(cacheDir, "{}-{}.blk".format(funcId, key))
+    try:
+        with open(cachePath, "rb") as cache:
+            blocks = marshal.load(cache)
+        # Keep entries in use from ageing out
+        os.utime(cachePath)
+        return blocks
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    tree = ast.parse(source, filename)
+    ast.increment_lineno(tree, firstline - 1)
+    funcDef = tree.body[0]
+    markers = [(line + firstline - 1, kind) for line, kind in _findMarkers(source)]
+    stepList = []
+    cleanList = []
+    for stepStmts, cleanStmts in _splitBody(funcDef.body, markers):
+        for stmts, codeList in ((stepStmts, stepList), (cleanStmts, cleanList)):
+            module = ast.Module(body=stmts, type_ignores=[])
+            codeList.append(compile(module, filename, "exec"))
+    blocks = (funcDef.name, stepList, cleanList)
+
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=cacheDir)
+        with os.fdopen(fd, "wb") as cache:
+            marshal.dump(blocks, cache)
+        os.replace(tmpPath, cachePath)
+        _pruneCache(funcId, cachePath)
+    except OSError:
+        pass
+    return blocks
+
+
+def _pruneCache(funcId, keep):
+    """
+    Remove the other revisions of a function from the disk cache, and
+    entries that are stale or not named <function id>-<source hash>.blk.
+    """
+    cutoff = time.time() - cacheMaxAge
+    for entry in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, entry)
+        if path == keep or not entry.endswith(".blk"):
+            continue
+        prefix, _, rest = entry.partition("-")
+        try:
+            if prefix == funcId or len(rest) != 68:
+                os.remove(path)
+            elif os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            # Removed by a concurrent run
+            pass
+
+
+def compileBlocks(func):
+    """
+    Return the compiled STEP/CLEAN blocks of a function.
+    Each function is parsed at most once per process and, while its
+    source is unchanged, at most once across runs.
+    Args:
+        func: Setup or test function.
+    Returns:
+        Tuple of (function name, step code list, clean code list).
+    """
+    try:
+        return _blockCache[func.__code__]
+    except KeyError:
+        pass
+    blocks = _compileBlocks(func)
+    _blockCache[func.__code__] = blocks
+    return blocks
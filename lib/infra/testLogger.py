@@ -1,9 +1,211 @@
+import atexit
 import logging
+import logSegments
+import os
+import queue
 import sys
 import re
+import threading
+import time
 
+ansi_escape = re.compile(
+    rb'''
+    \x1B\[ [0-?]* [ -/]* [@-~]      |
+    \x1B\] .*? (?:\x07|\x1B\\)      |
+    \x1B[@-Z\\-_]                   |
+    \r
+    ''',
+    re.VERBOSE,
+)
+
+# Active tee logger, set by initLogging
+tee = None
+
+
+# Tee logger to log both to terminal and file
+class teeLogger:
+    """
+    Writes to the terminal and the log file from a background thread.
+    write() only queues the data; the writer thread batches everything
+    queued within flushInterval seconds (or up to flushSize bytes), strips
+    ANSI escapes from the whole batch once and issues one write per target.
+    flush() does not force a write, since pexpect and logging call it after
+    every chunk; data always reaches the targets within flushInterval.
+    sync() waits until everything written so far has been written out.
+    The log file side is a logSegments log, plain or compressed, and
+    mark() indexes the position reached in it, in order with the output.
+    """
+
+    STOP = object()
+
+    def __init__(
+        self,
+        logFile,
+        flushInterval=0.2,
+        flushSize=65536,
+        compress="none",
+        segmentSize=64 << 20,
+    ):
+        self.terminal = sys.stdout.buffer
+        self.log = logSegments.openLog(logFile, compress, segmentSize)
+        self.buffer = self
+        self.flushInterval = flushInterval
+        self.flushSize = flushSize
+        self._start()
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(
+            target=self._run, name="relex-logwriter", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            chunks = []
+            size = 0
+            deadline = time.monotonic() + self.flushInterval
+            events = []
+            marks = []
+            stop = False
+            while True:
+                if item is self.STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                    break
+                if isinstance(item, dict):
+                    marks.append(item)
+                    break
+                chunks.append(item)
+                size += len(item)
+                remaining = deadline - time.monotonic()
+                if size >= self.flushSize or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if chunks:
+                self._write(b"".join(chunks))
+            for entry in marks:
+                self._mark(entry)
+            if events:
+                self._sync()
+            for event in events:
+                event.set()
+            if stop:
+                return
+
+    def _write(self, data):
+        try:
+            self.terminal.write(data)
+            self.terminal.flush()
+        except (OSError, ValueError):
+            pass
+        try:
+            self.log.write(ansi_escape.sub(b"", data))
+            self.log.flush()
+        except (OSError, ValueError):
+            pass
+
+    def _mark(self, entry):
+        try:
+            self.log.mark(entry)
+        except (OSError, ValueError):
+            pass
+
+    def _sync(self):
+        try:
+            self.log.sync()
+        except (OSError, ValueError):
+            pass
+
+    def write(self, message):
+        if isinstance(message, str):
+            data = message.encode()
+        else:
+            data = bytes(message)
+        if self.pid != os.getpid():
+            # Forked child: the writer thread did not survive the fork
+            self._start()
+        self.queue.put(data)
+        return len(message)
+
+    def flush(self):
+        pass
+
+    def mark(self, entry):
+        """Index the log position reached once the output so far is written."""
+        if self.pid != os.getpid():
+            self._start()
+        self.queue.put(entry)
+
+    def sync(self, timeout=10):
+        """Block until everything written so far has reached both targets."""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
 
-def initLogging(logFile="app.log", level="debug"):
+    def close(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(10)
+        self.log.close()
+
+
+def mark(section, test, block=None, step=None):
+    """
+    Index the start of a test, or of one of its STEP/CLEAN blocks, in the
+    log, so relexLog.py can show it without reading the whole log.
+    Args:
+        section: "Setup" or "Test".
+        test: Setup, fixture or test name, None at the end of a test.
+        block: "STEP" or "CLEAN", None for the start of the test.
+        step: Block number.
+    """
+    if tee is not None:
+        tee.mark({"section": section, "test": test, "block": block, "step": step})
+
+
+def flushAll():
+    """Write out everything the tee logger has queued, waiting for it."""
+    if tee is not None:
+        tee.sync()
+
+
+def detach():
+    """
+    Drop the logging inherited from a parent process.
+    Used by forked suite scripts so initLogging sets up their own log.
+    Returns:
+        The inherited tee logger, to be kept referenced by the caller.
+    """
+    global tee
+    inheritedTee = tee
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    sys.stdout = sys.__stdout__
+    sys.excepthook = sys.__excepthook__
+    tee = None
+    return inheritedTee
+
+
+def initLogging(
+    logFile="app.log",
+    level="debug",
+    flushInterval=0.2,
+    flushSize=65536,
+    compress="none",
+    segmentSize=64 << 20,
+):
+    global tee
     logger = logging.getLogger()
 
     # Prevent duplicate handlers in case of multiple calls
@@ -43,51 +245,23 @@ def initLogging(logFile="app.log", level="debug"):
         "critical": logging.CRITICAL,
     }
     logger.setLevel(logMethods[level])
-    # Console handler (output to terminal)
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
 
-    # File handler (output to file)
-    file_handler = open(logFile, "a", buffering=1)
-    file_handler = logging.StreamHandler(file_handler)
-    file_handler.setFormatter(formatter)
+    # Terminal and file output share one ordered, buffered pipeline
+    tee = teeLogger(logFile, flushInterval, flushSize, compress, segmentSize)
+    tee_handler = logging.StreamHandler(tee)
+    tee_handler.setFormatter(formatter)
 
-    # Add handlers to the root logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Add handler to the root logger
+    logger.addHandler(tee_handler)
 
+    # Make sure queued output is written on exit, including sys.exit()
+    # from AbortOnFail and uncaught exceptions
+    atexit.register(tee.close)
+    excepthook = sys.excepthook
 
-    ansi_escape = re.compile(
-    rb'''
-    \x1B\[ [0-?]* [ -/]* [@-~]      |
-    \x1B\] .*? (?:\x07|\x1B\\)      |
-    \x1B[@-Z\\-_]                   |  
-    \r                                
-    ''',
-    re.VERBOSE,
-    )
-    # Tee logger to log both to terminal and file
-    class teeLogger:
-        def __init__(self, logFile):
-            self.terminal = sys.stdout.buffer
-            self.log = open(logFile, "ab")
-            self.buffer = self
-
-        def write(self, message):
-            if isinstance(message, str):
-                data = message.encode()
-            else:
-                data = message
-            clean_data = ansi_escape.sub(b'', data)
-            self.terminal.write(data)
-            self.terminal.flush()
-            self.log.write(clean_data)
-            self.log.flush()
-
-        def flush(self):
-            self.terminal.flush()
-            self.log.flush()
+    def flushingExcepthook(*exc_info):
+        tee.sync()
+        excepthook(*exc_info)
 
-        def close(self):
-            self.log.close()
-    sys.stdout= teeLogger(logFile)
\ No newline at end of file
+    sys.excepthook = flushingExcepthook
+    sys.stdout = tee
@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Distinct span names kept per category before the rest are grouped
+maxNames = 5000
+
+
+class timingTrace:
+    """
+    Wall-time instrumentation for steps, commands and connects.
+    Every span updates count/total/max per (category, name); the totals
+    feed the timing table of the summary. When a trace file is open each
+    span is also written as a Chrome trace event (phase "X"), one atomic
+    append per event so forked workers can share the file.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.fd = None
+        self.path = None
+
+    def open(self, path):
+        """Start writing trace events to path (JSON array format)."""
+        self.path = path
+        self.fd = os.open(
+            path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644
+        )
+        os.write(self.fd, b"[\n")
+
+    def add(self, cat, name, start, duration, tid=None, **args):
+        """
+        Record one finished span.
+        Args:
+            cat: Category ("step", "command", "expect", "connect", ...).
+            name: Span name, e.g. the command or "Setup STEP 2".
+            start: Epoch start time in seconds.
+            duration: Duration in seconds.
+            tid: Trace thread id, defaults to the current thread.
+            **args: Extra details shown in the trace viewer.
+        """
+        with self.lock:
+            catStats = self.stats.setdefault(cat, {})
+            key = name if name in catStats or len(catStats) < maxNames else "(other)"
+            entry = catStats.get(key)
+            if entry is None:
+                catStats[key] = [1, duration, duration]
+            else:
+                entry[0] += 1
+                entry[1] += duration
+                if duration > entry[2]:
+                    entry[2] = duration
+        if self.fd is None:
+            return
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id() if tid is None else tid,
+        }
+        if args:
+            event["args"] = args
+        try:
+            os.write(self.fd, (json.dumps(event, default=str) + ",\n").encode())
+        except OSError:
+            pass
+
+    @contextlib.contextmanager
+    def span(self, cat, name, **args):
+        """
+        Time the enclosed block.
+        The yielded dictionary can be filled with extra args on the way.
+        """
+        start = time.time()
+        began = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(cat, name, start, time.perf_counter() - began, **args)
+
+    def reset(self):
+        """Forget the collected totals (used by forked test workers)."""
+        with self.lock:
+            self.stats = {}
+
+    def merge(self, stats):
+        """Add the totals collected by a worker process."""
+        with self.lock:
+            for cat, catStats in stats.items():
+                mine = self.stats.setdefault(cat, {})
+                for name, (count, total, peak) in catStats.items():
+                    entry = mine.get(name)
+                    if entry is None:
+                        mine[name] = [count, total, peak]
+                    else:
+                        entry[0] += count
+                        entry[1] += total
+                        entry[2] = max(entry[2], peak)
+
+    def table(self, limit=25):
+        """
+        Return the slowest spans by total time.
+        Returns:
+            List of (category, name, count, total, average, max) tuples.
+        """
+        rows = [
+            (cat, name, count, total, total / count, peak)
+            for cat, catStats in self.stats.items()
+            for name, (count, total, peak) in catStats.items()
+        ]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def close(self):
+        """Finish the trace file with a process name event."""
+        if self.fd is None:
+            return
+        meta = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "args": {"name": "relex"},
+        }
+        os.write(self.fd, (json.dumps(meta) + "\n]\n").encode())
+        os.close(self.fd)
+        self.fd = None
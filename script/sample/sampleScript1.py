@@ -38,11 +38,11 @@ def Setup():
 def Test1():
     #STEP - Test Step 1
     print(param["vars"]["x"])
-    output = lib("func", "checkFile", vm1h, "bashrc")
+    output = lib("func", "checkFile", vm1h, ".bashrc")
     if output["result"] == "ok":
-        OK("File bashrc exists in vm1")
+        OK("File .bashrc exists in vm1")
     else:
-        FAIL("File bashrc does not exist in vm1")
+        FAIL("File .bashrc does not exist in vm1")
     OK("Test 1, step 1", "TestCase")
 
     #CLEAN - Test Clean 1